@@ -15,6 +15,7 @@ from jsonfield import JSONField
 from daiquiri.core.constants import ACCESS_LEVEL_CHOICES
 from daiquiri.core.managers import AccessLevelManager
 from daiquiri.core.adapter import DatabaseAdapter
+from daiquiri.core.generators import generate_zip
 from daiquiri.jobs.models import Job
 from daiquiri.jobs.managers import JobManager
 
@@ -127,9 +128,10 @@ class ArchiveJob(Job):
 
         elif 'search' in self.data:
             # retrieve the pathes of all file matching the search criteria
+            search_column_names = [column['name'] for column in settings.ARCHIVE_COLUMNS if column.get('searchable')] or None
             rows = adapter.fetch_rows(schema_name, table_name, page_size=0, search=self.data['search'], filters={
                 'collection': collections
-            })
+            }, search_column_names=search_column_names)
 
             # get the index of the path column in the row
             path_index = next((i for i, column in enumerate(settings.ARCHIVE_COLUMNS) if column['name'] == 'path'))
@@ -187,3 +189,6 @@ class ArchiveJob(Job):
             os.remove(self.file_path)
         except OSError:
             pass
+
+    def stream(self):
+        return generate_zip(settings.ARCHIVE_BASE_PATH, self.files)
@@ -1,8 +1,7 @@
 import logging
 import os
-import zipfile
+import uuid
 
-from django.conf import settings
 from django.utils.timezone import now
 
 from celery import shared_task
@@ -34,11 +33,28 @@ def create_archive_zip_file(archive_job_id):
     archive_job.start_time = now()
     archive_job.save()
 
-    # create a zipfile with all files
-    with zipfile.ZipFile(archive_job.file_path, 'w') as z:
-        for file_path in archive_job.files:
-            os.chdir(settings.ARCHIVE_BASE_PATH)
-            z.write(file_path)
+    # write the zip file into a temporary file first, so that the file appears only when it is complete
+    tmp_path = '%s.%s.tmp' % (archive_job.file_path, uuid.uuid4().hex)
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in archive_job.stream():
+                f.write(chunk)
+
+        os.replace(tmp_path, archive_job.file_path)
+
+    except Exception as e:
+        archive_job.phase = archive_job.PHASE_ERROR
+        archive_job.error_summary = str(e)
+        archive_job.end_time = now()
+        archive_job.save()
+        logger.info('archive_job %s failed (%s)' % (archive_job.id, archive_job.error_summary))
+
+        raise e
+
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
 
     archive_job.end_time = now()
     archive_job.phase = archive_job.PHASE_COMPLETED
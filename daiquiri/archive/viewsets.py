@@ -5,11 +5,13 @@ from collections import OrderedDict
 from sendfile import sendfile
 
 from django.conf import settings
+from django.http import FileResponse
 from django.utils.timezone import now
 
 from rest_framework import viewsets, serializers
 from rest_framework.response import Response
 from rest_framework.exceptions import NotFound
+from rest_framework.decorators import action
 
 from daiquiri.core.viewsets import RowViewSetMixin
 from daiquiri.core.adapter import DatabaseAdapter
@@ -26,7 +28,7 @@ class RowViewSet(RowViewSetMixin, viewsets.GenericViewSet):
 
     def list(self, request, *args, **kwargs):
         # get the row query params from the request
-        ordering, page, page_size, search, filters = self._get_query_params(settings.ARCHIVE_COLUMNS)
+        ordering, page, page_size, search, filters, cursor = self._get_query_params(settings.ARCHIVE_COLUMNS)
 
         # get database adapter
         adapter = DatabaseAdapter()
@@ -42,18 +44,22 @@ class RowViewSet(RowViewSetMixin, viewsets.GenericViewSet):
         # get the name of the columns
         column_names = [column['name'] for column in settings.ARCHIVE_COLUMNS]
 
+        # get the columns which are marked as searchable in the settings, or search all columns
+        search_column_names = [column['name'] for column in settings.ARCHIVE_COLUMNS if column.get('searchable')] or None
+
         # query the database for the total number of rows
-        count = adapter.count_rows(schema_name, table_name, column_names, search, filters)
+        count, estimated = adapter.fetch_count(schema_name, table_name, column_names, search, filters, search_column_names)
 
         # query the paginated rowset
-        results = adapter.fetch_rows(schema_name, table_name, column_names, ordering, page, page_size, search, filters)
+        results, cursors = adapter.fetch_page(schema_name, table_name, column_names, ordering, page, page_size, search, filters, search_column_names, cursor)
 
         # return ordered dict to be send as json
         return Response(OrderedDict((
             ('count', count),
+            ('estimated', estimated),
             ('results', results),
-            ('next', self._get_next_url(page, page_size, count)),
-            ('previous', self._get_previous_url(page))
+            ('next', self._get_next_url(page, page_size, count, cursors)),
+            ('previous', self._get_previous_url(page, cursors))
         )))
 
 
@@ -150,3 +156,17 @@ class ArchiveViewSet(viewsets.GenericViewSet):
         return Response({
             'id': archive_job.id
         })
+
+    @action(detail=False, methods=['post'])
+    def stream(self, request):
+        # stream the zip file while it is created, without storing the archive job
+        archive_job = ArchiveJob(
+            owner=(None if self.request.user.is_anonymous else self.request.user),
+            client_ip=get_client_ip(self.request),
+            data=request.data
+        )
+        archive_job.process()
+
+        response = FileResponse(archive_job.stream(), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="archive.zip"'
+        return response
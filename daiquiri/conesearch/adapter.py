@@ -1,3 +1,8 @@
+import io
+import uuid
+
+import numpy as np
+
 from django.conf import settings
 from django.http import FileResponse
 from django.utils.translation import gettext_lazy as _
@@ -8,6 +13,7 @@ from daiquiri.core.adapter import DatabaseAdapter
 from daiquiri.core.adapter.stream import BaseServiceAdapter
 from daiquiri.core.utils import import_class, make_query_dict_upper_case
 from daiquiri.core.generators import generate_votable
+from daiquiri.core.parsers import get_parser
 
 
 def ConeSearchAdapter():
@@ -60,12 +66,33 @@ class BaseConeSearchAdapter(BaseServiceAdapter):
 
     max_records = 10000
 
+    crossmatch_columns = [
+        {
+            'name': 'xmatch_row',
+            'ucd': 'meta.id;meta.number',
+            'datatype': 'long'
+        },
+        {
+            'name': 'xmatch_distance',
+            'ucd': 'pos.angDistance',
+            'unit': 'deg',
+            'datatype': 'double'
+        }
+    ]
+
     def get_resources(self):
         raise NotImplementedError()
 
     def clean(self, request, resource):
         raise NotImplementedError()
 
+    def clean_crossmatch(self, request, resource):
+        # the cross-match is only available for adapters with a resource in the metadata store
+        raise NotFound()
+
+    def crossmatch(self):
+        raise NotImplementedError()
+
     def clean_args(self, data, errors):
         # parse RA, DEC, and SR arguments
         self.args = {}
@@ -125,6 +152,27 @@ LIMIT %(limit)s
 class TableConeSearchAdapter(BaseConeSearchAdapter):
 
     def clean(self, request, resource):
+        data = make_query_dict_upper_case(request.GET)
+        errors = {}
+
+        schema_name, table_name = self.clean_table(request, resource, data, errors)
+
+        # construct sql query
+        adapter = DatabaseAdapter()
+        escaped_column_names = [adapter.escape_identifier(column['name']) for column in self.columns]
+        self.sql = self.sql_pattern % {
+            'schema': adapter.escape_identifier(schema_name),
+            'table': adapter.escape_identifier(table_name),
+            'columns': ', '.join(escaped_column_names)
+        }
+
+        # parse RA, DEC, and SR arguments
+        self.clean_args(data, errors)
+
+        if errors:
+            raise ValidationError(errors)
+
+    def clean_table(self, request, resource, data, errors):
         from daiquiri.metadata.models import Schema, Table
 
         resources = self.get_resources()
@@ -135,9 +183,6 @@ class TableConeSearchAdapter(BaseConeSearchAdapter):
         schema_name = resources[resource]['schema_name']
         table_name = resources[resource]['table_name']
 
-        data = make_query_dict_upper_case(request.GET)
-        errors = {}
-
         # check if the user is allowed to access the schema
         try:
             schema = Schema.objects.filter_by_access_level(request.user).get(name=schema_name)
@@ -162,31 +207,130 @@ class TableConeSearchAdapter(BaseConeSearchAdapter):
         else:
             errors['VERB'] = [_('This field must be 1, 2, or 3.')]
 
-        # construct sql query
-        adapter = DatabaseAdapter()
-        escaped_column_names = [adapter.escape_identifier(column['name']) for column in self.columns]
-        self.sql = self.sql_pattern % {
-            'schema': adapter.escape_identifier(schema_name),
-            'table': adapter.escape_identifier(table_name),
-            'columns': ', '.join(escaped_column_names)
-        }
+        return schema_name, table_name
 
-        # parse RA, DEC, and SR arguments
-        self.args = {}
-        for key in ['RA', 'DEC', 'SR']:
-            try:
-                value = float(data[key])
+    def clean_crossmatch(self, request, resource):
+        data = make_query_dict_upper_case(request.POST)
+        errors = {}
 
-                if self.ranges[key]['min'] <= value <= self.ranges[key]['max']:
-                    self.args[key] = value
-                else:
-                    errors[key] = [_('This value must be between %(min)g and %(max)g.' % self.ranges[key])]
+        schema_name, table_name = self.clean_table(request, resource, data, errors)
+        resource_config = self.get_resources()[resource]
 
-            except KeyError:
-                errors[key] = [_('This field may not be blank.')]
+        # parse the match radius
+        try:
+            radius = float(data['SR'])
 
-            except ValueError:
-                errors[key] = [_('This field must be a float.')]
+            if self.ranges['SR']['min'] < radius <= settings.CONESEARCH_CROSSMATCH_MAX_RADIUS:
+                self.args = {'SR': radius}
+            else:
+                errors['SR'] = [_('This value must be between %(min)g and %(max)g.') % {
+                    'min': self.ranges['SR']['min'],
+                    'max': settings.CONESEARCH_CROSSMATCH_MAX_RADIUS
+                }]
+
+        except KeyError:
+            errors['SR'] = [_('This field may not be blank.')]
+
+        except ValueError:
+            errors['SR'] = [_('This field must be a float.')]
+
+        mode = data.get('MODE', 'nearest').lower()
+        if mode not in ['nearest', 'all']:
+            errors['MODE'] = [_('This field must be nearest or all.')]
+
+        # the positions can be uploaded as CSV, VOTable or FITS
+        try:
+            self.parser = get_parser(io.BufferedReader(request.FILES['UPLOAD']))
+            self.upload_columns = self.get_upload_columns(data, errors)
+        except KeyError:
+            errors['UPLOAD'] = [_('This field may not be blank.')]
+        except ValueError as e:
+            errors['UPLOAD'] = [_('The file could not be parsed (%s).') % e]
 
         if errors:
             raise ValidationError(errors)
+
+        self.upload_schema_name = settings.CONESEARCH_CROSSMATCH_SCHEMA or settings.TAP_UPLOAD
+        self.upload_table_name = 'crossmatch_%s' % uuid.uuid4().hex
+
+        self.sql = DatabaseAdapter().build_crossmatch_query(
+            schema_name, table_name, [column['name'] for column in self.columns],
+            resource_config.get('ra_column_name', 'ra'), resource_config.get('dec_column_name', 'dec'),
+            self.upload_schema_name, self.upload_table_name,
+            nearest=(mode == 'nearest'),
+            max_records=settings.CONESEARCH_CROSSMATCH_MAX_RECORDS,
+            options=resource_config
+        )
+
+        self.columns = [self.crossmatch_columns[0]] + list(self.columns) + [self.crossmatch_columns[1]]
+
+    def get_upload_columns(self, data, errors):
+        # the indexes of the ra and dec columns of the uploaded table, either given by name
+        # or found by their name or ucd
+        upload_columns = []
+        for key, names, ucd in [('RA_COLUMN', ('ra', 'raj2000', 'ra_deg'), 'pos.eq.ra'),
+                                ('DEC_COLUMN', ('dec', 'de', 'dej2000', 'dec_deg'), 'pos.eq.dec')]:
+            for i, field in enumerate(self.parser.fields):
+                if data.get(key):
+                    if field['name'] == data.get(key):
+                        break
+                elif field['name'].lower() in names or (field.get('ucd') or '').startswith(ucd):
+                    break
+            else:
+                errors[key] = [_('The column could not be found in the uploaded table.')]
+                continue
+
+            if self.parser.fields[i]['datatype'] not in ['short', 'int', 'long', 'float', 'double']:
+                errors[key] = [_('The column needs to be numeric.')]
+
+            upload_columns.append(i)
+
+        return upload_columns
+
+    def generate_upload_batches(self):
+        # only the row number and the position of the uploaded rows are loaded into the database
+        row_id = 0
+        for rows, mask in self.parser:
+            if row_id + len(rows) > settings.CONESEARCH_CROSSMATCH_MAX_POSITIONS:
+                raise ValidationError({
+                    'UPLOAD': [_('The uploaded table can contain at most %d rows.') % settings.CONESEARCH_CROSSMATCH_MAX_POSITIONS]
+                })
+
+            batch = np.zeros(len(rows), dtype=[('row_id', 'i8'), ('ra', 'f8'), ('dec', 'f8')])
+            batch_mask = np.zeros(len(rows), dtype=[('row_id', '?'), ('ra', '?'), ('dec', '?')])
+
+            batch['row_id'] = np.arange(row_id, row_id + len(rows))
+            for name, i in zip(['ra', 'dec'], self.upload_columns):
+                batch[name] = rows['column_%i' % i]
+                batch_mask[name] = mask['column_%i' % i]
+
+            row_id += len(rows)
+            yield batch, batch_mask
+
+    def crossmatch(self):
+        adapter = DatabaseAdapter()
+
+        upload_columns = [
+            {'name': 'row_id', 'datatype': 'long'},
+            {'name': 'ra', 'datatype': 'double'},
+            {'name': 'dec', 'datatype': 'double'}
+        ]
+
+        # load the positions into a table, the table is removed again after the matches were streamed
+        adapter.create_table(self.upload_schema_name, self.upload_table_name, upload_columns)
+        try:
+            adapter.copy_batches(self.upload_schema_name, self.upload_table_name, upload_columns, self.generate_upload_batches())
+        except Exception:
+            adapter.drop_table(self.upload_schema_name, self.upload_table_name)
+            raise
+
+        # the matches are fetched in batches, so that they are not kept in memory
+        matches = adapter.fetchiter(self.sql, self.args)
+        response = FileResponse(generate_votable(matches, self.columns), content_type='application/xml')
+
+        # the server closes the response even if the matches were not (completely) streamed,
+        # this closes the cursor and its transaction, and removes the table
+        response._resource_closers.append(matches.close)
+        response._resource_closers.append(lambda: adapter.drop_table(self.upload_schema_name, self.upload_table_name))
+
+        return response
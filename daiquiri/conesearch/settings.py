@@ -6,4 +6,10 @@ CONESEARCH_ANONYMOUS = False
 CONESEARCH_SCHEMA = env.get('CONESEARCH_SCHEMA')
 CONESEARCH_TABLE = env.get('CONESEARCH_TABLE')
 
+# the uploaded positions are loaded into a temporary table in this schema, TAP_UPLOAD if not set
+CONESEARCH_CROSSMATCH_SCHEMA = env.get('CONESEARCH_CROSSMATCH_SCHEMA')
+CONESEARCH_CROSSMATCH_MAX_POSITIONS = 100000
+CONESEARCH_CROSSMATCH_MAX_RECORDS = 100000
+CONESEARCH_CROSSMATCH_MAX_RADIUS = 0.1
+
 CONESEARCH_SUBJECTS = ['cone search']
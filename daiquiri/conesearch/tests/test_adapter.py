@@ -0,0 +1,81 @@
+import io
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from rest_framework.exceptions import ValidationError
+
+from daiquiri.core.parsers import CSVParser
+
+from ..adapter import TableConeSearchAdapter
+
+
+class CrossMatchAdapterTestCase(SimpleTestCase):
+
+    def get_upload_columns(self, fields, data={}):
+        adapter = TableConeSearchAdapter()
+        adapter.parser = mock.Mock(fields=fields)
+
+        errors = {}
+        upload_columns = adapter.get_upload_columns(data, errors)
+        return upload_columns, errors
+
+    def test_get_upload_columns_name(self):
+        upload_columns, errors = self.get_upload_columns([
+            {'name': 'ID', 'datatype': 'long'},
+            {'name': 'RAJ2000', 'datatype': 'double'},
+            {'name': 'DEJ2000', 'datatype': 'double'}
+        ])
+        self.assertEqual(upload_columns, [1, 2])
+        self.assertEqual(errors, {})
+
+    def test_get_upload_columns_ucd(self):
+        upload_columns, errors = self.get_upload_columns([
+            {'name': 'alpha', 'ucd': 'pos.eq.ra;meta.main', 'datatype': 'double'},
+            {'name': 'delta', 'ucd': 'pos.eq.dec;meta.main', 'datatype': 'float'}
+        ])
+        self.assertEqual(upload_columns, [0, 1])
+        self.assertEqual(errors, {})
+
+    def test_get_upload_columns_given(self):
+        # the given names take precedence over the detection
+        upload_columns, errors = self.get_upload_columns([
+            {'name': 'ra', 'datatype': 'double'},
+            {'name': 'dec', 'datatype': 'double'},
+            {'name': 'ra_2', 'datatype': 'double'},
+            {'name': 'dec_2', 'datatype': 'double'}
+        ], {'RA_COLUMN': 'ra_2', 'DEC_COLUMN': 'dec_2'})
+        self.assertEqual(upload_columns, [2, 3])
+        self.assertEqual(errors, {})
+
+    def test_get_upload_columns_errors(self):
+        upload_columns, errors = self.get_upload_columns([
+            {'name': 'ra', 'datatype': 'char'},
+            {'name': 'name', 'datatype': 'char'}
+        ])
+        self.assertEqual(set(errors), {'RA_COLUMN', 'DEC_COLUMN'})
+        self.assertIn('numeric', str(errors['RA_COLUMN'][0]))
+        self.assertIn('could not be found', str(errors['DEC_COLUMN'][0]))
+
+    def test_generate_upload_batches(self):
+        adapter = TableConeSearchAdapter()
+        adapter.parser = CSVParser(io.BufferedReader(io.BytesIO(b'id,ra,dec\n1,10.5,-20\n2,11,\n3,12,22\n')), batch_size=2)
+        adapter.upload_columns = [1, 2]
+
+        batches = list(adapter.generate_upload_batches())
+        self.assertEqual(len(batches), 2)
+
+        batch, mask = batches[0]
+        self.assertEqual(batch['row_id'].tolist(), [0, 1])
+        self.assertEqual(batch['ra'].tolist(), [10.5, 11.0])
+        self.assertEqual(mask['dec'].tolist(), [False, True])
+        self.assertEqual(batches[1][0]['row_id'].tolist(), [2])
+
+    @override_settings(CONESEARCH_CROSSMATCH_MAX_POSITIONS=2)
+    def test_generate_upload_batches_max_positions(self):
+        adapter = TableConeSearchAdapter()
+        adapter.parser = CSVParser(io.BufferedReader(io.BytesIO(b'ra,dec\n1,2\n3,4\n5,6\n')), batch_size=2)
+        adapter.upload_columns = [0, 1]
+
+        with self.assertRaises(ValidationError):
+            list(adapter.generate_upload_batches())
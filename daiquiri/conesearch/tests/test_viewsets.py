@@ -0,0 +1,108 @@
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from daiquiri.core.constants import ACCESS_LEVEL_PUBLIC
+from daiquiri.metadata.models import Schema, Table
+from daiquiri.stats.models import Record
+
+from ..adapter import TableConeSearchAdapter
+
+
+class StarsConeSearchAdapter(TableConeSearchAdapter):
+
+    def get_resources(self):
+        return {
+            'stars': {
+                'schema_name': 'daiquiri_data_obs',
+                'table_name': 'stars',
+                'column_names': ['id', 'ra', 'dec']
+            }
+        }
+
+
+@override_settings(
+    CONESEARCH_ANONYMOUS=True,
+    CONESEARCH_ADAPTER='daiquiri.conesearch.tests.test_viewsets.StarsConeSearchAdapter',
+    CONESEARCH_CROSSMATCH_MAX_RADIUS=0.1
+)
+class CrossMatchViewTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+        'metadata.json'
+    )
+
+    def setUp(self):
+        Schema.objects.filter(name='daiquiri_data_obs').update(access_level=ACCESS_LEVEL_PUBLIC)
+        Table.objects.filter(schema__name='daiquiri_data_obs', name='stars').update(access_level=ACCESS_LEVEL_PUBLIC)
+
+    def post(self, resource='stars', upload=b'ra,dec\n10,20\n11,21\n12,22\n', **data):
+        if upload is not None:
+            data['UPLOAD'] = SimpleUploadedFile('upload.csv', upload, content_type='text/csv')
+
+        return self.client.post(reverse('conesearch:crossmatch', args=[resource]), data)
+
+    def test_resource_not_found(self):
+        self.assertEqual(self.post('galaxies', SR=0.01).status_code, 404)
+
+    def test_missing_fields(self):
+        response = self.post(upload=None)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'SR', response.content)
+        self.assertIn(b'UPLOAD', response.content)
+
+    def test_invalid_fields(self):
+        self.assertEqual(self.post(SR='a').status_code, 400)
+        self.assertEqual(self.post(SR=1).status_code, 400)
+        self.assertEqual(self.post(SR=0.01, MODE='first').status_code, 400)
+        self.assertEqual(self.post(SR=0.01, upload=b'alpha,delta\n10,20\n').status_code, 400)
+        self.assertEqual(self.post(SR=0.01, upload=b'ra,dec\na,b\n').status_code, 400)
+
+    @override_settings(CONESEARCH_CROSSMATCH_MAX_POSITIONS=2)
+    @mock.patch('daiquiri.conesearch.adapter.DatabaseAdapter')
+    def test_max_positions(self, adapter):
+        adapter.return_value.copy_batches.side_effect = lambda schema_name, table_name, columns, batches: list(batches)
+
+        # the upload is rejected, the table is removed and no stats record is created
+        response = self.post(SR=0.01)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b'UPLOAD', response.content)
+
+        adapter.return_value.drop_table.assert_called_once()
+        self.assertFalse(Record.objects.filter(resource_type='CONESEARCH').exists())
+
+    @override_settings(CONESEARCH_CROSSMATCH_SCHEMA=None, TAP_UPLOAD='tap_upload_test')
+    @mock.patch('daiquiri.conesearch.adapter.DatabaseAdapter')
+    def test_crossmatch(self, adapter):
+        adapter.return_value.copy_batches.side_effect = lambda schema_name, table_name, columns, batches: list(batches)
+        adapter.return_value.fetchiter.return_value = (row for row in [])
+
+        response = self.post(SR=0.01)
+        self.assertEqual(response.status_code, 200)
+
+        # the upload table is created in TAP_UPLOAD and removed after the matches were streamed
+        self.assertEqual(adapter.return_value.create_table.call_args.args[0], 'tap_upload_test')
+        adapter.return_value.drop_table.assert_not_called()
+
+        b''.join(response.streaming_content)
+        adapter.return_value.drop_table.assert_called_once()
+
+        self.assertTrue(Record.objects.filter(resource_type='CONESEARCH').exists())
+
+    @override_settings(CONESEARCH_CROSSMATCH_SCHEMA=None, TAP_UPLOAD='tap_upload_test')
+    @mock.patch('daiquiri.conesearch.adapter.DatabaseAdapter')
+    def test_crossmatch_closed(self, adapter):
+        adapter.return_value.copy_batches.side_effect = lambda schema_name, table_name, columns, batches: list(batches)
+        adapter.return_value.fetchiter.return_value = (row for row in [])
+
+        response = self.post(SR=0.01)
+        self.assertEqual(response.status_code, 200)
+
+        # the table is removed when the response is closed, even if the matches were never streamed
+        response.close()
+        adapter.return_value.drop_table.assert_called_once_with('tap_upload_test', mock.ANY)
@@ -2,7 +2,7 @@ from django.urls import path, re_path
 from django.views.generic import TemplateView
 
 from .views import resource, availability, capabilities
-from .viewsets import ConeSearchView
+from .viewsets import ConeSearchView, CrossMatchView
 
 
 app_name = 'conesearch'
@@ -12,5 +12,6 @@ urlpatterns = [
     path('resource', resource, name='resource'),
     path('availability', availability, name='availability'),
     path('capabilities', capabilities, name='capabilities'),
+    re_path(r'^api/(?P<resource>.+)/crossmatch/$', CrossMatchView.as_view(), name='crossmatch'),
     re_path(r'^api/(?P<resource>.+)/$', ConeSearchView.as_view(), name='search'),
 ]
@@ -3,6 +3,7 @@ from django.utils.timezone import now
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.renderers import JSONRenderer
+from rest_framework.parsers import MultiPartParser
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 
 from daiquiri.core.utils import get_client_ip
@@ -39,3 +40,36 @@ class ConeSearchView(APIView):
         else:
             # send an empty response
             return Response()
+
+
+class CrossMatchView(APIView):
+
+    permission_classes = (HasPermission, )
+    authentication_classes = (SessionAuthentication, TokenAuthentication)
+    renderer_classes = (ConeSearchErrorRenderer, JSONRenderer)
+    parser_classes = (MultiPartParser, )
+
+    def post(self, request, resource=None):
+
+        adapter = ConeSearchAdapter()
+        adapter.clean_crossmatch(request, resource)
+
+        # join the uploaded positions with the table and stream the matches,
+        # this fails if the uploaded table has too many rows
+        response = adapter.crossmatch()
+
+        # create a stats record for this cross-match, if this fails, the response is closed
+        # right away, which removes the table with the uploaded positions
+        try:
+            Record.objects.create(
+                time=now(),
+                resource_type='CONESEARCH',
+                resource=dict(adapter.args, crossmatch=resource),
+                client_ip=get_client_ip(request),
+                user=request.user if request.user.is_authenticated else None
+            )
+        except Exception:
+            response.close()
+            raise
+
+        return response
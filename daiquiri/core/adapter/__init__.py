@@ -1,11 +1,19 @@
+from functools import lru_cache
+
 from django.conf import settings
 
 from daiquiri.core.utils import import_class
 
 
 def DatabaseAdapter():
-    return import_class(settings.ADAPTER_DATABASE)('data', settings.DATABASES['data'])
+    return get_adapter_class(settings.ADAPTER_DATABASE)('data', settings.DATABASES['data'])
 
 
 def DownloadAdapter():
-    return import_class(settings.ADAPTER_DOWNLOAD)('data', settings.DATABASES['data'])
+    return get_adapter_class(settings.ADAPTER_DOWNLOAD)('data', settings.DATABASES['data'])
+
+
+@lru_cache(maxsize=None)
+def get_adapter_class(class_name):
+    # the adapter classes are only resolved once per process
+    return import_class(class_name)
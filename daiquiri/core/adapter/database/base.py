@@ -1,19 +1,89 @@
+import hashlib
+import json
 import logging
+import os
 import warnings
+from collections import Counter
 
-from django.db import connections
+import numpy as np
+from celery.signals import task_prerun
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
 
 logger = logging.getLogger(__name__)
 
+# process-local statistics about the connections used by the adapters, keyed by database_key
+connection_stats = {}
+
+
+def count_connection_created(sender, connection, **kwargs):
+    if connection.alias in connection_stats:
+        connection_stats[connection.alias]['created'] += 1
+
+
+def request_health_check(**kwargs):
+    # the connections of the adapters are checked once, when they are first used in a request or task
+    for database_key in connection_stats:
+        connections[database_key].health_check_needed = True
+
+
+connection_created.connect(count_connection_created, dispatch_uid='daiquiri.core.adapter.database.count_connection_created')
+request_started.connect(request_health_check, dispatch_uid='daiquiri.core.adapter.database.request_health_check')
+task_prerun.connect(request_health_check, dispatch_uid='daiquiri.core.adapter.database.request_health_check')
+
 
 class BaseDatabaseAdapter(object):
 
+    # the number of rows which are copied into the database at once
+    copy_chunk_size = 10000
+
+    # the parts of the catalog of a table which are cached, see get_table_catalog
+    table_catalog_names = ('unique_columns', 'columns')
+
     def __init__(self, database_key, database_config):
         self.database_key = database_key
         self.database_config = database_config
 
+        connection_stats.setdefault(database_key, Counter())
+
     def connection(self):
-        return connections[self.database_key]
+        # the connection is kept open between requests and tasks (CONN_MAX_AGE), so check if
+        # it is still usable before it is reused, but only once per request or task
+        connection = connections[self.database_key]
+        stats = connection_stats[self.database_key]
+
+        if getattr(connection, 'health_check_needed', False) and not connection.in_atomic_block:
+            connection.health_check_needed = False
+
+            if connection.connection is not None and not connection.is_usable():
+                logger.info('closing unusable connection to "%s"', self.database_key)
+                connection.close()
+                stats['unusable'] += 1
+
+        if connection.connection is not None:
+            stats['reused'] += 1
+
+        return connection
+
+    def fetch_connection_stats(self):
+        # returns the statistics for the connections of this process
+        return dict(connection_stats[self.database_key], **{
+            'pid': os.getpid(),
+            'max_age': self.database_config.get('CONN_MAX_AGE', 0)
+        })
+
+    def reset_session(self):
+        # reset the session settings (e.g. timeouts) after a query, so that they do not
+        # apply to the next query which uses the same connection
+        pass
+
+    def set_idle_timeout(self, timeout):
+        # end the current transaction if the client does not send a command for timeout seconds,
+        # e.g. while the rows of a server-side cursor are streamed to a slow client
+        pass
 
     def execute(self, sql):
         return self.connection().cursor().execute(sql)
@@ -53,6 +123,31 @@ class BaseDatabaseAdapter(object):
         else:
             return cursor.fetchall()
 
+    def fetchiter(self, sql, args=None, fetch_size=10000):
+        # the rows are fetched in batches from a server-side cursor, which lives in a transaction
+        with transaction.atomic(using=self.database_key):
+            self.set_idle_timeout(settings.DATABASE_STREAM_IDLE_TIMEOUT)
+
+            cursor = self.get_server_side_cursor()
+            try:
+                if args:
+                    cursor.execute(sql, args)
+                else:
+                    cursor.execute(sql)
+
+                while True:
+                    rows = cursor.fetchmany(fetch_size)
+                    if not rows:
+                        break
+
+                    yield from rows
+            finally:
+                cursor.close()
+
+    def get_server_side_cursor(self):
+        # for PostgreSQL, django creates a named cursor
+        return self.connection().chunked_cursor()
+
     def fetch_pid(self):
         raise NotImplementedError()
 
@@ -68,19 +163,46 @@ class BaseDatabaseAdapter(object):
     def build_sync_query(self, query, timeout, max_records):
         raise NotImplementedError()
 
+    def build_copy_query(self, schema_name, table_name, source_schema_name, source_table_name, timeout):
+        # copy an existing table, e.g. the result of an identical query
+        query = 'SELECT * FROM %(schema)s.%(table)s' % {
+            'schema': self.escape_identifier(source_schema_name),
+            'table': self.escape_identifier(source_table_name)
+        }
+
+        return self.build_query(schema_name, table_name, query, timeout, None)
+
     def submit_query(self, sql):
-        self.execute(sql)
+        try:
+            self.execute(sql)
+        finally:
+            self.reset_session()
 
     def abort_query(self, pid):
         raise NotImplementedError()
 
-    def count_rows(self, schema_name, table_name, column_names=None, search=None, filters=None):
+    def fetch_estimate(self, query):
+        # returns the number of rows and the cost estimated by the query planner for a query, or None
+        return None
+
+    def build_crossmatch_query(self, schema_name, table_name, column_names, ra_column_name, dec_column_name,
+                               upload_schema_name, upload_table_name, nearest=False, max_records=None, options={}):
+        # the query joins the positions in the upload table (row_id, ra, dec) with the table,
+        # the match radius in degrees is passed as %(SR)s
+        raise NotImplementedError()
+
+    def fetch_progress(self, pid):
+        # returns what the database reports about the query running in the process pid,
+        # e.g. the state, the rows processed so far, and the size of the temporary files
+        return {}
+
+    def count_rows(self, schema_name, table_name, column_names=None, search=None, filters=None, search_column_names=None):
         # if no column names are provided get all column_names from the table
         if not column_names:
             column_names= self.fetch_column_names(schema_name, table_name)
 
-        # create a list of escaped columns
-        escaped_column_names = [self.escape_identifier(column_name) for column_name in column_names]
+        # get the columns which are used for the search
+        search_columns = self.get_search_columns(schema_name, table_name, column_names, search, search_column_names)
 
         # prepare sql string
         sql = 'SELECT COUNT(*) FROM %(schema)s.%(table)s' % {
@@ -90,11 +212,54 @@ class BaseDatabaseAdapter(object):
         sql_args = []
 
         # process filtering
-        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, escaped_column_names)
+        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, search_columns)
 
         return self.fetchone(sql, args=sql_args)[0]
 
-    def fetch_rows(self, schema_name, table_name, column_names=None, ordering=None, page=1, page_size=10, search=None, filters=None):
+    def fetch_count(self, schema_name, table_name, column_names=None, search=None, filters=None, search_column_names=None, nrows=None):
+        # returns the number of rows and if the number is estimated, nrows is the known
+        # exact number of rows of the table (e.g. QueryJob.nrows)
+        if not search and not filters and nrows is not None:
+            return nrows, False
+
+        # if no column names are provided get all column_names from the table
+        if not column_names:
+            column_names = self.fetch_column_names(schema_name, table_name)
+
+        cache_key = self.get_count_cache_key(schema_name, table_name, column_names, search, filters, search_column_names)
+        count = cache.get(cache_key)
+        if count is not None:
+            return count, False
+
+        # small tables are always counted exactly
+        table_nrows = nrows if nrows is not None else self.fetch_nrows(schema_name, table_name)
+        if table_nrows is not None and table_nrows >= settings.COUNT_ROWS_EXACT_LIMIT:
+            if search or filters:
+                estimate = self.estimate_rows(schema_name, table_name, column_names, search, filters, search_column_names)
+            else:
+                estimate = table_nrows
+
+            if estimate is not None:
+                # count the rows exactly in the background, so that the next request can use the cache
+                if settings.ASYNC and cache.add(cache_key + '.pending', True, settings.COUNT_ROWS_CACHE_TIMEOUT):
+                    from daiquiri.core.tasks import count_rows
+                    count_rows.apply_async((schema_name, table_name, column_names, search, filters, search_column_names))
+
+                return estimate, True
+
+        count = self.count_rows(schema_name, table_name, column_names, search, filters, search_column_names)
+        cache.set(cache_key, count, settings.COUNT_ROWS_CACHE_TIMEOUT)
+        return count, False
+
+    def estimate_rows(self, schema_name, table_name, column_names=None, search=None, filters=None, search_column_names=None):
+        # returns the number of rows estimated by the query planner, or None
+        return None
+
+    def get_count_cache_key(self, schema_name, table_name, column_names, search, filters, search_column_names=None):
+        key = json.dumps([self.database_key, schema_name, table_name, column_names, search, filters, search_column_names], sort_keys=True)
+        return 'daiquiri.count_rows.' + hashlib.sha256(key.encode()).hexdigest()
+
+    def fetch_rows(self, schema_name, table_name, column_names=None, ordering=None, page=1, page_size=10, search=None, filters=None, search_column_names=None):
 
         # if no column names are provided get all column_names from the table
         if not column_names:
@@ -103,6 +268,9 @@ class BaseDatabaseAdapter(object):
         # create a list of escaped columns
         escaped_column_names = [self.escape_identifier(column_name) for column_name in column_names]
 
+        # get the columns which are used for the search
+        search_columns = self.get_search_columns(schema_name, table_name, column_names, search, search_column_names)
+
         # init sql string and sql_args list
         sql = 'SELECT %(columns)s FROM %(schema)s.%(table)s' % {
             'schema': self.escape_identifier(schema_name),
@@ -112,7 +280,7 @@ class BaseDatabaseAdapter(object):
         sql_args = []
 
         # process filtering
-        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, escaped_column_names)
+        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, search_columns)
 
         # process ordering
         sql = self._process_ordering(sql, ordering, escaped_column_names)
@@ -126,6 +294,140 @@ class BaseDatabaseAdapter(object):
 
         return self.fetchall(sql, args=sql_args)
 
+    def fetch_page(self, schema_name, table_name, column_names=None, ordering=None, page=1, page_size=10, search=None, filters=None, search_column_names=None, cursor=None):
+        # if no column names are provided get all column_names from the table
+        if not column_names:
+            column_names = self.fetch_column_names(schema_name, table_name)
+
+        # get the key column for keyset pagination, fall back to LIMIT/OFFSET if there is none
+        keyset = self.get_keyset(schema_name, table_name, column_names, ordering) if page_size > 0 else None
+        if keyset is None:
+            return self.fetch_rows(schema_name, table_name, column_names, ordering, page, page_size, search, filters, search_column_names), None
+
+        key_column_name, descending = keyset
+        key_index = column_names.index(key_column_name)
+
+        # ignore cursors which do not match the current ordering
+        if cursor and (cursor.get('ordering') != ordering or len(cursor.get('values', [])) != 1):
+            cursor = None
+
+        if cursor:
+            # a previous page is fetched in reverse order and reversed afterwards
+            reverse = bool(cursor.get('reverse'))
+            rows = self.fetch_keyset_rows(schema_name, table_name, column_names, key_column_name, descending != reverse,
+                                          cursor['values'][0], page_size + 1, search, filters, search_column_names)
+
+            # one more row was fetched to check if there is another page
+            more = len(rows) > page_size
+            rows = rows[:page_size]
+
+            if reverse:
+                rows.reverse()
+        else:
+            # without a cursor, the page is fetched with LIMIT/OFFSET, ordered by the key column
+            reverse = False
+            rows = list(self.fetch_rows(schema_name, table_name, column_names, ('-' if descending else '') + key_column_name,
+                                        page, page_size, search, filters, search_column_names))
+            more = len(rows) == page_size
+
+        # create the cursors for the next and the previous page from the first and the last row
+        cursors = {
+            'next': None,
+            'previous': None
+        }
+
+        if rows:
+            if more or reverse:
+                cursors['next'] = {
+                    'ordering': ordering,
+                    'values': [rows[-1][key_index]],
+                    'reverse': False
+                }
+
+            if (more and reverse) or (not reverse and (cursor or int(page) > 1)):
+                cursors['previous'] = {
+                    'ordering': ordering,
+                    'values': [rows[0][key_index]],
+                    'reverse': True
+                }
+
+        return rows, cursors
+
+    def fetch_keyset_rows(self, schema_name, table_name, column_names, key_column_name, descending, key_value, limit, search=None, filters=None, search_column_names=None):
+        # get the columns which are used for the search
+        search_columns = self.get_search_columns(schema_name, table_name, column_names, search, search_column_names)
+
+        # init sql string and sql_args list
+        sql = 'SELECT %(columns)s FROM %(schema)s.%(table)s' % {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'columns': ', '.join([self.escape_identifier(column_name) for column_name in column_names])
+        }
+
+        # get the WHERE statements for the search and the filters, and seek to the row after (or before) the cursor
+        where_stmts, sql_args = self._get_where_stmts(search, filters, search_columns)
+        where_stmts.append('%(column)s %(operator)s %%s' % {
+            'column': self.escape_identifier(key_column_name),
+            'operator': '<' if descending else '>'
+        })
+        sql_args.append(key_value)
+
+        # the rows are read from the unique index of the key column
+        sql += ' WHERE %(where)s ORDER BY %(column)s %(direction)s LIMIT %(limit)s' % {
+            'where': ' AND '.join(where_stmts),
+            'column': self.escape_identifier(key_column_name),
+            'direction': 'DESC' if descending else 'ASC',
+            'limit': int(limit)
+        }
+
+        return list(self.fetchall(sql, args=sql_args))
+
+    def get_keyset(self, schema_name, table_name, column_names, ordering=None):
+        # keyset pagination is only used if the rows are ordered by a NOT NULL column with a unique index,
+        # any other ordering (e.g. with a tie-breaking key, or by a row id like ctid) sorts the whole table
+        unique_column_names = self.get_table_catalog('unique_columns', schema_name, table_name, self.fetch_unique_columns)
+        if unique_column_names is None:
+            return None
+
+        if ordering and ordering.startswith('-'):
+            ordering_column_name, descending = ordering[1:], True
+        else:
+            ordering_column_name, descending = ordering, False
+
+        if ordering_column_name not in column_names:
+            # the ordering is ignored, like in _process_ordering, the first unique column is used instead
+            return next(((column_name, False) for column_name in unique_column_names if column_name in column_names), None)
+        elif ordering_column_name in unique_column_names:
+            return ordering_column_name, descending
+        else:
+            return None
+
+    def fetch_unique_columns(self, schema_name, table_name):
+        # returns the NOT NULL columns with a unique index on their own, which can be used for keyset pagination,
+        # or None if they could not be fetched
+        return []
+
+    def get_table_catalog(self, name, schema_name, table_name, fetch):
+        # the catalog queries for a table (keys, indexes) are needed for every page or search,
+        # so their results are cached, None (e.g. for a missing table) is not cached
+        cache_key = self.get_table_catalog_cache_key(name, schema_name, table_name)
+
+        value = cache.get(cache_key)
+        if value is None:
+            value = fetch(schema_name, table_name)
+            if value is not None:
+                cache.set(cache_key, value, settings.TABLE_CATALOG_CACHE_TIMEOUT)
+
+        return value
+
+    def get_table_catalog_cache_key(self, name, schema_name, table_name):
+        key = json.dumps([self.database_key, schema_name, table_name])
+        return 'daiquiri.table_catalog.%s.%s' % (name, hashlib.sha256(key.encode()).hexdigest())
+
+    def invalidate_table_catalog(self, schema_name, table_name):
+        cache.delete_many([self.get_table_catalog_cache_key(name, schema_name, table_name)
+                           for name in self.table_catalog_names])
+
     def fetch_row(self, schema_name, table_name, column_names=None, search=None, filters=None):
 
         # if no column names are provided get all column_names from the table
@@ -135,6 +437,9 @@ class BaseDatabaseAdapter(object):
         # create a list of escaped columns
         escaped_column_names = [self.escape_identifier(column_name) for column_name in column_names]
 
+        # get the columns which are used for the search
+        search_columns = self.get_search_columns(schema_name, table_name, column_names, search)
+
         # prepare sql string
         sql = 'SELECT %(columns)s FROM %(schema)s.%(table)s' % {
             'schema': self.escape_identifier(schema_name),
@@ -144,7 +449,7 @@ class BaseDatabaseAdapter(object):
         sql_args = []
 
         # process filtering
-        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, escaped_column_names)
+        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, search_columns)
 
         return self.fetchone(sql, args=sql_args)
 
@@ -215,6 +520,7 @@ class BaseDatabaseAdapter(object):
         # log sql string and execute
         logger.debug('sql = "%s"', sql)
         self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
 
     def rename_table(self, schema_name, table_name, new_table_name):
         raise NotImplementedError()
@@ -228,6 +534,18 @@ class BaseDatabaseAdapter(object):
         # log sql string and execute
         logger.debug('sql = "%s"', sql)
         self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+
+    def create_search_index(self, schema_name, table_name, column_name):
+        raise NotImplementedError()
+
+    def drop_search_index(self, schema_name, table_name, column_name):
+        raise NotImplementedError()
+
+    def get_search_index_name(self, schema_name, table_name, column_name):
+        # index names are limited to 63 (postgres) or 64 (mysql) characters, so a hash is used
+        digest = hashlib.sha256(('%s.%s.%s' % (schema_name, table_name, column_name)).encode()).hexdigest()
+        return 'daiquiri_search_%s' % digest[:16]
 
     def insert_rows(self, schema_name, table_name, columns, rows, mask=None):
         # create a list of escaped columns
@@ -267,23 +585,96 @@ class BaseDatabaseAdapter(object):
         logger.debug('sql = "%s"', sql)
         self.execute(sql)
 
-    def _process_filtering(self, sql, sql_args, search, filters, escaped_column_names):
+    def copy_rows(self, schema_name, table_name, columns, rows, mask=None):
+        self.copy_batches(schema_name, table_name, columns, self.generate_batches(rows, mask))
+
+    def copy_batches(self, schema_name, table_name, columns, batches):
+        # the generic fallback inserts the batches one by one, the database adapters
+        # override this method to use COPY or LOAD DATA
+        with transaction.atomic(using=self.database_key):
+            for rows, mask in batches:
+                self.insert_rows(schema_name, table_name, columns, rows, mask)
+
+    def generate_batches(self, rows, mask=None):
+        # split the (masked) numpy array into batches of copy_chunk_size rows
+        if mask is np.ma.nomask:
+            mask = None
+
+        for start in range(0, len(rows), self.copy_chunk_size):
+            stop = start + self.copy_chunk_size
+            yield rows[start:stop], None if mask is None else mask[start:stop]
+
+    def generate_copy_chunks(self, batches, null=''):
+        # encode every batch as csv, column by column
+        for rows, mask in batches:
+            cells = []
+            for name in rows.dtype.names:
+                values = rows[name]
+                if isinstance(values, np.ma.MaskedArray):
+                    values = values.data
+
+                cells.append(self._encode_copy_column(values, None if mask is None else mask[name], null))
+
+            yield ''.join(','.join(row) + '\n' for row in zip(*cells))
+
+    def _encode_copy_column(self, values, mask=None, null=''):
+        kind = values.dtype.kind
+
+        if kind == 'b':
+            # booleans are converted to 1 or 0, which is understood by all databases
+            cells = ['1' if value else '0' for value in values.tolist()]
+        elif kind in 'iu':
+            cells = [str(value) for value in values.tolist()]
+        elif kind == 'f':
+            cells = [repr(value) for value in values.tolist()]
+
+            # NaN is stored as NULL
+            nan = np.isnan(values)
+            if nan.any():
+                mask = nan if mask is None else (mask | nan)
+        else:
+            # strings are quoted, chars need to be decoded
+            cells = [
+                '"%s"' % (value.decode() if isinstance(value, bytes) else str(value)).replace('"', '""')
+                for value in values.tolist()
+            ]
+
+        if mask is not None and mask.any():
+            cells = [null if mask_cell else cell for cell, mask_cell in zip(cells, mask.tolist())]
+
+        return cells
+
+    def _process_filtering(self, sql, sql_args, search, filters, search_columns):
+        where_stmts, where_args = self._get_where_stmts(search, filters, search_columns)
+
+        # connect the where statements with AND and append to the sql string
+        if where_stmts:
+            sql += ' WHERE ' + ' AND '.join(where_stmts)
+            sql_args += where_args
+
+        return sql, sql_args
+
+    def _get_where_stmts(self, search, filters, search_columns):
         # prepare lists for the WHERE statements
         where_stmts = []
         where_args = []
 
         if search:
-            # append a OR condition fo every column
+            # append a OR condition fo every column which can be searched for this string
             search_stmts = []
             search_args = []
-            for escaped_column_name in escaped_column_names:
-                # search_stmt_template and search_arg_template are set differently for mysql and postgres
-                search_stmts.append(self.search_stmt_template % escaped_column_name)
-                search_args.append(self.search_arg_template % search)
+            for column in search_columns:
+                search_stmt = self.get_search_stmt(column, search)
+                if search_stmt is not None:
+                    search_stmts.append(search_stmt[0])
+                    search_args.append(search_stmt[1])
 
             if search_stmts:
                 where_stmts.append('(' + ' OR '.join(search_stmts) + ')')
                 where_args += search_args
+            else:
+                # no column can match the search string
+                where_stmts.append('1 = 0')
 
         if filters:
             for column_name, column_filter in filters.items():
@@ -309,12 +700,35 @@ class BaseDatabaseAdapter(object):
                     where_stmts.append('(' + ' OR '.join(filter_stmts) + ')')
                     where_args += filter_args
 
-        # connect the where statements with AND and append to the sql string
-        if where_stmts:
-            sql += ' WHERE ' + ' AND '.join(where_stmts)
-            sql_args += where_args
+        return where_stmts, where_args
 
-        return sql, sql_args
+    def get_search_columns(self, schema_name, table_name, column_names, search=None, search_column_names=None):
+        # the search uses the searchable columns from the metadata, or all columns
+        if not search:
+            return []
+
+        # the columns and their indexes are taken from the catalog cache, an empty list is not cached
+        columns = self.get_table_catalog('columns', schema_name, table_name,
+                                         lambda schema_name, table_name: self.fetch_columns(schema_name, table_name) or None)
+        columns = {column['name']: column for column in columns or []}
+        return [dict(columns[column_name]) for column_name in (search_column_names or column_names) if column_name in columns]
+
+    def get_search_stmt(self, column, search):
+        # strings are searched using LIKE (which can use a trigram index), integers only if
+        # the search string is an integer, other columns are not searched
+        escaped_column_name = self.escape_identifier(column['name'])
+
+        if column['datatype'] in ('char', 'unicodeChar'):
+            # search_stmt_template and search_arg_template are set differently for mysql and postgres
+            return self.search_stmt_template % escaped_column_name, self.search_arg_template % search
+
+        elif column['datatype'] in ('short', 'int', 'long'):
+            try:
+                return escaped_column_name + ' = %s', int(search)
+            except ValueError:
+                pass
+
+        return None
 
     def _process_ordering(self, sql, ordering, escaped_column_names):
         if ordering:
@@ -30,3 +30,17 @@ class MariaDBAdapter(MySQLAdapter):
             return 'SET STATEMENT max_statement_time=%(timeout)s FOR %(query)s LIMIT %(max_records)s;' % params
         else:
             return 'SET STATEMENT max_statement_time=%(timeout)s FOR %(query)s;' % params
+
+    def fetch_progress(self, pid):
+        # mariadb reports the examined rows and the progress (in percent) of some statements
+        sql = 'SELECT STATE, EXAMINED_ROWS, PROGRESS FROM information_schema.PROCESSLIST WHERE ID = %s'
+        row = self.fetchone(sql, [pid])
+
+        if row:
+            return {
+                'state': row[0],
+                'rows': row[1],
+                'percent': float(row[2])
+            }
+        else:
+            return {}
@@ -1,7 +1,13 @@
+import json
 import logging
+import os
 import re
+import tempfile
 
-from django.db import OperationalError, ProgrammingError
+import numpy as np
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, ProgrammingError, transaction
 
 from .base import BaseDatabaseAdapter
 
@@ -63,9 +69,23 @@ class MySQLAdapter(BaseDatabaseAdapter):
         'double': 'double'
     }
 
+    # errors if LOAD DATA LOCAL INFILE is disabled in the server (MySQL, MariaDB) or the client
+    LOCAL_INFILE_ERRORS = (1148, 2068, 3948, 4166)
+
+    table_catalog_names = BaseDatabaseAdapter.table_catalog_names + ('fulltext_column_names', )
+
     search_stmt_template = '%s LIKE %%s'
     search_arg_template = '%%%s%%'
 
+    def get_server_side_cursor(self):
+        from MySQLdb.cursors import SSCursor
+
+        connection = self.connection()
+        connection.ensure_connection()
+
+        # the SSCursor keeps the result set on the server and streams the rows
+        return connection.connection.cursor(SSCursor)
+
     def fetch_pid(self):
         return self.connection().connection.thread_id()
 
@@ -108,6 +128,76 @@ class MySQLAdapter(BaseDatabaseAdapter):
         sql = 'KILL %(pid)i' % {'pid': pid}
         self.execute(sql)
 
+    def build_crossmatch_query(self, schema_name, table_name, column_names, ra_column_name, dec_column_name,
+                               upload_schema_name, upload_table_name, nearest=False, max_records=None, options={}):
+        params = {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'columns': ''.join([', t.%s' % self.escape_identifier(column_name) for column_name in column_names]),
+            'outer_columns': ''.join([', m.%s' % self.escape_identifier(column_name) for column_name in column_names]),
+            'ra': 't.%s' % self.escape_identifier(ra_column_name),
+            'dec': 't.%s' % self.escape_identifier(dec_column_name),
+            'upload_schema': self.escape_identifier(upload_schema_name),
+            'upload_table': self.escape_identifier(upload_table_name)
+        }
+
+        # the great circle distance in degrees (haversine formula)
+        params['distance'] = (
+            'DEGREES(2 * ASIN(SQRT(POW(SIN(RADIANS(%(dec)s - u.dec) / 2), 2) + '
+            'COS(RADIANS(u.dec)) * COS(RADIANS(%(dec)s)) * POW(SIN(RADIANS(%(ra)s - u.ra) / 2), 2))))'
+        ) % params
+
+        # the declination zone of each position uses the index on the declination of the table,
+        # the exact distance is only computed for the rows in the zone
+        sql = (
+            'SELECT m.xmatch_row%(outer_columns)s, m.xmatch_distance FROM ('
+            'SELECT u.row_id AS xmatch_row%(columns)s, %(distance)s AS xmatch_distance, '
+            'ROW_NUMBER() OVER (PARTITION BY u.row_id ORDER BY %(distance)s) AS xmatch_rank '
+            'FROM %(upload_schema)s.%(upload_table)s AS u '
+            'JOIN %(schema)s.%(table)s AS t ON %(dec)s BETWEEN u.dec - %%(SR)s AND u.dec + %%(SR)s '
+            'WHERE %(distance)s <= %%(SR)s'
+            ') AS m%(nearest)s ORDER BY m.xmatch_row, m.xmatch_distance'
+        ) % dict(params, nearest=' WHERE m.xmatch_rank = 1' if nearest else '')
+
+        if max_records is not None:
+            sql += ' LIMIT %d' % max_records
+
+        return sql
+
+    def fetch_estimate(self, query):
+        sql = 'EXPLAIN FORMAT=JSON %s' % query
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        try:
+            plan = json.loads(self.fetchone(sql)[0])
+        except (DatabaseError, ValueError) as e:
+            logger.debug('Could not estimate query (%s)', e)
+            return None
+
+        # the rows of all tables in the (nested) plan are multiplied, mysql reports
+        # rows_examined_per_scan and a query_cost, mariadb only rows
+        rows = 1
+        for table in self._get_plan_tables(plan):
+            rows *= int(table.get('rows_examined_per_scan', table.get('rows', 1)))
+
+        try:
+            cost = float(plan['query_block']['cost_info']['query_cost'])
+        except (KeyError, TypeError, ValueError):
+            cost = None
+
+        return {
+            'rows': rows,
+            'cost': cost
+        }
+
+    def fetch_progress(self, pid):
+        sql = 'SELECT STATE FROM information_schema.PROCESSLIST WHERE ID = %s'
+        row = self.fetchone(sql, [pid])
+
+        return {'state': row[0]} if row else {}
+
     def fetch_size(self, schema_name, table_name):
         sql = 'SELECT data_length + index_length AS size FROM `information_schema`.`tables` WHERE `table_schema` = %s AND table_name = %s;'
         size = self.fetchone(sql, (schema_name, table_name))[0]
@@ -124,6 +214,33 @@ class MySQLAdapter(BaseDatabaseAdapter):
         logger.debug('size = %d', nrows)
         return nrows
 
+    def estimate_rows(self, schema_name, table_name, column_names=None, search=None, filters=None, search_column_names=None):
+        # get the columns which are used for the search
+        search_columns = self.get_search_columns(schema_name, table_name, column_names, search, search_column_names)
+
+        # prepare sql string
+        sql = 'EXPLAIN SELECT 1 FROM %(schema)s.%(table)s' % {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name)
+        }
+        sql_args = []
+
+        # process filtering
+        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, search_columns)
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        with self.connection().cursor() as cursor:
+            cursor.execute(sql, sql_args)
+            row = dict(zip([column[0] for column in cursor.description], cursor.fetchone()))
+
+        # the filtered column is not available for all versions of MySQL and MariaDB
+        if row.get('rows') is None:
+            return None
+        else:
+            return int(row['rows'] * float(row.get('filtered') or 100) / 100)
+
     def fetch_tables(self, schema_name):
         # escape input
         escaped_schema_name = self.escape_identifier(schema_name)
@@ -220,6 +337,28 @@ class MySQLAdapter(BaseDatabaseAdapter):
         }
         return [column[0] for column in self.fetchall(sql)]
 
+    def fetch_unique_columns(self, schema_name, table_name):
+        # get the NOT NULL columns which have a unique index on their own
+        sql = (
+            'SELECT c.COLUMN_NAME FROM information_schema.COLUMNS c WHERE c.TABLE_SCHEMA = %s AND c.TABLE_NAME = %s '
+            'AND c.IS_NULLABLE = \'NO\' AND EXISTS ('
+            'SELECT 1 FROM information_schema.STATISTICS s WHERE s.TABLE_SCHEMA = c.TABLE_SCHEMA '
+            'AND s.TABLE_NAME = c.TABLE_NAME AND s.COLUMN_NAME = c.COLUMN_NAME AND s.NON_UNIQUE = 0 '
+            'AND s.SEQ_IN_INDEX = 1 AND NOT EXISTS ('
+            'SELECT 1 FROM information_schema.STATISTICS t WHERE t.TABLE_SCHEMA = s.TABLE_SCHEMA '
+            'AND t.TABLE_NAME = s.TABLE_NAME AND t.INDEX_NAME = s.INDEX_NAME AND t.SEQ_IN_INDEX = 2)'
+            ') ORDER BY c.ORDINAL_POSITION'
+        )
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        try:
+            return [row[0] for row in self.fetchall(sql, [schema_name, table_name])]
+        except ProgrammingError as e:
+            logger.error('Could not fetch unique columns from %s.%s (%s)', schema_name, table_name, e)
+            return None
+
     def rename_table(self, schema_name, table_name, new_table_name):
         sql = 'RENAME TABLE %(schema)s.%(table)s to %(schema)s.%(new_table)s;' % {
             'schema': self.escape_identifier(schema_name),
@@ -228,6 +367,155 @@ class MySQLAdapter(BaseDatabaseAdapter):
         }
 
         self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+        self.invalidate_table_catalog(schema_name, new_table_name)
+
+    def create_search_index(self, schema_name, table_name, column_name):
+        # mysql has no CREATE INDEX IF NOT EXISTS, so check for the index first
+        if (self.fetch_fulltext_column_names(schema_name, table_name) or {}).get(column_name):
+            return
+
+        sql = 'CREATE FULLTEXT INDEX %(index)s ON %(schema)s.%(table)s (%(column)s);' % {
+            'index': self.escape_identifier(self.get_search_index_name(schema_name, table_name, column_name)),
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'column': self.escape_identifier(column_name)
+        }
+
+        # log sql string and execute
+        logger.debug('sql = "%s"', sql)
+        self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+
+    def drop_search_index(self, schema_name, table_name, column_name):
+        index_name = self.get_search_index_name(schema_name, table_name, column_name)
+        if index_name not in (self.fetch_fulltext_column_names(schema_name, table_name) or {}).values():
+            return
+
+        sql = 'DROP INDEX %(index)s ON %(schema)s.%(table)s;' % {
+            'index': self.escape_identifier(index_name),
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name)
+        }
+
+        # log sql string and execute
+        logger.debug('sql = "%s"', sql)
+        self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+
+    def fetch_fulltext_column_names(self, schema_name, table_name):
+        # get the columns which have a FULLTEXT index on their own, mapped to the name of the index
+        sql = (
+            'SELECT s.COLUMN_NAME, s.INDEX_NAME FROM information_schema.STATISTICS s '
+            'WHERE s.TABLE_SCHEMA = %s AND s.TABLE_NAME = %s AND s.INDEX_TYPE = \'FULLTEXT\' AND NOT EXISTS ('
+            'SELECT 1 FROM information_schema.STATISTICS t WHERE t.TABLE_SCHEMA = s.TABLE_SCHEMA '
+            'AND t.TABLE_NAME = s.TABLE_NAME AND t.INDEX_NAME = s.INDEX_NAME AND t.SEQ_IN_INDEX = 2)'
+        )
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        try:
+            rows = self.fetchall(sql, [schema_name, table_name])
+        except ProgrammingError as e:
+            logger.error('Could not fetch fulltext indexes of %s.%s (%s)', schema_name, table_name, e)
+            return None
+
+        return dict(rows)
+
+    def get_search_columns(self, schema_name, table_name, column_names, search=None, search_column_names=None):
+        search_columns = super().get_search_columns(schema_name, table_name, column_names, search, search_column_names)
+
+        if search_columns:
+            fulltext_column_names = self.get_table_catalog('fulltext_column_names', schema_name, table_name,
+                                                           self.fetch_fulltext_column_names) or {}
+            for column in search_columns:
+                column['fulltext'] = column['name'] in fulltext_column_names
+
+        return search_columns
+
+    def get_search_stmt(self, column, search):
+        # columns with a FULLTEXT index are searched for words starting with the terms of the
+        # search string, the operators of the boolean mode are removed from the terms
+        if column.get('fulltext'):
+            terms = [term for term in re.split(r'[\s+\-<>()~*"@]+', search) if term]
+            if terms:
+                search_stmt = 'MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % self.escape_identifier(column['name'])
+                search_arg = ' '.join(['+%s*' % term for term in terms])
+                return search_stmt, search_arg
+
+        return super().get_search_stmt(column, search)
+
+    def copy_batches(self, schema_name, table_name, columns, batches):
+        if not settings.DATABASE_LOCAL_INFILE:
+            return super().copy_batches(schema_name, table_name, columns, batches)
+
+        # LOAD DATA LOCAL INFILE needs local_infile to be enabled for the server and
+        # in the OPTIONS of the database connection
+        sql = (
+            'LOAD DATA LOCAL INFILE %%s INTO TABLE %(schema)s.%(table)s CHARACTER SET utf8mb4 '
+            'FIELDS TERMINATED BY \',\' OPTIONALLY ENCLOSED BY \'"\' ESCAPED BY \'\' '
+            'LINES TERMINATED BY \'\\n\' (%(columns)s)'
+        ) % {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'columns': ', '.join([self.escape_identifier(column['name']) for column in columns])
+        }
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        # every batch is written to a temporary file and loaded separately,
+        # the unquoted word NULL is read as NULL
+        local_infile = True
+        with transaction.atomic(using=self.database_key):
+            with self.connection().cursor() as cursor:
+                for rows, mask in batches:
+                    if local_infile:
+                        chunk = next(self.generate_copy_chunks([(rows, mask)], null='NULL'))
+                        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', delete=False) as f:
+                            f.write(chunk)
+
+                        try:
+                            cursor.execute(sql, [f.name])
+                            continue
+                        except DatabaseError as e:
+                            # the server or the client does not allow LOAD DATA LOCAL INFILE,
+                            # the rows are inserted instead
+                            if e.args[0] not in self.LOCAL_INFILE_ERRORS:
+                                raise
+
+                            logger.warning('LOAD DATA LOCAL INFILE is not allowed, inserting the rows instead (%s)', e)
+                            local_infile = False
+                        finally:
+                            os.remove(f.name)
+
+                    self.insert_rows(schema_name, table_name, columns, rows, mask)
+
+    def _encode_copy_column(self, values, mask=None, null=''):
+        # MySQL has no NaN or infinite floats, they are stored as NULL
+        if values.dtype.kind == 'f':
+            infinite = np.isinf(values)
+            if infinite.any():
+                mask = infinite if mask is None else (mask | infinite)
+
+        return super()._encode_copy_column(values, mask, null)
+
+    def _escape_cell(self, cell, mask_cell=None):
+        if cell.dtype.kind == 'f' and not np.isfinite(cell):
+            return 'NULL'
+
+        return super()._escape_cell(cell, mask_cell)
+
+    def _get_plan_tables(self, node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == 'table' and isinstance(value, dict):
+                    yield value
+                yield from self._get_plan_tables(value)
+        elif isinstance(node, list):
+            for value in node:
+                yield from self._get_plan_tables(value)
 
     def _convert_datatype(self, datatype_string):
         result = re.match('([a-z]+)\(*(\d*)\)*', datatype_string)
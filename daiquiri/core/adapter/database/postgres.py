@@ -1,6 +1,8 @@
+import io
+import json
 import logging
 
-from django.db import OperationalError, ProgrammingError
+from django.db import DatabaseError, OperationalError, ProgrammingError, transaction
 
 from .base import BaseDatabaseAdapter
 
@@ -103,6 +105,107 @@ class PostgreSQLAdapter(BaseDatabaseAdapter):
         sql = 'select pg_cancel_backend(%(pid)i)' % {'pid': pid}
         self.execute(sql)
 
+    def build_crossmatch_query(self, schema_name, table_name, column_names, ra_column_name, dec_column_name,
+                               upload_schema_name, upload_table_name, nearest=False, max_records=None, options={}):
+        params = {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'columns': ''.join([', t.%s' % self.escape_identifier(column_name) for column_name in column_names]),
+            'ra': 't.%s' % self.escape_identifier(ra_column_name),
+            'dec': 't.%s' % self.escape_identifier(dec_column_name),
+            'upload_schema': self.escape_identifier(upload_schema_name),
+            'upload_table': self.escape_identifier(upload_table_name)
+        }
+
+        if options.get('index') == 'q3c':
+            # q3c_join uses the q3c_ang2ipix index of the table
+            params['condition'] = 'q3c_join(u.ra, u.dec, %(ra)s, %(dec)s, %%(SR)s)' % params
+            params['distance'] = 'q3c_dist(u.ra, u.dec, %(ra)s, %(dec)s)' % params
+        else:
+            # pg_sphere uses the index of a spoint column, or of the spoint expression
+            if options.get('position_column_name'):
+                params['position'] = 't.%s' % self.escape_identifier(options['position_column_name'])
+            else:
+                params['position'] = 'spoint(radians(%(ra)s), radians(%(dec)s))' % params
+
+            params['condition'] = '%(position)s <@ scircle(spoint(radians(u.ra), radians(u.dec)), radians(%%(SR)s))' % params
+            params['distance'] = 'degrees(%(position)s <-> spoint(radians(u.ra), radians(u.dec)))' % params
+
+        sql = (
+            'SELECT %(distinct)su.row_id AS xmatch_row%(columns)s, %(distance)s AS xmatch_distance '
+            'FROM %(upload_schema)s.%(upload_table)s AS u '
+            'JOIN %(schema)s.%(table)s AS t ON %(condition)s '
+            'ORDER BY u.row_id, xmatch_distance'
+        ) % dict(params, distinct='DISTINCT ON (u.row_id) ' if nearest else '')
+
+        if max_records is not None:
+            sql += ' LIMIT %d' % max_records
+
+        return sql
+
+    def fetch_estimate(self, query):
+        sql = 'EXPLAIN (FORMAT JSON) %s' % query
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        # the query can fail, e.g. if it uses uploaded tables, which do not exist yet,
+        # so use a savepoint which is rolled back in this case
+        try:
+            with transaction.atomic(using=self.database_key):
+                plan = self.fetchone(sql)[0]
+        except DatabaseError as e:
+            logger.debug('Could not estimate query (%s)', e)
+            return None
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return {
+            'rows': int(plan[0]['Plan']['Plan Rows']),
+            'cost': float(plan[0]['Plan']['Total Cost'])
+        }
+
+    def fetch_progress(self, pid):
+        progress = {}
+
+        sql = 'SELECT state, wait_event FROM pg_stat_activity WHERE pid = %s'
+        row = self.fetchone(sql, [pid])
+        if row:
+            progress['state'] = row[1] or row[0]
+
+        # rows are only reported for COPY (e.g. when uploads are ingested) and since PostgreSQL 14, there is
+        # no progress view for CREATE TABLE AS, so query jobs get only the state and the temporary files
+        try:
+            sql = 'SELECT tuples_processed FROM pg_stat_progress_copy WHERE pid = %s'
+            row = self.fetchone(sql, [pid])
+            if row:
+                progress['rows'] = row[0]
+        except ProgrammingError as e:
+            logger.debug('Could not fetch copy progress (%s)', e)
+
+        # the temporary files of the backend can only be listed with the pg_monitor role
+        try:
+            sql = 'SELECT COALESCE(SUM(size), 0) FROM pg_ls_tmpdir() WHERE name LIKE %s'
+            progress['temp_bytes'] = int(self.fetchone(sql, ['pgsql_tmp%d.%%' % pid])[0])
+        except DatabaseError as e:
+            logger.debug('Could not fetch temporary files (%s)', e)
+
+        return progress
+
+    def set_idle_timeout(self, timeout):
+        # the setting only applies to the current transaction, if it ends, the server terminates the session
+        self.execute('SET LOCAL idle_in_transaction_session_timeout = %i;' % (timeout * 1000))
+
+    def reset_session(self):
+        # the statement_timeout from build_query and build_sync_query is set for the session,
+        # if it cannot be reset, the connection is closed so that it is not reused
+        try:
+            self.execute('RESET statement_timeout;')
+        except DatabaseError as e:
+            logger.error('Could not reset session (%s)', e)
+            self.connection().close()
+
     def fetch_size(self, schema_name, table_name):
         # fetch the size of the table using pg_total_relation_size
         sql = 'SELECT pg_total_relation_size(\'%(schema)s.%(table)s\')' % {
@@ -127,6 +230,29 @@ class PostgreSQLAdapter(BaseDatabaseAdapter):
         logger.debug('nrows = %d', nrows)
         return nrows
 
+    def estimate_rows(self, schema_name, table_name, column_names=None, search=None, filters=None, search_column_names=None):
+        # get the columns which are used for the search
+        search_columns = self.get_search_columns(schema_name, table_name, column_names, search, search_column_names)
+
+        # prepare sql string
+        sql = 'EXPLAIN (FORMAT JSON) SELECT 1 FROM %(schema)s.%(table)s' % {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name)
+        }
+        sql_args = []
+
+        # process filtering
+        sql, sql_args = self._process_filtering(sql, sql_args, search, filters, search_columns)
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        plan = self.fetchone(sql, args=sql_args)[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return int(plan[0]['Plan']['Plan Rows'])
+
     def fetch_tables(self, schema_name):
         # escape input
         escaped_schema_name = self.escape_string(schema_name)
@@ -279,6 +405,26 @@ class PostgreSQLAdapter(BaseDatabaseAdapter):
         logger.debug('sql = "%s"', sql)
         return [column[0] for column in self.fetchall(sql)]
 
+    def fetch_unique_columns(self, schema_name, table_name):
+        # get the NOT NULL columns which have a unique index on their own
+        sql = (
+            'SELECT a.attname FROM pg_attribute a WHERE a.attrelid = %s::regclass AND a.attnum > 0 '
+            'AND NOT a.attisdropped AND a.attnotnull AND EXISTS ('
+            'SELECT 1 FROM pg_index i WHERE i.indrelid = a.attrelid AND i.indisunique AND i.indnatts = 1 '
+            'AND i.indkey[0] = a.attnum AND i.indpred IS NULL'
+            ') ORDER BY a.attnum'
+        )
+        args = ['%s.%s' % (self.escape_identifier(schema_name), self.escape_identifier(table_name))]
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        try:
+            return [row[0] for row in self.fetchall(sql, args)]
+        except ProgrammingError as e:
+            logger.error('Could not fetch unique columns from %s.%s (%s)', schema_name, table_name, e)
+            return None
+
     def rename_table(self, schema_name, table_name, new_table_name):
         sql = 'ALTER TABLE %(schema)s.%(table)s RENAME TO %(new_table)s;' % {
             'schema': self.escape_identifier(schema_name),
@@ -289,6 +435,53 @@ class PostgreSQLAdapter(BaseDatabaseAdapter):
         # log sql string and execute
         logger.debug('sql = "%s"', sql)
         self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+        self.invalidate_table_catalog(schema_name, new_table_name)
+
+    def create_search_index(self, schema_name, table_name, column_name):
+        # a trigram index can be used by LIKE '%...%', the column is cast to text
+        # in the same way as in search_stmt_template
+        sql = (
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm; '
+            'CREATE INDEX IF NOT EXISTS %(index)s ON %(schema)s.%(table)s USING gin ((%(column)s::text) gin_trgm_ops);'
+        ) % {
+            'index': self.escape_identifier(self.get_search_index_name(schema_name, table_name, column_name)),
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'column': self.escape_identifier(column_name)
+        }
+
+        # log sql string and execute
+        logger.debug('sql = "%s"', sql)
+        self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+
+    def drop_search_index(self, schema_name, table_name, column_name):
+        sql = 'DROP INDEX IF EXISTS %(schema)s.%(index)s;' % {
+            'schema': self.escape_identifier(schema_name),
+            'index': self.escape_identifier(self.get_search_index_name(schema_name, table_name, column_name))
+        }
+
+        # log sql string and execute
+        logger.debug('sql = "%s"', sql)
+        self.execute(sql)
+        self.invalidate_table_catalog(schema_name, table_name)
+
+    def copy_batches(self, schema_name, table_name, columns, batches):
+        sql = 'COPY %(schema)s.%(table)s (%(columns)s) FROM STDIN WITH CSV' % {
+            'schema': self.escape_identifier(schema_name),
+            'table': self.escape_identifier(table_name),
+            'columns': ', '.join([self.escape_identifier(column['name']) for column in columns])
+        }
+
+        # log sql string
+        logger.debug('sql = "%s"', sql)
+
+        # every chunk is sent using a separate COPY, unquoted empty fields are NULL
+        with transaction.atomic(using=self.database_key):
+            with self.connection().cursor() as cursor:
+                for chunk in self.generate_copy_chunks(batches, null=''):
+                    cursor.copy_expert(sql, io.StringIO(chunk))
 
     def _parse_column(self, row):
         column_name, data_type, udt_name, character_maximum_length, ordinal_position = row
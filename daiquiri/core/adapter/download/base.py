@@ -5,7 +5,8 @@ import re
 
 from django.conf import settings
 
-from daiquiri.core.generators import generate_csv, generate_votable, generate_fits
+from daiquiri.core.generators import (generate_csv, generate_votable, generate_votable_binary2,
+                                      generate_fits, generate_parquet)
 from daiquiri.core.utils import get_doi_url
 
 logger = logging.getLogger(__name__)
@@ -13,12 +14,25 @@ logger = logging.getLogger(__name__)
 
 class BaseDownloadAdapter(object):
 
+    # formats which can be created in several parts, see get_parts
+    part_formats = ()
+
     def __init__(self, database_key, database_config):
         self.database_key = database_key
         self.database_config = database_config
 
+        self.part = {}
+        self.rows_written = 0
+
     def generate(self, format_key, columns, sources=[], schema_name=None, table_name=None, nrows=None,
-                 query_status=None, query=None, query_language=None):
+                 query_status=None, query=None, query_language=None, part=None):
+        # only a part of the table is generated if a part from get_parts is given
+        self.part = part or {}
+        self.rows_written = 0
+
+        header = self.part.get('first', True)
+        footer = self.part.get('last', True)
+
         # create the final list of arguments subprocess.Popen
         if format_key == 'sql':
             # create the final list of arguments subprocess.Popen
@@ -33,18 +47,32 @@ class BaseDownloadAdapter(object):
             prepend = self.get_prepend(columns)
 
             if format_key == 'csv':
-                return generate_csv(self.generate_rows(prepend=prepend), columns)
+                return generate_csv(self.generate_rows(prepend=prepend), columns, header=header)
 
             elif format_key == 'votable':
                 return generate_votable(self.generate_rows(prepend=prepend), columns,
                                         table=self.get_table_name(schema_name, table_name),
                                         infos=self.get_infos(query_status, query, query_language, sources),
                                         links=self.get_links(sources),
-                                        empty=(nrows==0))
+                                        empty=(nrows==0),
+                                        header=header,
+                                        footer=footer)
+
+            elif format_key == 'votable-binary2':
+                return generate_votable_binary2(self.generate_rows(prepend=prepend), columns,
+                                                table=self.get_table_name(schema_name, table_name),
+                                                infos=self.get_infos(query_status, query, query_language, sources),
+                                                links=self.get_links(sources),
+                                                empty=(nrows==0))
 
             elif format_key == 'fits':
                 return generate_fits(self.generate_rows(prepend=prepend), columns, nrows,
-                                     table_name=self.get_table_name(schema_name, table_name))
+                                     table_name=self.get_table_name(schema_name, table_name),
+                                     header=header,
+                                     footer=footer)
+
+            elif format_key == 'parquet':
+                return generate_parquet(self.generate_rows(prepend=prepend), columns)
 
             else:
                 raise Exception('Not supported.')
@@ -80,6 +108,8 @@ class BaseDownloadAdapter(object):
                     reader = csv.reader([line], quotechar="'", skipinitialspace=True)
                     row = next(reader)
 
+                    self.rows_written += 1
+
                     if prepend:
                         yield [(prepend[i] + cell if (i in prepend and cell != 'NULL') else cell) for i, cell in enumerate(row)]
                     else:
@@ -88,6 +118,21 @@ class BaseDownloadAdapter(object):
         except subprocess.CalledProcessError as e:
             logger.error('Command PIPE returned non-zero exit status: %s' % e)
 
+    def get_parts(self, format_key, schema_name, table_name, nrows, part_rows):
+        # by default, the file is created in one part
+        return self.get_parts_from_ranges([None])
+
+    def get_parts_from_ranges(self, ranges):
+        return [{
+            'range': part_range,
+            'first': i == 0,
+            'last': i == len(ranges) - 1
+        } for i, part_range in enumerate(ranges)]
+
+    def get_range_condition(self):
+        # returns an sql condition to select the rows of self.part, if supported
+        return None
+
     def get_prepend(self, columns):
         if not settings.FILES_BASE_URL:
             return {}
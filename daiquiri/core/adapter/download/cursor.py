@@ -0,0 +1,121 @@
+import logging
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .mysqldump import MysqldumpAdapter
+from .pgdump import PgDumpAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class CursorAdapterMixin(object):
+    '''
+    Reads the rows of the table through a server-side cursor instead of parsing
+    the output of pg_dump/mysqldump. The rows are fetched in batches of fetch_size
+    and yielded as typed python values. The sql format still uses the dump tools.
+    '''
+
+    fetch_size = 10000
+
+    # booleans are written like in the output of the dump tools
+    boolean_values = {True: 'true', False: 'false'}
+
+    def set_args(self, schema_name, table_name, data_only=False):
+        super().set_args(schema_name, table_name, data_only=data_only)
+
+        self.schema_name = schema_name
+        self.table_name = table_name
+
+    def connection(self):
+        return connections[self.database_key]
+
+    def get_cursor(self):
+        raise NotImplementedError()
+
+    def get_sql(self):
+        sql = 'SELECT * FROM %(schema)s.%(table)s' % {
+            'schema': self.escape_identifier(self.schema_name),
+            'table': self.escape_identifier(self.table_name)
+        }
+
+        condition = self.get_range_condition()
+        if condition:
+            sql += ' WHERE ' + condition
+
+        return sql
+
+    @contextmanager
+    def open_cursor(self):
+        # the cursor is closed, even if the generator using it is not exhausted
+        cursor = self.get_cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def format_row(self, row, prepend=None):
+        return [
+            self.boolean_values[cell] if isinstance(cell, bool) else
+            (prepend[i] + cell if (prepend and i in prepend and cell is not None) else cell)
+            for i, cell in enumerate(row)
+        ]
+
+    def generate_rows(self, prepend=None):
+        sql = self.get_sql()
+
+        # log the sql string
+        logger.debug('sql = "%s"', sql)
+
+        with self.open_cursor() as cursor:
+            cursor.execute(sql)
+
+            while True:
+                rows = cursor.fetchmany(self.fetch_size)
+                if not rows:
+                    break
+
+                self.rows_written += len(rows)
+
+                for row in rows:
+                    yield self.format_row(row, prepend)
+
+
+class PostgreSQLCursorAdapter(CursorAdapterMixin, PgDumpAdapter):
+
+    part_formats = ('csv', 'votable', 'fits')
+
+    def get_cursor(self):
+        # a named cursor is a server-side cursor in psycopg2
+        cursor = self.connection().connection.cursor(name='daiquiri_download_%s' % uuid.uuid4().hex)
+        cursor.itersize = self.fetch_size
+        return cursor
+
+    @contextmanager
+    def open_cursor(self):
+        # the cursor lives in a transaction, a cursor declared WITH HOLD would be
+        # materialized on the server as soon as it is declared in autocommit mode
+        with transaction.atomic(using=self.database_key):
+            # the transaction stays open while the response is streamed, if the client stops reading,
+            # the server terminates the session after DATABASE_STREAM_IDLE_TIMEOUT seconds
+            with self.connection().cursor() as cursor:
+                cursor.execute('SET LOCAL idle_in_transaction_session_timeout = %i' % (settings.DATABASE_STREAM_IDLE_TIMEOUT * 1000))
+
+            with super().open_cursor() as cursor:
+                yield cursor
+
+
+class MySQLCursorAdapter(CursorAdapterMixin, MysqldumpAdapter):
+
+    boolean_values = {True: 1, False: 0}
+
+    def get_cursor(self):
+        from MySQLdb.cursors import SSCursor
+
+        connection = self.connection()
+        connection.ensure_connection()
+
+        # the SSCursor keeps the result set on the server and streams the rows
+        return connection.connection.cursor(SSCursor)
@@ -26,3 +26,6 @@ class MysqldumpAdapter(BaseDownloadAdapter):
 
         self.args.append(schema_name)
         self.args.append(table_name)
+
+    def escape_identifier(self, identifier):
+        return '`%s`' % identifier.replace('`', '``')
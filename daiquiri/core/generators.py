@@ -1,33 +1,170 @@
+import base64
 import csv
 import datetime
 import io
+import os
 import struct
-import sys
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from xml.sax.saxutils import escape, quoteattr
 
+import numpy as np
+
 from daiquiri import __version__ as daiquiri_version
 from django.contrib.sites.models import Site
 
-
-def generate_csv(generator, fields):
-    if sys.version_info.major >= 3:
-        io_class = io.StringIO
-    else:
-        io_class = io.BytesIO
+VOTABLE_NUMERIC_DATATYPES = ('boolean', 'unsignedByte', 'short', 'int', 'long', 'float', 'double')
+
+PARQUET_DATATYPES = {
+    'boolean': 'bool_',
+    'unsignedByte': 'uint8',
+    'short': 'int16',
+    'int': 'int32',
+    'long': 'int64',
+    'float': 'float32',
+    'double': 'float64',
+    'timestamp': 'timestamp'
+}
+
+ZIP_STORED_EXTENSIONS = (
+    '.gz', '.tgz', '.bz2', '.xz', '.zst', '.zip', '.7z', '.fz',
+    '.jpg', '.jpeg', '.png', '.gif', '.mp4', '.mpg', '.parquet'
+)
+
+BINARY2_FORMATS = {
+    'unsignedByte': '>B',
+    'short': '>h',
+    'int': '>i',
+    'long': '>q',
+    'float': '>f',
+    'double': '>d'
+}
+
+
+def generate_csv(generator, fields, buffer_size=65536, header=True):
+    f = io.StringIO()
+    writer = csv.writer(f, quotechar='"')
 
     # write header
-    f = io_class()
-    csv.writer(f, quotechar='"').writerow([field['name'] for field in fields])
-    yield f.getvalue()
+    if header:
+        writer.writerow([field['name'] for field in fields])
 
+    # write the rows into a buffer and yield it once it is full
     for row in generator:
         if row:
-            f = io_class()
-            csv.writer(f, quotechar='"').writerow(row)
-            yield f.getvalue()
+            writer.writerow(row)
+
+            if f.tell() >= buffer_size:
+                yield f.getvalue()
+                f.seek(0)
+                f.truncate()
+
+    if f.tell():
+        yield f.getvalue()
+
+
+def generate_votable(generator, fields, infos=[], links=[], table=None, empty=None, buffer_size=65536,
+                     header=True, footer=True):
+    # header and footer can be omitted to create a file in several parts
+    if header:
+        yield from generate_votable_header(fields, infos=infos, links=links, table=table)
+
+    if not empty:
+        if header:
+            yield '''
+            <DATA>
+                <TABLEDATA>'''
+
+        # get a formatter for each column, numeric columns do not need to be escaped
+        formatters = [
+            format_votable_number if field.get('datatype') in VOTABLE_NUMERIC_DATATYPES else format_votable_string
+            for field in fields
+        ]
+
+        row_start = '''
+                    <TR>
+                        <TD>'''
+        row_separator = '''</TD>
+                        <TD>'''
+        row_end = '''</TD>
+                    </TR>'''
+
+        # write rows of the table yielded by the generator into a buffer and yield it once it is full
+        buffer = []
+        buffer_length = 0
+        for row in generator:
+            line = row_start + row_separator.join([formatter(cell) for formatter, cell in zip(formatters, row)]) + row_end
+            buffer.append(line)
+            buffer_length += len(line)
+
+            if buffer_length >= buffer_size:
+                yield ''.join(buffer)
+                buffer = []
+                buffer_length = 0
+
+        if buffer:
+            yield ''.join(buffer)
+
+        if footer:
+            yield '''
+                </TABLEDATA>
+            </DATA>'''
+
+    if footer:
+        yield from generate_votable_footer()
+
+
+def generate_votable_binary2(generator, fields, infos=[], links=[], table=None, empty=None, buffer_size=58368):
+    yield from generate_votable_header(fields, infos=infos, links=links, table=table, binary=True)
+
+    if not empty:
+        yield '''
+            <DATA>
+                <BINARY2>
+                    <STREAM encoding="base64">
+'''
 
+        # get an encoder and the bytes for NULL values for each column
+        encoders, nulls = zip(*[get_binary2_encoder(field) for field in fields]) if fields else ((), ())
 
-def generate_votable(generator, fields, infos=[], links=[], table=None, empty=None):
+        # each row starts with a bitmask with one bit per column, the first column is the highest bit
+        mask_length = (len(fields) + 7) // 8
+        mask_bits = [(i // 8, 0x80 >> (i % 8)) for i in range(len(fields))]
+
+        # the buffer is encoded in pieces of a multiple of 57 bytes, which results in
+        # complete lines of 76 characters and no base64 padding inside the stream
+        buffer = bytearray()
+        for row in generator:
+            mask = bytearray(mask_length)
+            values = []
+            for (index, bit), encoder, null, cell in zip(mask_bits, encoders, nulls, row):
+                if cell is None or cell == 'NULL':
+                    mask[index] |= bit
+                    values.append(null)
+                else:
+                    values.append(encoder(cell))
+
+            buffer += mask
+            buffer += b''.join(values)
+
+            if len(buffer) >= buffer_size:
+                length = len(buffer) - len(buffer) % 57
+                yield base64.encodebytes(buffer[:length]).decode()
+                del buffer[:length]
+
+        if buffer:
+            yield base64.encodebytes(buffer).decode()
+
+        yield '''                    </STREAM>
+                </BINARY2>
+            </DATA>'''
+
+    yield from generate_votable_footer()
+
+
+def generate_votable_header(fields, infos=[], links=[], table=None, binary=False):
     yield '''<?xml version="1.0"?>
 <VOTABLE version="1.3"
     xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
@@ -66,35 +203,33 @@ def generate_votable(generator, fields, infos=[], links=[], table=None, empty=No
                 value = field[key].replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
                 attrs.append('%s="%s"' % (key, value))
 
-        if 'arraysize' in field and field['arraysize']:
-            attrs.append('arraysize="%s"' % field['arraysize'])
-
-        if 'datatype' in field:
-            if field['datatype'] in ['boolean', 'char', 'unsignedByte', 'short', 'int', 'long', 'float', 'double']:
+        if binary:
+            # in BINARY2, all non numeric columns are written as variable length unicodeChar arrays,
+            # since char only allows ASCII
+            if field.get('datatype') in VOTABLE_NUMERIC_DATATYPES:
                 attrs.append('datatype="%s"' % field['datatype'])
             else:
-                attrs.append('xtype="%s"' % field['datatype'])
+                attrs.append('datatype="unicodeChar"')
+                attrs.append('arraysize="%s*"' % (field.get('arraysize') or ''))
+
+                if field.get('datatype') not in [None, 'char']:
+                    attrs.append('xtype="%s"' % field['datatype'])
+        else:
+            if 'arraysize' in field and field['arraysize']:
+                attrs.append('arraysize="%s"' % field['arraysize'])
+
+            if 'datatype' in field:
+                if field['datatype'] in ['boolean', 'char', 'unsignedByte', 'short', 'int', 'long', 'float', 'double']:
+                    attrs.append('datatype="%s"' % field['datatype'])
+                else:
+                    attrs.append('xtype="%s"' % field['datatype'])
 
         if attrs:
             yield '''
             <FIELD %s />''' % ' '.join(attrs)
 
-    if not empty:
-        yield '''
-            <DATA>
-                <TABLEDATA>'''
-
-        # write rows of the table yielded by the generator
-        for row in generator:
-            yield '''
-                    <TR>
-                        <TD>%s</TD>
-                    </TR>''' % '''</TD>
-                        <TD>'''.join([('' if cell in ['NULL', None] else escape(str(cell))) for cell in row])
 
-        yield '''
-                </TABLEDATA>
-            </DATA>'''
+def generate_votable_footer():
     yield '''
         </TABLE>
     </RESOURCE>
@@ -102,21 +237,21 @@ def generate_votable(generator, fields, infos=[], links=[], table=None, empty=No
 '''
 
 
-def generate_fits(generator, fields, nrows, table_name=None):
+def generate_fits(generator, fields, nrows, table_name=None, chunk_size=10000, header=True, footer=True):
 
-    # VO format label, FITS format label, size, NULL value, encoded value
+    # VO format label, FITS format label, size, NULL value
     formats_dict = {
-        'boolean':      ('s', 'L', 1,  b'\x00',             lambda x: b'T' if x == 'true' else b'F'),
-        'short':        ('h', 'I', 2,  32767,               int),
-        'int':          ('i', 'J', 4,  2147483647,          int),
-        'long':         ('q', 'K', 8,  9223372036854775807, int),
-        'float':        ('f', 'E', 4,  float('nan'),        float),
-        'double':       ('d', 'D', 8,  float('nan'),        float),
-        'char':         ('s', 'A', 32, b'',                 lambda x: x.encode()),
-        'timestamp':    ('s', 'A', 19, b'',                 lambda x: x.encode()),
-        'array':        ('s', 'A', 64, b'',                 lambda x: x.encode()),
-        'spoint':       ('s', 'A', 64, b'',                 lambda x: x.encode()),
-        'unknown':      ('s', 'A', 8,  b'',                 lambda x: x.encode())
+        'boolean':      ('s', 'L', 1,  b'\x00'),
+        'short':        ('h', 'I', 2,  32767),
+        'int':          ('i', 'J', 4,  2147483647),
+        'long':         ('q', 'K', 8,  9223372036854775807),
+        'float':        ('f', 'E', 4,  float('nan')),
+        'double':       ('d', 'D', 8,  float('nan')),
+        'char':         ('s', 'A', 32, b''),
+        'timestamp':    ('s', 'A', 19, b''),
+        'array':        ('s', 'A', 64, b''),
+        'spoint':       ('s', 'A', 64, b''),
+        'unknown':      ('s', 'A', 8,  b'')
     }
 
     names = [field['name'] for field in fields]
@@ -205,11 +340,13 @@ def generate_fits(generator, fields, nrows, table_name=None):
     h0 = ''.join(header0)
     h0 += ' ' * (2880 * (len(h0) // 2880 + 1) - len(h0))
 
-    yield h0.encode()
+    if header:
+        yield h0.encode()
 
     # Main table content - required by some FITS viewers ######################
 
-    yield (content + '\x00' * (2880 - len(content))).encode()
+    if header:
+        yield (content + '\x00' * (2880 - len(content))).encode()
 
     # Table header ############################################################
     header1 = [
@@ -282,22 +419,251 @@ def generate_fits(generator, fields, nrows, table_name=None):
     h1 += 'END'.ljust(80)
     h1 += ' ' * (2880 * (len(h1) // 2880 + 1) - len(h1))
 
-    yield h1.encode()
+    if header:
+        yield h1.encode()
 
     # Data ####################################################################
-    fmt = '>' + ''.join([str(i[1]) + formats_dict[i[0]][0]
-                         for i in zip(datatypes, arraysizes)])
+    dtype = np.dtype([
+        ('f%d' % i, 'S%s' % (d[1] or formats_dict[d[0]][2]) if formats_dict[d[0]][0] == 's' else '>' + formats_dict[d[0]][0])
+        for i, d in enumerate(zip(datatypes, arraysizes))
+    ])
 
     row_count = 0
-    for row in generator:
-        r = [formats_dict[i[1]][3] if i[0] == 'NULL'
-             else formats_dict[i[1]][4](i[0]) for i in zip(row, datatypes)]
+    for rows in generate_chunks(generator, chunk_size):
+        data = np.empty(len(rows), dtype=dtype)
+
+        for i, column in enumerate(zip(*rows)):
+            fits_format, null_value = formats_dict[datatypes[i]][1], formats_dict[datatypes[i]][3]
+            data['f%d' % i] = pack_fits_column(column, dtype['f%d' % i], fits_format, null_value)
 
-        yield struct.pack(fmt, *r)
-        row_count += 1
+        yield data.tobytes()
+        row_count += len(rows)
 
     # Footer padding (to fill the last block to 2880 bytes) ###################
-    ln = naxis1 * row_count
-    footer = '\x00' * (2880 * (ln // 2880 + 1) - ln)
+    if footer:
+        # if the file is created in parts, only the last part is generated with the footer
+        ln = naxis1 * (row_count if header else nrows)
+        padding = '\x00' * (2880 * (ln // 2880 + 1) - ln)
+
+        yield padding.encode()
+
+
+def generate_parquet(generator, fields, row_group_size=100000):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # store the column metadata as field metadata, all other datatypes are stored as strings
+    schema = pa.schema([
+        pa.field(field['name'], get_parquet_type(field.get('datatype')), metadata={
+            key: str(field[key]) for key in ['unit', 'ucd', 'utype', 'description', 'datatype'] if field.get(key)
+        }) for field in fields
+    ])
+
+    # the writer writes into a stream which is emptied after each row group,
+    # so that only one row group is held in memory at a time
+    stream = BufferStream()
+    writer = pq.ParquetWriter(pa.PythonFile(stream, mode='w'), schema)
+
+    try:
+        for rows in generate_chunks(generator, row_group_size):
+            columns = zip(*rows) if fields else []
+            writer.write_table(pa.Table.from_arrays([
+                pack_parquet_column(column, field.type) for column, field in zip(columns, schema)
+            ], schema=schema), row_group_size=row_group_size)
+
+            yield stream.pop()
+    finally:
+        writer.close()
+
+    yield stream.pop()
+
+
+class BufferStream(io.RawIOBase):
+    # a write-only, non-seekable file object which keeps the written bytes only until they are popped
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def get_parquet_type(datatype):
+    import pyarrow as pa
+
+    if datatype == 'timestamp':
+        return pa.timestamp('us')
+    elif datatype in PARQUET_DATATYPES:
+        return getattr(pa, PARQUET_DATATYPES[datatype])()
+    else:
+        return pa.string()
+
+
+def pack_parquet_column(column, arrow_type):
+    import pyarrow as pa
+
+    # NULL values come as 'NULL' strings from the dump adapters or as None from a cursor
+    values = [None if value is None or value == 'NULL' else value for value in column]
+
+    if pa.types.is_boolean(arrow_type):
+        return pa.array([None if value is None else value in (True, 'true', 't') for value in values], type=arrow_type)
+
+    elif pa.types.is_string(arrow_type):
+        return pa.array([value if value is None or isinstance(value, str) else str(value) for value in values], type=arrow_type)
+
+    elif any(isinstance(value, str) for value in values):
+        # strings from the dump adapters are parsed by arrow
+        return pa.array(values, type=pa.string()).cast(arrow_type)
+
+    else:
+        return pa.array(values, type=arrow_type)
+
+
+def generate_compressed(generator, encoding, level=None):
+    # compress the chunks of another generator incrementally using gzip or zstd
+    if encoding == 'gzip':
+        compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif encoding == 'zstd':
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=3 if level is None else level).compressobj()
+    else:
+        raise Exception('Not supported.')
+
+    for chunk in generator:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+def generate_zip(base_path, file_paths, max_workers=4, read_ahead=8, read_ahead_size=16777216, chunk_size=1048576):
+    # the zip file is written into a non-seekable stream, so zipfile uses data descriptors
+    # and ZIP64 extensions if needed, and the stream is emptied after each file or chunk
+    stream = BufferStream()
+    zip_file = zipfile.ZipFile(stream, 'w', allowZip64=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # read the next files in parallel, but keep only read_ahead files in memory
+        entries = deque()
+        file_paths = iter(file_paths)
+
+        def read_ahead_files():
+            while len(entries) < read_ahead:
+                try:
+                    file_path = next(file_paths)
+                except StopIteration:
+                    return
+
+                absolute_path = os.path.join(base_path, file_path)
+                entries.append((file_path, absolute_path, executor.submit(read_zip_file, absolute_path, read_ahead_size)))
+
+        read_ahead_files()
+
+        while entries:
+            file_path, absolute_path, future = entries.popleft()
+            read_ahead_files()
+
+            zip_info = zipfile.ZipInfo.from_file(absolute_path, file_path)
+            zip_info.compress_type = zipfile.ZIP_STORED if file_path.lower().endswith(ZIP_STORED_EXTENSIONS) \
+                else zipfile.ZIP_DEFLATED
+
+            data = future.result()
+            with zip_file.open(zip_info, 'w') as f:
+                if data is not None:
+                    f.write(data)
+                else:
+                    # large files are read in chunks here
+                    with open(absolute_path, 'rb') as large_file:
+                        for chunk in iter(lambda: large_file.read(chunk_size), b''):
+                            f.write(chunk)
+                            yield stream.pop()
+
+            yield stream.pop()
+
+    zip_file.close()
+    yield stream.pop()
+
+
+def read_zip_file(file_path, read_ahead_size):
+    # small files are read completely, large files are read later
+    if os.path.getsize(file_path) <= read_ahead_size:
+        with open(file_path, 'rb') as f:
+            return f.read()
+    else:
+        return None
+
+
+def format_votable_number(cell):
+    return '' if cell is None or cell == 'NULL' else str(cell)
+
+
+def format_votable_string(cell):
+    return '' if cell is None or cell == 'NULL' else escape(str(cell))
+
+
+def get_binary2_encoder(field):
+    # returns a function which encodes a (non NULL) cell and the bytes written for NULL values
+    datatype = field.get('datatype')
+
+    if datatype == 'boolean':
+        return (lambda cell: b'T' if cell in (True, 'true', 't') else b'F'), b'?'
+
+    elif datatype in BINARY2_FORMATS:
+        packer = struct.Struct(BINARY2_FORMATS[datatype])
+        cast = float if datatype in ('float', 'double') else int
+        null = packer.pack(float('nan') if cast is float else 0)
+        return (lambda cell: packer.pack(cast(cell))), null
+
+    else:
+        return encode_binary2_string, b'\x00\x00\x00\x00'
+
+
+def encode_binary2_string(cell):
+    # unicodeChar is UCS-2, the length is the number of 2 byte characters
+    value = (cell if isinstance(cell, str) else str(cell)).encode('utf-16-be')
+    return (len(value) // 2).to_bytes(4, 'big') + value
+
+
+def generate_chunks(generator, chunk_size):
+    chunk = []
+    for row in generator:
+        if row:
+            chunk.append(row)
+
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def pack_fits_column(column, fits_dtype, fits_format, null_value):
+    # fromiter keeps lists (from array columns) as single cells
+    values = np.fromiter(column, dtype=object, count=len(column))
+
+    # NULL values come as 'NULL' strings from the dump adapters or as None from a cursor
+    nulls = (values == None) | (values == 'NULL')  # noqa: E711
+
+    if fits_format == 'L':
+        values = np.where((values == True) | (values == 'true') | (values == 't'), b'T', b'F')  # noqa: E712
+    elif fits_format == 'A':
+        values = np.char.encode(values.astype(str), 'utf-8')
 
-    yield footer.encode()
+    # the cast converts the remaining strings from the dump adapters and truncates long strings
+    return np.where(nulls, null_value, values).astype(fits_dtype)
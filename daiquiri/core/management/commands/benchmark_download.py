@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from daiquiri.core.adapter import DatabaseAdapter
+from daiquiri.core.utils import import_class
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema', help='the schema for the table to download')
+        parser.add_argument('table', help='the table to download')
+        parser.add_argument('--format', action='append', dest='formats', help='the format(s) to benchmark, default: csv')
+        parser.add_argument('--adapter', action='append', dest='adapters', help='the download adapter(s) to benchmark, default: ADAPTER_DOWNLOAD')
+
+    def handle(self, *args, **options):
+        schema_name, table_name = options['schema'], options['table']
+
+        formats = options['formats'] or ['csv']
+        adapters = options['adapters'] or [settings.ADAPTER_DOWNLOAD]
+
+        database_adapter = DatabaseAdapter()
+        columns = database_adapter.fetch_columns(schema_name, table_name)
+        nrows = database_adapter.count_rows(schema_name, table_name)
+
+        self.stdout.write('%s.%s: %d rows, %d columns' % (schema_name, table_name, nrows, len(columns)))
+
+        for adapter_class in adapters:
+            adapter = import_class(adapter_class)('data', settings.DATABASES['data'])
+
+            for format_key in formats:
+                size = 0
+                start_time = time.perf_counter()
+
+                for chunk in adapter.generate(format_key, columns, schema_name=schema_name, table_name=table_name, nrows=nrows):
+                    size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+
+                duration = time.perf_counter() - start_time
+
+                self.stdout.write('%s %s: %.2fs, %.0f rows/s, %.2f MB/s (%d bytes)' % (
+                    adapter_class.rsplit('.', 1)[1],
+                    format_key,
+                    duration,
+                    nrows / duration,
+                    size / duration / 1e6,
+                    size
+                ))
@@ -0,0 +1,74 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from daiquiri.core.generators import (generate_csv, generate_votable, generate_votable_binary2,
+                                      generate_fits, generate_parquet)
+
+DATATYPES = ('short', 'int', 'long', 'float', 'double', 'boolean', 'char', 'timestamp')
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='the number of rows, default: 100000')
+        parser.add_argument('--columns', type=int, default=20, help='the number of columns, default: 20')
+        parser.add_argument('--nulls', type=float, default=0.0, help='the fraction of NULL values, default: 0')
+
+    def handle(self, *args, **options):
+        nrows = options['rows']
+
+        fields = [{
+            'name': 'column_%i' % i,
+            'datatype': DATATYPES[i % len(DATATYPES)],
+            'arraysize': 32 if DATATYPES[i % len(DATATYPES)] == 'char' else None
+        } for i in range(options['columns'])]
+
+        rows = self.get_rows(fields, nrows, options['nulls'])
+
+        generators = {
+            'csv': lambda: generate_csv(iter(rows), fields),
+            'votable': lambda: generate_votable(iter(rows), fields),
+            'votable-binary2': lambda: generate_votable_binary2(iter(rows), fields),
+            'fits': lambda: generate_fits(iter(rows), fields, nrows),
+            'parquet': lambda: generate_parquet(iter(rows), fields)
+        }
+
+        for format_key, generator in generators.items():
+            size = 0
+            chunks = 0
+            start_time = time.perf_counter()
+
+            for chunk in generator():
+                size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+                chunks += 1
+
+            duration = time.perf_counter() - start_time
+
+            self.stdout.write('%s: %.2fs, %.0f rows/s, %.2f MB/s (%d bytes in %d chunks)' % (
+                format_key,
+                duration,
+                nrows / duration,
+                size / duration / 1e6,
+                size,
+                chunks
+            ))
+
+    def get_rows(self, fields, nrows, nulls):
+        values = {
+            'short': lambda: random.randint(-32000, 32000),
+            'int': lambda: random.randint(-2**31, 2**31 - 1),
+            'long': lambda: random.randint(-2**63, 2**63 - 1),
+            'float': lambda: random.random(),
+            'double': lambda: random.gauss(0, 1e10),
+            'boolean': lambda: random.random() > 0.5,
+            'char': lambda: random.choice(['M31', 'NGC 1068', 'Gaia DR2 4551299946478123136', 'a < b & c']),
+            'timestamp': lambda: datetime.datetime(2000, 1, 1) + datetime.timedelta(seconds=random.randint(0, 10**9))
+        }
+
+        return [
+            [None if random.random() < nulls else values[field['datatype']]() for field in fields]
+            for i in range(nrows)
+        ]
@@ -0,0 +1,99 @@
+import time
+import tracemalloc
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from daiquiri.core.adapter import DatabaseAdapter
+
+DATATYPES = (
+    ('short', 'i2'),
+    ('int', 'i4'),
+    ('long', 'i8'),
+    ('float', 'f4'),
+    ('double', 'f8'),
+    ('boolean', '?'),
+    ('char', 'U32')
+)
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, action='append', help='the number(s) of rows, default: 10000, 1000000, 10000000')
+        parser.add_argument('--columns', type=int, default=14, help='the number of columns, default: 14')
+        parser.add_argument('--nulls', type=float, default=0.0, help='the fraction of NULL values, default: 0')
+        parser.add_argument('--method', action='append', dest='methods', help='the method(s) to benchmark, copy and/or insert, default: copy')
+        parser.add_argument('--schema', default=settings.TAP_UPLOAD, help='the schema for the temporary table, default: TAP_UPLOAD')
+        parser.add_argument('--trace-memory', action='store_true', help='trace the peak memory used while ingesting')
+
+    def handle(self, *args, **options):
+        schema_name = options['schema']
+        table_name = 'benchmark_ingest'
+
+        adapter = DatabaseAdapter()
+
+        columns = [{
+            'name': 'column_%i' % i,
+            'datatype': DATATYPES[i % len(DATATYPES)][0]
+        } for i in range(options['columns'])]
+
+        for nrows in options['rows'] or [10000, 1000000, 10000000]:
+            rows, mask = self.get_rows(columns, nrows, options['nulls'])
+
+            for method in options['methods'] or ['copy']:
+                adapter.drop_table(schema_name, table_name)
+                adapter.create_table(schema_name, table_name, columns)
+
+                if options['trace_memory']:
+                    tracemalloc.start()
+
+                start_time = time.perf_counter()
+
+                if method == 'insert':
+                    adapter.insert_rows(schema_name, table_name, columns, rows, mask)
+                else:
+                    adapter.copy_rows(schema_name, table_name, columns, rows, mask)
+
+                duration = time.perf_counter() - start_time
+
+                if options['trace_memory']:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                else:
+                    peak = None
+
+                self.stdout.write('%s %d rows: %.2fs, %.0f rows/s%s' % (
+                    method,
+                    nrows,
+                    duration,
+                    nrows / duration,
+                    ', peak memory %.2f MB' % (peak / 1e6) if peak is not None else ''
+                ))
+
+        adapter.drop_table(schema_name, table_name)
+
+    def get_rows(self, columns, nrows, nulls):
+        rng = np.random.default_rng()
+
+        dtype = [(column['name'], dict(DATATYPES)[column['datatype']]) for column in columns]
+        rows = np.zeros(nrows, dtype=dtype)
+
+        for name, column_dtype in dtype:
+            if column_dtype == '?':
+                rows[name] = rng.random(nrows) > 0.5
+            elif column_dtype.startswith('U'):
+                rows[name] = rng.choice(['M31', 'NGC 1068', 'Gaia DR2 4551299946478123136', 'a "b", c'], nrows)
+            elif column_dtype.startswith('i'):
+                info = np.iinfo(column_dtype)
+                rows[name] = rng.integers(info.min, info.max, nrows, dtype=column_dtype)
+            else:
+                rows[name] = rng.normal(0, 1e10, nrows)
+
+        mask = np.zeros(nrows, dtype=[(name, '?') for name, column_dtype in dtype])
+        if nulls:
+            for name, column_dtype in dtype:
+                mask[name] = rng.random(nrows) < nulls
+
+        return rows, mask
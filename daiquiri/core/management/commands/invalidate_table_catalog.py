@@ -0,0 +1,20 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from daiquiri.core.adapter import DatabaseAdapter
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema', help='the schema of the table which was changed')
+        parser.add_argument('table', help='the table which was changed')
+
+    def handle(self, *args, **options):
+        DatabaseAdapter().invalidate_table_catalog(options['schema'], options['table'])
+
+        if apps.is_installed('daiquiri.metadata'):
+            from daiquiri.metadata.utils import invalidate_column_catalog
+            invalidate_column_catalog(options['schema'], options['table'])
+
+        self.stdout.write('Invalidated the catalog of %s.%s.' % (options['schema'], options['table']))
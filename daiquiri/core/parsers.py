@@ -0,0 +1,616 @@
+import base64
+import csv
+import io
+import re
+import struct
+from xml.parsers import expat
+
+import numpy as np
+
+BATCH_DTYPES = {
+    'boolean': '?',
+    'short': 'i2',
+    'int': 'i4',
+    'long': 'i8',
+    'float': 'f8',
+    'double': 'f8',
+    'char': 'O'
+}
+
+VOTABLE_DATATYPES = {
+    'boolean': 'boolean',
+    'bit': 'boolean',
+    'unsignedByte': 'short',
+    'short': 'short',
+    'int': 'int',
+    'long': 'long',
+    'float': 'float',
+    'double': 'double',
+    'char': 'char',
+    'unicodeChar': 'char'
+}
+
+VOTABLE_BINARY_FORMATS = {
+    'unsignedByte': '>B',
+    'short': '>h',
+    'int': '>i',
+    'long': '>q',
+    'float': '>f',
+    'double': '>d'
+}
+
+# FITS format, VO datatype, numpy dtype
+FITS_FORMATS = {
+    'L': ('boolean', 'S1'),
+    'B': ('short', 'u1'),
+    'I': ('short', '>i2'),
+    'J': ('int', '>i4'),
+    'K': ('long', '>i8'),
+    'E': ('float', '>f4'),
+    'D': ('double', '>f8'),
+    'A': ('char', 'S')
+}
+
+FITS_BLOCK_SIZE = 2880
+
+CSV_TRUE_VALUES = ('t', 'true')
+CSV_FALSE_VALUES = ('f', 'false')
+
+
+def get_parser(stream, batch_size=10000):
+    # guess the format of the table from the first bytes of the stream,
+    # the stream needs to be an io.BufferedReader (e.g. from open(file_path, 'rb'))
+    head = stream.peek(FITS_BLOCK_SIZE)[:FITS_BLOCK_SIZE].lstrip(b'\xef\xbb\xbf \t\r\n')
+
+    if head.startswith(b'SIMPLE'):
+        return FITSParser(stream, batch_size)
+    elif head.startswith(b'<'):
+        return VOTableParser(stream, batch_size)
+    else:
+        return CSVParser(stream, batch_size)
+
+
+def get_batch(fields, rows):
+    # convert a list of rows (with None for NULL) to a numpy array and a mask
+    dtype = [('column_%i' % i, BATCH_DTYPES[field['datatype']]) for i, field in enumerate(fields)]
+
+    batch = np.zeros(len(rows), dtype=dtype)
+    mask = np.zeros(len(rows), dtype=[(name, '?') for name, column_dtype in dtype])
+
+    for i, (name, column_dtype) in enumerate(dtype):
+        values = [row[i] for row in rows]
+        mask[name] = [value is None for value in values]
+        batch[name] = [(0 if column_dtype != 'O' else '') if value is None else value for value in values]
+
+    return batch, mask
+
+
+def parse_int(value):
+    # integers in VOTables can also be hexadecimal
+    value = value.strip()
+    return int(value, 16) if value.lower().startswith('0x') else int(value)
+
+
+class VOTableParser(object):
+    '''
+    Parses the first TABLE of a VOTable incrementally using expat. The FIELDs are
+    available after the parser was created, the rows are yielded in batches while
+    the stream is read. TABLEDATA, BINARY and BINARY2 serializations are supported.
+    '''
+
+    def __init__(self, stream, batch_size=10000, chunk_size=65536):
+        self.stream = stream
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+
+        self.fields = []
+        self.rows = []
+        self.serialization = None
+        self.done = False
+
+        self.tables = 0
+        self.field = None
+        self.row = None
+        self.text = None
+        self.base64 = ''
+        self.buffer = bytearray()
+
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.character_data
+
+        # read the stream until the data of the table starts
+        while self.serialization is None and not self.done:
+            self.feed()
+
+        if not self.fields:
+            raise ValueError('The VOTable does not contain a table.')
+
+    def __iter__(self):
+        while True:
+            if len(self.rows) >= self.batch_size or (self.done and self.rows):
+                rows, self.rows = self.rows[:self.batch_size], self.rows[self.batch_size:]
+                yield get_batch(self.fields, rows)
+            elif self.done:
+                break
+            else:
+                self.feed()
+
+    def feed(self):
+        chunk = self.stream.read(self.chunk_size)
+
+        try:
+            self.parser.Parse(chunk, not chunk)
+        except expat.ExpatError as e:
+            raise ValueError('The VOTable could not be parsed (%s).' % e)
+
+        if not chunk:
+            if self.buffer:
+                raise ValueError('The binary stream of the VOTable is truncated.')
+            self.done = True
+
+    def start_element(self, tag, attrs):
+        tag = tag.rsplit(':', 1)[-1]
+
+        if self.done:
+            pass
+
+        elif tag == 'TABLE':
+            self.tables += 1
+
+        elif self.tables != 1:
+            pass
+
+        elif tag == 'FIELD':
+            self.field = self.get_field(attrs)
+            self.fields.append(self.field)
+
+        elif tag == 'VALUES' and self.field is not None:
+            self.field['null'] = attrs.get('null')
+
+        elif tag == 'DESCRIPTION' and self.field is not None:
+            self.text = []
+
+        elif tag in ('TABLEDATA', 'BINARY', 'BINARY2'):
+            self.serialization = tag
+            self.decoders = [self.get_decoder(field) for field in self.fields]
+
+        elif tag == 'FITS':
+            raise ValueError('FITS serialization inside of a VOTable is not supported.')
+
+        elif tag == 'STREAM':
+            if 'href' in attrs:
+                raise ValueError('Remote streams inside of a VOTable are not supported.')
+            if attrs.get('encoding') != 'base64':
+                raise ValueError('Only base64 encoded streams are supported.')
+
+            self.text = None
+
+        elif tag == 'TR':
+            self.row = []
+
+        elif tag == 'TD':
+            self.text = []
+
+    def end_element(self, tag):
+        tag = tag.rsplit(':', 1)[-1]
+
+        if self.done or self.tables != 1:
+            pass
+
+        elif tag == 'TABLE':
+            # only the first table is parsed
+            self.done = True
+
+        elif tag == 'FIELD':
+            self.field = None
+
+        elif tag == 'DESCRIPTION' and self.field is not None:
+            self.field['description'] = ''.join(self.text).strip()
+            self.text = None
+
+        elif tag == 'TD':
+            self.row.append(''.join(self.text))
+            self.text = None
+
+        elif tag == 'TR':
+            self.rows.append(self.decode_text_row(self.row))
+            self.row = None
+
+    def character_data(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+        elif self.serialization in ('BINARY', 'BINARY2') and not self.done:
+            # decode the base64 data in multiples of 4 characters
+            self.base64 += ''.join(data.split())
+            length = len(self.base64) - len(self.base64) % 4
+            self.buffer += base64.b64decode(self.base64[:length])
+            self.base64 = self.base64[length:]
+
+            self.decode_binary_rows()
+
+    def get_field(self, attrs):
+        name = attrs.get('name') or attrs.get('ID')
+        datatype = attrs.get('datatype')
+        arraysize = attrs.get('arraysize')
+
+        if datatype not in VOTABLE_DATATYPES:
+            raise ValueError('The datatype "%s" of the field "%s" is not supported.' % (datatype, name))
+
+        if arraysize not in (None, '1') and (VOTABLE_DATATYPES[datatype] != 'char' or 'x' in arraysize):
+            raise ValueError('The arraysize "%s" of the field "%s" is not supported.' % (arraysize, name))
+
+        return {
+            'name': name,
+            'datatype': VOTABLE_DATATYPES[datatype],
+            'votable_datatype': datatype,
+            'arraysize': arraysize,
+            'unit': attrs.get('unit'),
+            'ucd': attrs.get('ucd')
+        }
+
+    def get_decoder(self, field):
+        null = field.get('null')
+
+        if field['datatype'] == 'boolean':
+            return lambda value: {'t': True, 'true': True, '1': True, 'f': False, 'false': False, '0': False}.get(value.strip().lower())
+
+        elif field['datatype'] in ('short', 'int', 'long'):
+            return lambda value: None if (not value.strip() or value.strip() == null) else parse_int(value)
+
+        elif field['datatype'] in ('float', 'double'):
+            return lambda value: None if (not value.strip() or value.strip() == null) else float(value)
+
+        else:
+            return lambda value: value or None
+
+    def decode_text_row(self, row):
+        # missing cells are NULL
+        row += [''] * (len(self.decoders) - len(row))
+
+        try:
+            return [decode(value) for decode, value in zip(self.decoders, row)]
+        except ValueError:
+            raise ValueError('Row %i of the VOTable could not be parsed.' % (len(self.rows) + 1))
+
+    def decode_binary_rows(self):
+        offset = 0
+        while True:
+            row, row_offset = self.decode_binary_row(offset)
+            if row is None:
+                break
+
+            self.rows.append(row)
+            offset = row_offset
+
+        del self.buffer[:offset]
+
+    def decode_binary_row(self, offset):
+        # returns (None, offset) if the buffer does not contain the complete row
+        row = []
+
+        if self.serialization == 'BINARY2':
+            # the NULL flags for the row, the first column is the most significant bit
+            null_bytes = (len(self.fields) + 7) // 8
+            if len(self.buffer) < offset + null_bytes:
+                return None, offset
+
+            nulls = int.from_bytes(self.buffer[offset:offset + null_bytes], 'big')
+            offset += null_bytes
+        else:
+            null_bytes, nulls = 0, 0
+
+        for i, field in enumerate(self.fields):
+            if field['datatype'] == 'char':
+                width = 2 if field['votable_datatype'] == 'unicodeChar' else 1
+
+                if field['arraysize'] is not None and field['arraysize'].endswith('*'):
+                    if len(self.buffer) < offset + 4:
+                        return None, offset
+
+                    length = struct.unpack_from('>I', self.buffer, offset)[0] * width
+                    offset += 4
+                else:
+                    length = int(field['arraysize'] or 1) * width
+
+                if len(self.buffer) < offset + length:
+                    return None, offset
+
+                value = bytes(self.buffer[offset:offset + length])
+                value = value.decode('utf-16-be' if width == 2 else 'utf-8', errors='replace').rstrip('\x00') or None
+                offset += length
+
+            elif field['votable_datatype'] == 'bit':
+                if len(self.buffer) < offset + 1:
+                    return None, offset
+
+                # a single bit is stored in a whole byte
+                value = self.buffer[offset] != 0
+                offset += 1
+
+            elif field['datatype'] == 'boolean':
+                if len(self.buffer) < offset + 1:
+                    return None, offset
+
+                value = {b'T': True, b't': True, b'1': True, b'F': False, b'f': False, b'0': False}.get(
+                    bytes(self.buffer[offset:offset + 1])
+                )
+                offset += 1
+
+            else:
+                binary_format = VOTABLE_BINARY_FORMATS[field['votable_datatype']]
+                size = struct.calcsize(binary_format)
+                if len(self.buffer) < offset + size:
+                    return None, offset
+
+                value = struct.unpack_from(binary_format, self.buffer, offset)[0]
+                offset += size
+
+                if value != value or (field.get('null') is not None and str(value) == field['null']):
+                    value = None
+
+            if nulls and nulls & (1 << (null_bytes * 8 - 1 - i)):
+                value = None
+
+            row.append(value)
+
+        return row, offset
+
+
+class FITSParser(object):
+    '''
+    Parses the first BINTABLE extension of a FITS file incrementally. The rows are
+    read from the stream in batches and decoded using numpy.
+    '''
+
+    def __init__(self, stream, batch_size=10000):
+        self.stream = stream
+        self.batch_size = batch_size
+
+        # skip the primary HDU and all other extensions before the first BINTABLE
+        while True:
+            header = self.read_header()
+            if header.get('XTENSION') == 'BINTABLE':
+                break
+
+            self.skip(self.get_data_size(header))
+
+        self.nrows = header.get('NAXIS2', 0)
+        self.row_size = header.get('NAXIS1', 0)
+
+        self.fields = []
+        self.names = []
+        self.formats = []
+        self.offsets = []
+        self.nulls = []
+
+        offset = 0
+        for i in range(1, header.get('TFIELDS', 0) + 1):
+            name = header.get('TTYPE%i' % i, 'col%i' % i)
+
+            match = re.match(r'^(\d*)([A-Z])', header.get('TFORM%i' % i, ''))
+            if not match or match.group(2) not in FITS_FORMATS:
+                raise ValueError('The format of the column "%s" is not supported.' % name)
+
+            repeat = int(match.group(1) or 1)
+            datatype, dtype = FITS_FORMATS[match.group(2)]
+
+            if dtype == 'S':
+                dtype = 'S%i' % repeat
+                size = repeat
+            elif repeat != 1:
+                raise ValueError('The column "%s" is an array, which is not supported.' % name)
+            else:
+                size = np.dtype(dtype).itemsize
+
+            if header.get('TSCAL%i' % i, 1) != 1 or header.get('TZERO%i' % i, 0) != 0:
+                raise ValueError('Scaled columns like "%s" are not supported.' % name)
+
+            self.fields.append({
+                'name': name,
+                'datatype': datatype,
+                'arraysize': str(repeat) if datatype == 'char' else None,
+                'unit': header.get('TUNIT%i' % i),
+                'ucd': header.get('TUCD%i' % i)
+            })
+            self.names.append('column_%i' % i)
+            self.formats.append(dtype)
+            self.offsets.append(offset)
+            self.nulls.append(header.get('TNULL%i' % i))
+
+            offset += size
+
+        self.dtype = np.dtype({
+            'names': self.names,
+            'formats': self.formats,
+            'offsets': self.offsets,
+            'itemsize': self.row_size
+        })
+
+    def __iter__(self):
+        for start in range(0, self.nrows, self.batch_size):
+            nrows = min(self.batch_size, self.nrows - start)
+            data = self.read(nrows * self.row_size)
+            if len(data) < nrows * self.row_size:
+                raise ValueError('The FITS file is truncated.')
+
+            yield self.get_batch(np.frombuffer(data, dtype=self.dtype))
+
+    def get_batch(self, data):
+        batch = np.zeros(len(data), dtype=[(name, BATCH_DTYPES[field['datatype']])
+                                           for name, field in zip(self.names, self.fields)])
+        mask = np.zeros(len(data), dtype=[(name, '?') for name in self.names])
+
+        for name, field, null in zip(self.names, self.fields, self.nulls):
+            values = data[name]
+
+            if field['datatype'] == 'boolean':
+                mask[name] = (values != b'T') & (values != b'F')
+                batch[name] = values == b'T'
+            elif field['datatype'] == 'char':
+                # strings are padded with spaces or NUL characters
+                values = np.char.rstrip(values)
+                mask[name] = values == b''
+                batch[name] = values
+            elif field['datatype'] in ('float', 'double'):
+                mask[name] = np.isnan(values)
+                batch[name] = values
+            else:
+                if null is not None:
+                    mask[name] = values == null
+                batch[name] = values
+
+        return batch, mask
+
+    def read(self, size):
+        # read exactly size bytes, unless the stream ends
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+
+        return bytes(data)
+
+    def skip(self, size):
+        for start in range(0, size, 1048576):
+            if not self.read(min(1048576, size - start)):
+                raise ValueError('The FITS file does not contain a binary table.')
+
+    def read_header(self):
+        header = {}
+        while True:
+            block = self.read(FITS_BLOCK_SIZE)
+            if len(block) < FITS_BLOCK_SIZE:
+                raise ValueError('The FITS file does not contain a binary table.')
+
+            for start in range(0, FITS_BLOCK_SIZE, 80):
+                card = block[start:start + 80].decode('ascii', errors='replace')
+                keyword = card[:8].strip()
+
+                if keyword == 'END':
+                    return header
+                elif card[8:10] == '= ':
+                    header[keyword] = self.parse_value(card[10:])
+
+    def parse_value(self, value):
+        value = value.strip()
+
+        if value.startswith("'"):
+            # strings are quoted, quotes inside the string are doubled
+            match = re.match(r"'((?:[^']|'')*)'", value)
+            return match.group(1).replace("''", "'").rstrip() if match else ''
+
+        value = value.split('/', 1)[0].strip()
+        if value == 'T':
+            return True
+        elif value == 'F':
+            return False
+
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                return value
+
+    def get_data_size(self, header):
+        if not header.get('NAXIS'):
+            return 0
+
+        size = abs(header.get('BITPIX', 8)) // 8 * header.get('GCOUNT', 1)
+        size *= header.get('PCOUNT', 0) + int(np.prod([header.get('NAXIS%i' % i, 0)
+                                                       for i in range(1, header['NAXIS'] + 1)]))
+
+        # the data is padded to a multiple of the block size
+        return -(-size // FITS_BLOCK_SIZE) * FITS_BLOCK_SIZE
+
+
+class CSVParser(object):
+    '''
+    Parses a CSV file with a header row incrementally. The datatypes of the columns
+    are inferred from the first batch of rows, empty cells are NULL.
+    '''
+
+    def __init__(self, stream, batch_size=10000):
+        self.batch_size = batch_size
+        self.reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+
+        try:
+            names = next(self.reader)
+        except StopIteration:
+            raise ValueError('The CSV file is empty.')
+
+        self.rows = self.read_rows()
+
+        self.fields = [{
+            'name': name.strip(),
+            'datatype': self.infer_datatype([row[i] if i < len(row) else '' for row in self.rows]),
+            'arraysize': None,
+            'unit': None,
+            'ucd': None
+        } for i, name in enumerate(names)]
+
+        self.decoders = [self.get_decoder(field) for field in self.fields]
+
+    def __iter__(self):
+        rows = self.rows
+        self.rows = None
+
+        while rows:
+            yield get_batch(self.fields, [self.decode_row(row) for row in rows])
+            rows = self.read_rows()
+
+    def read_rows(self):
+        rows = []
+        for row in self.reader:
+            if row:
+                rows.append(row)
+                if len(rows) >= self.batch_size:
+                    break
+
+        return rows
+
+    def infer_datatype(self, values):
+        values = [value.strip() for value in values if value.strip()]
+
+        if not values:
+            return 'char'
+
+        for datatype, decode in (('long', int), ('double', float)):
+            try:
+                for value in values:
+                    decode(value)
+            except ValueError:
+                continue
+            else:
+                return datatype
+
+        if all(value.lower() in CSV_TRUE_VALUES + CSV_FALSE_VALUES for value in values):
+            return 'boolean'
+
+        return 'char'
+
+    def get_decoder(self, field):
+        if field['datatype'] == 'boolean':
+            return lambda value: value.strip().lower() in CSV_TRUE_VALUES
+        elif field['datatype'] == 'long':
+            return int
+        elif field['datatype'] == 'double':
+            return float
+        else:
+            return str
+
+    def decode_row(self, row):
+        # missing cells are NULL
+        row += [''] * (len(self.decoders) - len(row))
+
+        try:
+            return [decode(value) if value.strip() else None for decode, value in zip(self.decoders, row)]
+        except ValueError:
+            raise ValueError('The row "%s" of the CSV file does not match the datatypes of the columns.' % ','.join(row))
@@ -1,4 +1,100 @@
-from django.http import HttpResponseRedirect
+import os
+import re
+
+from sendfile import sendfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponseRedirect
+from django.utils.cache import patch_vary_headers
+
+from daiquiri.core.generators import generate_compressed
+from daiquiri.core.utils import get_accept_encoding
+
+COMPRESSED_CONTENT_TYPES = ('application/gzip', 'application/zstd')
+
 
 class HttpResponseSeeOther(HttpResponseRedirect):
     status_code = 303
+
+
+class CompressedFileResponse(FileResponse):
+    '''
+    Streams a generator like FileResponse, but compresses the chunks on the fly
+    using the best encoding from the Accept-Encoding header of the request.
+    '''
+
+    def __init__(self, request, streaming_content=(), *args, **kwargs):
+        if kwargs.get('content_type') in COMPRESSED_CONTENT_TYPES:
+            encoding = None
+        else:
+            encoding = get_accept_encoding(request)
+
+        if encoding:
+            streaming_content = generate_compressed(streaming_content, encoding)
+
+        super().__init__(streaming_content, *args, **kwargs)
+
+        if encoding:
+            self['Content-Encoding'] = encoding
+
+        patch_vary_headers(self, ('Accept-Encoding', ))
+
+
+class RangeFileResponse(FileResponse):
+    '''
+    Sends a file like FileResponse, but answers requests with a single byte range
+    in the Range header with the requested part of the file (206 Partial Content).
+    '''
+
+    def __init__(self, request, file_path, *args, **kwargs):
+        super().__init__(open(file_path, 'rb'), *args, **kwargs)
+
+        self['Accept-Ranges'] = 'bytes'
+
+        match = re.match(r'^bytes=(\d*)-(\d*)$', request.META.get('HTTP_RANGE', '').strip())
+        if match and any(match.groups()):
+            file_size = os.path.getsize(file_path)
+            start, end = match.groups()
+
+            if start:
+                start, end = int(start), min(int(end), file_size - 1) if end else file_size - 1
+            else:
+                # a suffix range, e.g. the last 500 bytes
+                start, end = max(file_size - int(end), 0), file_size - 1
+
+            if start > end:
+                self.status_code = 416
+                self.streaming_content = []
+                self['Content-Range'] = 'bytes */%d' % file_size
+                self['Content-Length'] = 0
+            else:
+                file_to_stream = self.file_to_stream
+                file_to_stream.seek(start)
+
+                self.status_code = 206
+                self.streaming_content = self.read_range(file_to_stream, end - start + 1)
+                self['Content-Range'] = 'bytes %d-%d/%d' % (start, end, file_size)
+                self['Content-Length'] = end - start + 1
+
+    def read_range(self, f, length):
+        while length > 0:
+            data = f.read(min(self.block_size, length))
+            if not data:
+                break
+
+            length -= len(data)
+            yield data
+
+
+def send_file(request, file_path, attachment=False, attachment_filename=None):
+    if settings.SENDFILE_BACKEND == 'sendfile.backends.simple':
+        # the simple backend of django-sendfile does not support range requests
+        return RangeFileResponse(request, file_path, as_attachment=attachment, filename=attachment_filename or '')
+    else:
+        response = sendfile(request, file_path, attachment=attachment, attachment_filename=attachment_filename)
+
+        # compressed files, e.g. .csv.gz, are sent as they are and not with a content encoding
+        if response.has_header('Content-Encoding'):
+            del response['Content-Encoding']
+
+        return response
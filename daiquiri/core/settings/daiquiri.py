@@ -26,3 +26,20 @@ SITE_SUBJECTS = [
 ]
 SITE_TYPE = 'service'
 SITE_LOGO_URL = None
+
+# tables with fewer rows (according to the statistics) are always counted exactly
+COUNT_ROWS_EXACT_LIMIT = 100000
+COUNT_ROWS_CACHE_TIMEOUT = 3600
+
+# the columns, keys and indexes of the tables in the data database are cached for the row endpoints, tables
+# which are changed outside of daiquiri need to be invalidated using ./manage.py invalidate_table_catalog,
+# which also invalidates the column catalog of the metadata app (see METADATA_COLUMN_CATALOG_TIMEOUT)
+TABLE_CATALOG_CACHE_TIMEOUT = 3600
+
+# the rows of downloads and cross-matches are streamed from a server-side cursor in an open transaction,
+# PostgreSQL terminates the session if the client does not read for n seconds (MySQL uses net_write_timeout)
+DATABASE_STREAM_IDLE_TIMEOUT = 60
+
+# use LOAD DATA LOCAL INFILE for uploads to MySQL, needs local_infile to be enabled for the server
+# and in the OPTIONS of the data database, otherwise the rows are inserted in chunks
+DATABASE_LOCAL_INFILE = False
@@ -40,6 +40,9 @@ DATABASES = {
     'oai': env.get_database('data'),
 }
 
+# keep the connections to the data database open between requests and tasks
+DATABASES['data']['CONN_MAX_AGE'] = int(env.get('DATABASE_DATA_CONN_MAX_AGE', 600))
+
 DATABASES['tap']['OPTIONS'] = {
     'options': '-c search_path=%s' % env.get('TAP_SCHEMA', 'tap_schema')
 }
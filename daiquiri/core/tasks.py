@@ -1,4 +1,4 @@
-from celery import Task as CeleryTask
+from celery import Task as CeleryTask, shared_task
 
 
 class Task(CeleryTask):
@@ -7,3 +7,18 @@ class Task(CeleryTask):
         import logging
         logger = logging.getLogger('daiquiri')
         logger.error(einfo)
+
+
+@shared_task(base=Task)
+def count_rows(schema_name, table_name, column_names, search, filters, search_column_names=None):
+    from django.conf import settings
+    from django.core.cache import cache
+    from daiquiri.core.adapter import DatabaseAdapter
+
+    adapter = DatabaseAdapter()
+
+    count = adapter.count_rows(schema_name, table_name, column_names, search, filters, search_column_names)
+
+    cache_key = adapter.get_count_cache_key(schema_name, table_name, column_names, search, filters, search_column_names)
+    cache.set(cache_key, count, settings.COUNT_ROWS_CACHE_TIMEOUT)
+    cache.delete(cache_key + '.pending')
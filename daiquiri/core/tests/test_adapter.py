@@ -1,8 +1,21 @@
 import logging
+import subprocess
+from unittest import mock
 
-from django.test import TestCase
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connections
+from django.test import SimpleTestCase, TestCase, override_settings
 
 from daiquiri.core.adapter import DatabaseAdapter
+from daiquiri.core.adapter.database.base import BaseDatabaseAdapter, request_health_check
+from daiquiri.core.adapter.database.mysql import MySQLAdapter
+from daiquiri.core.adapter.database.postgres import PostgreSQLAdapter
+from daiquiri.core.adapter.download.cursor import MySQLCursorAdapter, PostgreSQLCursorAdapter
+from daiquiri.core.adapter.download.pgdump import PgDumpAdapter
+from daiquiri.core.tasks import count_rows
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +28,31 @@ class CoreAdapterTestCase(TestCase):
         rows = DatabaseAdapter().fetch_table('daiquiri_data_obs', 'stars')
         self.assertEqual(rows['type'], 'table')
 
+    def test_fetchiter(self):
+        adapter = DatabaseAdapter()
+        sql = 'SELECT %s FROM %s.%s' % (adapter.escape_identifier('id'),
+                                        adapter.escape_identifier('daiquiri_data_obs'),
+                                        adapter.escape_identifier('stars'))
+
+        rows = list(adapter.fetchiter(sql, fetch_size=1000))
+        self.assertEqual(len(rows), 10000)
+
+        # a generator which is not exhausted closes the cursor, the connection can be used again
+        rows = adapter.fetchiter(sql, fetch_size=1000)
+        next(rows)
+        rows.close()
+
+        self.assertEqual(adapter.count_rows('daiquiri_data_obs', 'stars'), 10000)
+
+    @override_settings(DATABASE_STREAM_IDLE_TIMEOUT=30)
+    def test_fetchiter_idle_timeout(self):
+        if connections['data'].vendor != 'postgresql':
+            return
+
+        # the timeout is set for the transaction of the server-side cursor
+        rows = DatabaseAdapter().fetchiter("SELECT current_setting('idle_in_transaction_session_timeout')")
+        self.assertEqual(list(rows), [('30s', )])
+
     def test_fetch_row(self):
         row = DatabaseAdapter().fetch_row('daiquiri_data_obs', 'stars', column_names=None, search=None, filters={
             'id': '4551299946478123136'
@@ -59,3 +97,413 @@ class CoreAdapterTestCase(TestCase):
     def test_count_rows(self):
         row = DatabaseAdapter().count_rows('daiquiri_data_obs', 'stars')
         self.assertEqual(row, 10000)
+
+    def test_fetch_page(self):
+        # walk through the pages using the cursors, ordered by the primary key
+        adapter = DatabaseAdapter()
+        column_names = adapter.fetch_column_names('daiquiri_data_obs', 'stars')
+        ordering = '-' + column_names[0]
+
+        ids = []
+        rows, cursors = adapter.fetch_page('daiquiri_data_obs', 'stars', column_names, ordering, page_size=1000)
+        while True:
+            ids += [row[0] for row in rows]
+            if cursors is None or cursors['next'] is None:
+                break
+
+            rows, cursors = adapter.fetch_page('daiquiri_data_obs', 'stars', column_names, ordering,
+                                               page_size=1000, cursor=cursors['next'])
+
+        if cursors is not None:
+            self.assertEqual(len(ids), 10000)
+            self.assertEqual(len(set(ids)), 10000)
+
+
+class CoreConnectionTestCase(SimpleTestCase):
+
+    def test_health_check(self):
+        connection = mock.Mock(in_atomic_block=False, health_check_needed=False)
+        connection.is_usable.return_value = False
+
+        with mock.patch('daiquiri.core.adapter.database.base.connections') as connections:
+            connections.__getitem__.return_value = connection
+            adapter = BaseDatabaseAdapter('data', {})
+
+            adapter.connection()
+            connection.is_usable.assert_not_called()
+
+            # the connection is checked only once per request or task
+            request_health_check()
+            adapter.connection()
+            adapter.connection()
+            connection.is_usable.assert_called_once_with()
+            connection.close.assert_called_once_with()
+
+
+class CoreCursorAdapterTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    def get_adapter(self):
+        if connections['data'].vendor == 'postgresql':
+            return PostgreSQLCursorAdapter('data', settings.DATABASES['data'])
+        else:
+            return MySQLCursorAdapter('data', settings.DATABASES['data'])
+
+    def test_format_row(self):
+        adapter = PostgreSQLCursorAdapter('data', {})
+        row = adapter.format_row([1, True, False, None, 'a.fits'], prepend={4: 'http://example.com/'})
+        self.assertEqual(row, [1, 'true', 'false', None, 'http://example.com/a.fits'])
+
+        adapter = MySQLCursorAdapter('data', {})
+        row = adapter.format_row([1, True, False, None])
+        self.assertEqual(row, [1, 1, 0, None])
+
+    def test_generate_rows(self):
+        adapter = self.get_adapter()
+        adapter.fetch_size = 1000
+        adapter.set_args('daiquiri_data_obs', 'stars', data_only=True)
+
+        rows = list(adapter.generate_rows())
+        self.assertEqual(len(rows), 10000)
+        self.assertEqual(adapter.rows_written, 10000)
+
+    def test_generate_rows_closed(self):
+        adapter = self.get_adapter()
+        adapter.set_args('daiquiri_data_obs', 'stars', data_only=True)
+
+        # a generator which is not exhausted closes the cursor, the connection can be used again
+        rows = adapter.generate_rows()
+        next(rows)
+        rows.close()
+
+        self.assertEqual(DatabaseAdapter().count_rows('daiquiri_data_obs', 'stars'), 10000)
+
+    @override_settings(DATABASE_STREAM_IDLE_TIMEOUT=30)
+    def test_open_cursor_timeout(self):
+        if connections['data'].vendor != 'postgresql':
+            return
+
+        adapter = self.get_adapter()
+
+        # the timeout is only set for the transaction of the cursor
+        with adapter.open_cursor():
+            with connections['data'].cursor() as cursor:
+                cursor.execute('SHOW idle_in_transaction_session_timeout')
+                self.assertEqual(cursor.fetchone()[0], '30s')
+
+
+class CorePgDumpAdapterTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    columns = [
+        {'name': 'id', 'datatype': 'long'},
+        {'name': 'flag', 'datatype': 'boolean'}
+    ]
+
+    def test_get_copy_sql(self):
+        adapter = PgDumpAdapter('data', {})
+        sql = adapter.get_copy_sql('daiquiri_data_obs', 'stars', self.columns)
+
+        self.assertEqual(sql, 'COPY (SELECT "id", "flag"::text AS "flag" FROM "daiquiri_data_obs"."stars") '
+                              'TO STDOUT WITH (FORMAT csv, HEADER true, NULL \'NULL\')')
+
+    def test_generate_copy_error(self):
+        adapter = PgDumpAdapter('data', {})
+        adapter.args = ['false']
+
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(adapter.generate_copy())
+
+    def test_count_rows(self):
+        adapter = PgDumpAdapter('data', {})
+        data = b'id,text\n1,"a\nb"\n2,"x ""y""\n"\n3,plain\n'
+
+        # the chunks may split a quoted field
+        for chunk_size in (1, 3, 100):
+            adapter.in_quotes = False
+            rows = sum([adapter.count_rows(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)])
+            self.assertEqual(rows, 4)
+
+    @mock.patch.object(PgDumpAdapter, 'has_tid_range_scan', mock.Mock(return_value=False))
+    def test_get_parts_without_tid_range_scan(self):
+        parts = PgDumpAdapter('data', {}).get_parts('csv', 'daiquiri_data_obs', 'stars', 10000, 1000)
+        self.assertEqual(parts, [{'range': None, 'first': True, 'last': True}])
+
+    @mock.patch.object(PgDumpAdapter, 'has_tid_range_scan', mock.Mock(return_value=True))
+    @mock.patch.object(PgDumpAdapter, 'fetch_pages', mock.Mock(return_value=100))
+    def test_get_parts(self):
+        parts = PgDumpAdapter('data', {}).get_parts('csv', 'daiquiri_data_obs', 'stars', 10000, 2500)
+        self.assertEqual([part['range'] for part in parts], [[0, 25], [25, 50], [50, 75], [75, None]])
+        self.assertEqual([(part['first'], part['last']) for part in parts][::3], [(True, False), (False, True)])
+
+
+class CoreCopyTestCase(SimpleTestCase):
+
+    rows = np.ma.array(np.array([
+        (1, True, 1.5, b'M31', 'a "b", c'),
+        (2, False, np.nan, b'', 'ω Cen'),
+        (3, True, np.inf, b'x', '')
+    ], dtype=[('id', 'i8'), ('flag', '?'), ('ra', 'f8'), ('name', 'S8'), ('text', 'U16')]))
+
+    def test_generate_copy_chunks(self):
+        rows = self.rows.copy()
+        rows.mask = np.zeros(3, dtype=rows.mask.dtype)
+        rows.mask[2]['id'] = True
+
+        chunks = list(BaseDatabaseAdapter('data', {}).generate_copy_chunks([(rows.data, rows.mask)], null='NULL'))
+        self.assertEqual(chunks, [
+            '1,1,1.5,"M31","a ""b"", c"\n'
+            '2,0,NULL,"","ω Cen"\n'
+            'NULL,1,inf,"x",""\n'
+        ])
+
+    def test_generate_copy_chunks_mysql(self):
+        # MySQL has no infinite floats
+        chunks = list(MySQLAdapter('data', {}).generate_copy_chunks([(self.rows.data, None)], null='NULL'))
+        self.assertEqual(chunks[0].splitlines()[2], '3,1,NULL,"x",""')
+
+    @override_settings(DATABASE_LOCAL_INFILE=True)
+    def test_copy_batches_mysql_fallback(self):
+        adapter = MySQLAdapter('data', {})
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.execute.side_effect = OperationalError(1148, 'The used command is not allowed')
+
+        with mock.patch.object(adapter, 'connection') as connection, \
+                mock.patch.object(adapter, 'insert_rows') as insert_rows, \
+                mock.patch('daiquiri.core.adapter.database.mysql.transaction'):
+            connection.return_value.cursor.return_value = cursor
+            adapter.copy_batches('schema', 'table', [], [(self.rows.data[:2], None), (self.rows.data[2:], None)])
+
+        # LOAD DATA is tried only once, all batches are inserted
+        self.assertEqual(cursor.__enter__.return_value.execute.call_count, 1)
+        self.assertEqual(insert_rows.call_count, 2)
+
+
+class CoreKeysetTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @mock.patch.object(BaseDatabaseAdapter, 'fetch_unique_columns', mock.Mock(return_value=['id']))
+    def test_get_keyset(self):
+        adapter = BaseDatabaseAdapter('data', {})
+        column_names = ['id', 'ra', 'dec']
+
+        self.assertEqual(adapter.get_keyset('schema', 'table', column_names), ('id', False))
+        self.assertEqual(adapter.get_keyset('schema', 'table', column_names, '-id'), ('id', True))
+
+        # columns without a unique index would need a sort of the whole table
+        self.assertIsNone(adapter.get_keyset('schema', 'table', column_names, 'ra'))
+
+        # without a unique column, keyset pagination is not possible
+        self.assertIsNone(adapter.get_keyset('schema', 'table', ['ra', 'dec']))
+
+    def test_get_keyset_cache(self):
+        adapter = BaseDatabaseAdapter('data', {})
+
+        with mock.patch.object(adapter, 'fetch_unique_columns', return_value=['id']) as fetch_unique_columns:
+            adapter.get_keyset('schema', 'table', ['id'])
+            adapter.get_keyset('schema', 'table', ['id'])
+            self.assertEqual(fetch_unique_columns.call_count, 1)
+
+            adapter.invalidate_table_catalog('schema', 'table')
+            adapter.get_keyset('schema', 'table', ['id'])
+            self.assertEqual(fetch_unique_columns.call_count, 2)
+
+        # errors are not cached
+        with mock.patch.object(adapter, 'fetch_unique_columns', return_value=None) as fetch_unique_columns:
+            self.assertIsNone(adapter.get_keyset('schema', 'other', ['id']))
+            self.assertIsNone(adapter.get_keyset('schema', 'other', ['id']))
+            self.assertEqual(fetch_unique_columns.call_count, 2)
+
+    @mock.patch.object(PostgreSQLAdapter, 'fetch_unique_columns', mock.Mock(return_value=['id']))
+    def test_fetch_page(self):
+        adapter = PostgreSQLAdapter('data', {})
+
+        # the first page is fetched with LIMIT/OFFSET, ordered by the key column
+        with mock.patch.object(adapter, 'fetchall', return_value=[(1, 10.0), (2, 20.0)]) as fetchall:
+            rows, cursors = adapter.fetch_page('schema', 'table', ['id', 'ra'], page_size=2)
+
+        self.assertEqual(fetchall.call_args.args[0], 'SELECT "id", "ra" FROM "schema"."table" '
+                                                     'ORDER BY "id" ASC LIMIT 2 OFFSET 0')
+        self.assertEqual(cursors['next'], {'ordering': None, 'values': [2], 'reverse': False})
+        self.assertIsNone(cursors['previous'])
+
+        # the next pages seek to the row after the cursor
+        with mock.patch.object(adapter, 'fetchall', return_value=[(3, 30.0)]) as fetchall:
+            rows, cursors = adapter.fetch_page('schema', 'table', ['id', 'ra'], page_size=2, cursor=cursors['next'])
+
+        self.assertEqual(fetchall.call_args.args, ('SELECT "id", "ra" FROM "schema"."table" '
+                                                   'WHERE "id" > %s ORDER BY "id" ASC LIMIT 3', ))
+        self.assertEqual(fetchall.call_args.kwargs, {'args': [2]})
+        self.assertEqual(rows, [(3, 30.0)])
+        self.assertIsNone(cursors['next'])
+        self.assertEqual(cursors['previous'], {'ordering': None, 'values': [3], 'reverse': True})
+
+        # other orderings use LIMIT/OFFSET without cursors
+        with mock.patch.object(adapter, 'fetchall', return_value=[]) as fetchall:
+            rows, cursors = adapter.fetch_page('schema', 'table', ['id', 'ra'], '-ra', page=2, page_size=2)
+
+        self.assertEqual(fetchall.call_args.args[0], 'SELECT "id", "ra" FROM "schema"."table" '
+                                                     'ORDER BY "ra" DESC LIMIT 2 OFFSET 2')
+        self.assertIsNone(cursors)
+
+
+@override_settings(ASYNC=True, COUNT_ROWS_EXACT_LIMIT=100)
+class CoreCountTestCase(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fetch_count(self):
+        adapter = BaseDatabaseAdapter('data', {})
+
+        with mock.patch.object(adapter, 'fetch_nrows', return_value=1000), \
+                mock.patch.object(adapter, 'estimate_rows', return_value=50), \
+                mock.patch.object(adapter, 'count_rows', return_value=42) as adapter_count_rows, \
+                mock.patch('daiquiri.core.tasks.count_rows') as count_rows_task:
+
+            # large tables are estimated, the exact count is started only once in the background
+            self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], search='M31'), (50, True))
+            self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], search='M31'), (50, True))
+            self.assertEqual(count_rows_task.apply_async.call_count, 1)
+            self.assertEqual(adapter_count_rows.call_count, 0)
+
+            # the task counts the rows and stores the count for the next request
+            with mock.patch('daiquiri.core.adapter.DatabaseAdapter', return_value=adapter):
+                count_rows(*count_rows_task.apply_async.call_args[0][0])
+
+            self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], search='M31'), (42, False))
+            self.assertEqual(adapter_count_rows.call_count, 1)
+
+            # a different search is estimated again
+            self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], search='M32'), (50, True))
+
+    def test_fetch_count_small_table(self):
+        adapter = BaseDatabaseAdapter('data', {})
+
+        with mock.patch.object(adapter, 'fetch_nrows', return_value=10), \
+                mock.patch.object(adapter, 'count_rows', return_value=7) as adapter_count_rows:
+            self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], search='M31'), (7, False))
+            self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], search='M31'), (7, False))
+            self.assertEqual(adapter_count_rows.call_count, 1)
+
+        # the known number of rows of a table is used without a search
+        self.assertEqual(adapter.fetch_count('schema', 'table', ['id'], nrows=1000), (1000, False))
+
+    def test_get_count_cache_key(self):
+        adapter = BaseDatabaseAdapter('data', {})
+        cache_key = adapter.get_count_cache_key('schema', 'table', ['id'], 'M31', {'a': '1', 'b': '2'})
+
+        self.assertTrue(cache_key.startswith('daiquiri.count_rows.'))
+        self.assertEqual(cache_key, adapter.get_count_cache_key('schema', 'table', ['id'], 'M31', {'b': '2', 'a': '1'}))
+        self.assertNotEqual(cache_key, adapter.get_count_cache_key('schema', 'table', ['id'], 'M32', {'a': '1', 'b': '2'}))
+        self.assertNotEqual(cache_key, adapter.get_count_cache_key('schema', 'table', ['id'], 'M31', {'a': '1'}))
+        self.assertNotEqual(cache_key, adapter.get_count_cache_key('schema', 'table', ['id', 'ra'], 'M31', {'a': '1', 'b': '2'}))
+        self.assertNotEqual(cache_key, BaseDatabaseAdapter('tap', {}).get_count_cache_key('schema', 'table', ['id'], 'M31', {'a': '1', 'b': '2'}))
+
+
+class CoreSearchTestCase(SimpleTestCase):
+
+    columns = [
+        {'name': 'id', 'datatype': 'long'},
+        {'name': 'ra', 'datatype': 'double'},
+        {'name': 'name', 'datatype': 'char'}
+    ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_get_search_stmt_postgres(self):
+        adapter = PostgreSQLAdapter('data', {})
+
+        # the cast to text matches the trigram index created by create_search_index
+        self.assertEqual(adapter.get_search_stmt(self.columns[2], 'M31'), ('"name"::text LIKE %s', '%M31%'))
+        self.assertEqual(adapter.get_search_stmt(self.columns[0], '12'), ('"id" = %s', 12))
+        self.assertIsNone(adapter.get_search_stmt(self.columns[0], 'M31'))
+        self.assertIsNone(adapter.get_search_stmt(self.columns[1], '12'))
+
+    def test_create_search_index_postgres(self):
+        adapter = PostgreSQLAdapter('data', {})
+
+        with mock.patch.object(adapter, 'execute') as execute:
+            adapter.create_search_index('schema', 'table', 'name')
+
+        sql = execute.call_args[0][0]
+        self.assertIn('CREATE EXTENSION IF NOT EXISTS pg_trgm;', sql)
+        self.assertIn('ON "schema"."table" USING gin (("name"::text) gin_trgm_ops)', sql)
+
+    def test_get_search_stmt_mysql(self):
+        adapter = MySQLAdapter('data', {})
+        column = dict(self.columns[2], fulltext=True)
+
+        # the operators of the boolean mode are removed from the search string
+        self.assertEqual(adapter.get_search_stmt(column, 'M31 +ngc -"224"'),
+                         ('MATCH (`name`) AGAINST (%s IN BOOLEAN MODE)', '+M31* +ngc* +224*'))
+
+        # columns without a FULLTEXT index and search strings without terms use LIKE
+        self.assertEqual(adapter.get_search_stmt(column, '+-'), ('`name` LIKE %s', '%+-%'))
+        self.assertEqual(adapter.get_search_stmt(self.columns[2], 'M31'), ('`name` LIKE %s', '%M31%'))
+
+    def test_get_search_columns_mysql(self):
+        adapter = MySQLAdapter('data', {})
+
+        with mock.patch.object(adapter, 'fetch_columns', return_value=self.columns) as fetch_columns, \
+                mock.patch.object(adapter, 'fetch_fulltext_column_names', return_value={'name': 'index'}) as fetch_fulltext_column_names:
+            for i in range(2):
+                search_columns = adapter.get_search_columns('schema', 'table', ['id', 'name'], 'M31')
+                self.assertEqual([(column['name'], column['fulltext']) for column in search_columns],
+                                 [('id', False), ('name', True)])
+
+            # the columns and indexes are only fetched once
+            self.assertEqual(fetch_columns.call_count, 1)
+            self.assertEqual(fetch_fulltext_column_names.call_count, 1)
+
+            # no columns are needed without a search
+            self.assertEqual(adapter.get_search_columns('schema', 'table', ['id', 'name']), [])
+
+
+class CoreCrossMatchTestCase(SimpleTestCase):
+
+    args = ('daiquiri_data_obs', 'stars', ['id', 'ra'], 'ra', 'dec', 'tap_upload', 'crossmatch_test')
+
+    def test_build_crossmatch_query_postgres_nearest(self):
+        sql = PostgreSQLAdapter('data', {}).build_crossmatch_query(*self.args, nearest=True, max_records=100)
+
+        self.assertEqual(sql, (
+            'SELECT DISTINCT ON (u.row_id) u.row_id AS xmatch_row, t."id", t."ra", '
+            'degrees(spoint(radians(t."ra"), radians(t."dec")) <-> spoint(radians(u.ra), radians(u.dec))) AS xmatch_distance '
+            'FROM "tap_upload"."crossmatch_test" AS u '
+            'JOIN "daiquiri_data_obs"."stars" AS t '
+            'ON spoint(radians(t."ra"), radians(t."dec")) <@ scircle(spoint(radians(u.ra), radians(u.dec)), radians(%(SR)s)) '
+            'ORDER BY u.row_id, xmatch_distance LIMIT 100'
+        ))
+
+    def test_build_crossmatch_query_postgres_all(self):
+        sql = PostgreSQLAdapter('data', {}).build_crossmatch_query(*self.args, options={'position_column_name': 'pos'})
+
+        # all matches are returned, the spoint column of the table is used
+        self.assertTrue(sql.startswith('SELECT u.row_id AS xmatch_row, t."id", t."ra", degrees(t."pos" <-> '))
+        self.assertIn('ON t."pos" <@ scircle(spoint(radians(u.ra), radians(u.dec)), radians(%(SR)s))', sql)
+        self.assertNotIn('LIMIT', sql)
+
+    def test_build_crossmatch_query_postgres_q3c(self):
+        sql = PostgreSQLAdapter('data', {}).build_crossmatch_query(*self.args, nearest=True, options={'index': 'q3c'})
+
+        self.assertIn('q3c_dist(u.ra, u.dec, t."ra", t."dec") AS xmatch_distance', sql)
+        self.assertIn('ON q3c_join(u.ra, u.dec, t."ra", t."dec", %(SR)s)', sql)
+        self.assertNotIn('spoint', sql)
+
+    def test_build_crossmatch_query_mysql(self):
+        adapter = MySQLAdapter('data', {})
+
+        # the declination zone of the position is used for the join, the distance is checked afterwards
+        sql = adapter.build_crossmatch_query(*self.args, nearest=True, max_records=100)
+        self.assertTrue(sql.startswith('SELECT m.xmatch_row, m.`id`, m.`ra`, m.xmatch_distance FROM ('))
+        self.assertIn('JOIN `daiquiri_data_obs`.`stars` AS t ON t.`dec` BETWEEN u.dec - %(SR)s AND u.dec + %(SR)s', sql)
+        self.assertIn(') <= %(SR)s) AS m WHERE m.xmatch_rank = 1 ORDER BY m.xmatch_row, m.xmatch_distance LIMIT 100', sql)
+
+        sql = adapter.build_crossmatch_query(*self.args)
+        self.assertTrue(sql.endswith(') AS m ORDER BY m.xmatch_row, m.xmatch_distance'))
@@ -0,0 +1,118 @@
+import gzip
+import io
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+from astropy.io import fits
+from astropy.io.votable import parse_single_table
+import pyarrow.parquet as pq
+
+from django.test import SimpleTestCase, TestCase
+
+from daiquiri.core.generators import (generate_csv, generate_votable_binary2, generate_fits, generate_parquet,
+                                      generate_compressed, generate_zip)
+
+FIELDS = [
+    {'name': 'id', 'datatype': 'long'},
+    {'name': 'ra', 'datatype': 'double', 'unit': 'deg'},
+    {'name': 'flag', 'datatype': 'boolean'},
+    {'name': 'name', 'datatype': 'char', 'arraysize': 32},
+    {'name': 'date', 'datatype': 'timestamp'}
+]
+
+ROWS = [
+    ['1', '10.5', 't', 'M31', '2000-01-01 00:00:00'],
+    ['2', 'NULL', 'f', 'a < b & c', 'NULL'],
+    [3, None, None, None, None]
+]
+
+
+class GeneratorsTestCase(SimpleTestCase):
+
+    def test_generate_votable_binary2(self):
+        votable = ''.join(generate_votable_binary2(iter(ROWS), FIELDS, table='schema.table'))
+        array = parse_single_table(io.BytesIO(votable.encode())).array
+
+        self.assertEqual(len(array), 3)
+        self.assertEqual(list(array['id']), [1, 2, 3])
+        self.assertEqual(array['ra'][0], 10.5)
+        self.assertTrue(array['ra'].mask[1])
+        self.assertTrue(array['flag'][0])
+        self.assertTrue(array['flag'].mask[2])
+        self.assertEqual(array['name'][1], 'a < b & c')
+        self.assertEqual(array['date'][0], '2000-01-01 00:00:00')
+
+    def test_generate_votable_binary2_unicode(self):
+        rows = [[1, None, None, 'ω Cen', None], [2, None, None, 'M31', None]]
+        votable = ''.join(generate_votable_binary2(iter(rows), FIELDS))
+        array = parse_single_table(io.BytesIO(votable.encode())).array
+
+        self.assertIn('datatype="unicodeChar"', votable)
+        self.assertEqual(list(array['name']), ['ω Cen', 'M31'])
+        self.assertEqual(list(array['id']), [1, 2])
+
+    def test_generate_votable_binary2_empty(self):
+        votable = ''.join(generate_votable_binary2(iter([]), FIELDS, empty=True))
+        self.assertNotIn('<BINARY2>', votable)
+        self.assertIn('arraysize="32*"', votable)
+
+    def test_generate_parquet(self):
+        parquet = b''.join(generate_parquet(iter(ROWS), FIELDS, row_group_size=2))
+        parquet_file = pq.ParquetFile(io.BytesIO(parquet))
+        table = parquet_file.read()
+
+        self.assertEqual(parquet_file.num_row_groups, 2)
+        self.assertEqual(table.column('id').to_pylist(), [1, 2, 3])
+        self.assertEqual(table.column('ra').to_pylist(), [10.5, None, None])
+        self.assertEqual(table.column('flag').to_pylist(), [True, False, None])
+        self.assertEqual(table.column('name').to_pylist(), ['M31', 'a < b & c', None])
+        self.assertEqual(str(table.column('date')[0]), '2000-01-01 00:00:00')
+        self.assertEqual(table.schema.field('ra').metadata, {b'unit': b'deg', b'datatype': b'double'})
+
+    def test_generate_compressed(self):
+        csv = ''.join(generate_csv(iter(ROWS), FIELDS)).encode()
+        compressed = b''.join(generate_compressed(generate_csv(iter(ROWS), FIELDS), 'gzip'))
+
+        self.assertEqual(gzip.decompress(compressed), csv)
+
+    def test_generate_zip(self):
+        with tempfile.TemporaryDirectory() as base_path:
+            file_paths = ['a/table.csv', 'a/image.fits.gz', 'b.txt']
+            for i, file_path in enumerate(file_paths):
+                os.makedirs(os.path.dirname(os.path.join(base_path, file_path)), exist_ok=True)
+                with open(os.path.join(base_path, file_path), 'wb') as f:
+                    f.write(b'content %d\n' % i * 1000)
+
+            # the files are larger than read_ahead_size, so they are read in chunks
+            archive = b''.join(generate_zip(base_path, file_paths, read_ahead=1, read_ahead_size=1000, chunk_size=100))
+
+            with zipfile.ZipFile(io.BytesIO(archive)) as zip_file:
+                self.assertEqual(zip_file.namelist(), file_paths)
+                self.assertEqual(zip_file.read('b.txt'), b'content 2\n' * 1000)
+                self.assertEqual(zip_file.getinfo('a/table.csv').compress_type, zipfile.ZIP_DEFLATED)
+                self.assertEqual(zip_file.getinfo('a/image.fits.gz').compress_type, zipfile.ZIP_STORED)
+
+
+class FITSGeneratorsTestCase(TestCase):
+
+    # generate_fits reads the current site from the database
+    databases = ('default', )
+
+    def test_generate_fits(self):
+        rows = ROWS + [[4, 1.5, True, 'x' * 40, '2000-01-01 00:00:00']]
+        hdul = fits.open(io.BytesIO(b''.join(generate_fits(iter(rows), FIELDS, len(rows), chunk_size=2))))
+        hdu = hdul[1]
+
+        self.assertEqual(hdu.header['TFORM1'], 'K')
+        self.assertEqual(hdu.header['TNULL1'], 9223372036854775807)
+        self.assertEqual(hdu.header['TUNIT2'], 'deg')
+        self.assertEqual(list(hdu.data['id']), [1, 2, 3, 4])
+        self.assertEqual(hdu.data['ra'][0], 10.5)
+        self.assertTrue(np.isnan(hdu.data['ra'][1]))
+        self.assertEqual(list(hdu.data['flag']), [True, False, False, True])
+        self.assertEqual(hdu.data['name'][1], 'a < b & c')
+        self.assertEqual(hdu.data['name'][2], '')
+        self.assertEqual(hdu.data['name'][3], 'x' * 32)   # long strings are truncated to the arraysize
+        self.assertEqual(hdu.data['date'][0], '2000-01-01 00:00:00')
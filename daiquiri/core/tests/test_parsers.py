@@ -0,0 +1,71 @@
+import io
+
+from django.test import TestCase
+
+from daiquiri.core.generators import generate_csv, generate_votable, generate_votable_binary2, generate_fits
+from daiquiri.core.parsers import get_parser, CSVParser, FITSParser, VOTableParser
+
+FIELDS = [
+    {'name': 'id', 'datatype': 'long'},
+    {'name': 'ra', 'datatype': 'double', 'unit': 'deg'},
+    {'name': 'flag', 'datatype': 'boolean'},
+    {'name': 'name', 'datatype': 'char', 'arraysize': 32}
+]
+
+ROWS = [
+    [1, 10.5, True, 'M31'],
+    [2, None, False, 'a < b & "c"'],
+    [3, -1.25, None, None]
+]
+
+
+def parse(content):
+    stream = io.BufferedReader(io.BytesIO(content.encode() if isinstance(content, str) else content))
+    parser = get_parser(stream, batch_size=2)
+
+    rows = []
+    for batch, mask in parser:
+        for row, mask_row in zip(batch.tolist(), mask.tolist()):
+            rows.append([None if mask_cell else (cell.decode() if isinstance(cell, bytes) else cell)
+                         for cell, mask_cell in zip(row, mask_row)])
+
+    return parser, rows
+
+
+class ParsersTestCase(TestCase):
+
+    # generate_fits reads the current site from the database
+    databases = ('default', )
+
+    def test_parse_votable(self):
+        parser, rows = parse(''.join(generate_votable(iter(ROWS), FIELDS)))
+
+        self.assertIsInstance(parser, VOTableParser)
+        self.assertEqual([field['datatype'] for field in parser.fields], ['long', 'double', 'boolean', 'char'])
+        self.assertEqual(parser.fields[1]['unit'], 'deg')
+        self.assertEqual(rows, ROWS)
+
+    def test_parse_votable_binary2(self):
+        parser, rows = parse(''.join(generate_votable_binary2(iter(ROWS), FIELDS)))
+
+        self.assertIsInstance(parser, VOTableParser)
+        self.assertEqual(rows, ROWS)
+
+    def test_parse_fits(self):
+        parser, rows = parse(b''.join(generate_fits(iter(ROWS), FIELDS, len(ROWS))))
+
+        self.assertIsInstance(parser, FITSParser)
+        self.assertEqual([field['datatype'] for field in parser.fields], ['long', 'double', 'boolean', 'char'])
+        self.assertEqual(rows, ROWS)
+
+    def test_parse_csv(self):
+        parser, rows = parse(''.join(generate_csv(iter(ROWS), FIELDS)))
+
+        self.assertIsInstance(parser, CSVParser)
+        self.assertEqual([field['datatype'] for field in parser.fields], ['long', 'double', 'boolean', 'char'])
+        self.assertEqual(rows, ROWS)
+
+    def test_parse_votable_error(self):
+        with self.assertRaises(ValueError):
+            parse('<VOTABLE><RESOURCE><TABLE><FIELD name="a" datatype="int"/><DATA><TABLEDATA><TR><TD>x</TD></TR>'
+                  '</TABLEDATA></DATA></TABLE></RESOURCE></VOTABLE>')
@@ -0,0 +1,60 @@
+import os
+import tempfile
+
+from django.test import RequestFactory, SimpleTestCase
+
+from daiquiri.core.responses import RangeFileResponse
+
+
+class RangeFileResponseTestCase(SimpleTestCase):
+
+    def setUp(self):
+        fd, self.file_path = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bytes(range(100)))
+
+    def tearDown(self):
+        os.remove(self.file_path)
+
+    def get_response(self, http_range=None):
+        headers = {'HTTP_RANGE': http_range} if http_range else {}
+        request = RequestFactory().get('/', **headers)
+        response = RangeFileResponse(request, self.file_path)
+        content = b''.join(response.streaming_content)
+        response.close()
+        return response, content
+
+    def test_no_range(self):
+        response, content = self.get_response()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(content, bytes(range(100)))
+
+    def test_range(self):
+        response, content = self.get_response('bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(content, bytes(range(10, 20)))
+
+    def test_open_range(self):
+        response, content = self.get_response('bytes=90-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 90-99/100')
+        self.assertEqual(content, bytes(range(90, 100)))
+
+    def test_suffix_range(self):
+        response, content = self.get_response('bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, bytes(range(95, 100)))
+
+    def test_unsatisfiable_range(self):
+        response, content = self.get_response('bytes=200-300')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+        self.assertEqual(content, b'')
+
+    def test_invalid_range(self):
+        response, content = self.get_response('bytes=1-2,5-6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, bytes(range(100)))
@@ -1 +1,35 @@
+import base64
 
+from django.test import SimpleTestCase
+
+from rest_framework.exceptions import ParseError
+
+from daiquiri.core.viewsets import RowViewSetMixin
+
+
+class RowViewSetMixinTestCase(SimpleTestCase):
+
+    def test_cursor(self):
+        cursor = {'ordering': '-ra', 'values': [10.5, 'M31', 1, None], 'reverse': True}
+        token = RowViewSetMixin()._encode_cursor(cursor)
+        self.assertEqual(RowViewSetMixin()._decode_cursor(token), cursor)
+
+    def test_cursor_empty(self):
+        self.assertIsNone(RowViewSetMixin()._decode_cursor(None))
+        self.assertIsNone(RowViewSetMixin()._decode_cursor(''))
+
+    def test_cursor_invalid(self):
+        tokens = [
+            'not base64!',
+            base64.urlsafe_b64encode(b'not json').decode(),
+            base64.urlsafe_b64encode(b'[1, 2]').decode(),
+            base64.urlsafe_b64encode(b'{"values": 1}').decode(),
+            base64.urlsafe_b64encode(b'{"values": [{"a": 1}]}').decode(),
+            base64.urlsafe_b64encode(b'{"values": [[1, 2]]}').decode(),
+            base64.urlsafe_b64encode(b'{"values": [1], "ordering": 1}').decode(),
+            base64.urlsafe_b64encode(b'{"values": [1], "reverse": "yes"}').decode()
+        ]
+
+        for token in tokens:
+            with self.assertRaises(ParseError):
+                RowViewSetMixin()._decode_cursor(token)
@@ -60,6 +60,26 @@ def get_client_ip(request):
         return None
 
 
+def get_accept_encoding(request, encodings=('zstd', 'gzip')):
+    # parse the Accept-Encoding header into a dict of encoding -> quality
+    qualities = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding, params = item.partition(';')[::2]
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+
+        qualities[encoding.strip().lower()] = quality
+
+    # return the supported encoding with the highest quality, the order of encodings breaks ties
+    accepted = [encoding for encoding in encodings if qualities.get(encoding, 0.0) > 0]
+    if accepted:
+        return max(accepted, key=lambda encoding: qualities[encoding])
+    else:
+        return None
+
+
 def get_referer_path_info(request, default=None):
     referer = request.META.get('HTTP_REFERER', None)
     if not referer:
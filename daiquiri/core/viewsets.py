@@ -1,3 +1,7 @@
+import base64
+import binascii
+import json
+
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import mixins, viewsets
@@ -32,6 +36,9 @@ class RowViewSetMixin(object):
         except ValueError:
             raise ParseError(_('page_size must be an integer'))
 
+        # get the cursor for keyset pagination from the querystring
+        cursor = self._decode_cursor(self.request.GET.get('cursor'))
+
         # get additional filters from the querystring
         filters = {}
         try:
@@ -44,20 +51,55 @@ class RowViewSetMixin(object):
             if key in column_names:
                 filters[key] = value
 
-        return ordering, page, page_size, search, filters
+        return ordering, page, page_size, search, filters, cursor
 
-    def _get_next_url(self, page, page_size, count):
-        if page * page_size < count:
+    def _get_next_url(self, page, page_size, count, cursors=None):
+        if cursors is not None:
+            return self._get_cursor_url(cursors['next'])
+        elif page * page_size < count:
             querydict = self.request.GET.copy()
             querydict['page'] = page + 1
             return self.request.build_absolute_uri(self.request.path_info + '?' + querydict.urlencode())
         else:
             return None
 
-    def _get_previous_url(self, page):
-        if page > 1:
+    def _get_previous_url(self, page, cursors=None):
+        if cursors is not None:
+            return self._get_cursor_url(cursors['previous'])
+        elif page > 1:
             querydict = self.request.GET.copy()
             querydict['page'] = page - 1
             return self.request.build_absolute_uri(self.request.path_info + '?' + querydict.urlencode())
         else:
             return None
+
+    def _get_cursor_url(self, cursor):
+        if cursor is not None:
+            querydict = self.request.GET.copy()
+            querydict.pop('page', None)
+            querydict['cursor'] = self._encode_cursor(cursor)
+            return self.request.build_absolute_uri(self.request.path_info + '?' + querydict.urlencode())
+        else:
+            return None
+
+    def _encode_cursor(self, cursor):
+        # the cursor is an opaque token, values like datetimes are sent as strings
+        return base64.urlsafe_b64encode(json.dumps(cursor, default=str).encode()).decode()
+
+    def _decode_cursor(self, token):
+        if token:
+            try:
+                cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+            except (binascii.Error, UnicodeError, ValueError):
+                raise ParseError(_('cursor is invalid'))
+
+            # the values are passed to the database as arguments, so only scalars are allowed
+            if not isinstance(cursor, dict) or not isinstance(cursor.get('values'), list) or \
+                    not all(isinstance(value, (str, int, float, bool, type(None))) for value in cursor['values']) or \
+                    not isinstance(cursor.get('ordering'), (str, type(None))) or \
+                    not isinstance(cursor.get('reverse', False), bool):
+                raise ParseError(_('cursor is invalid'))
+
+            return cursor
+        else:
+            return None
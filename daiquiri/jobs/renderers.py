@@ -53,6 +53,10 @@ class UWSRenderer(XMLRenderer):
             elif key == 'parameters':
                 self.render_parameters(value, request)
 
+            elif key == 'job_info':
+                if value:
+                    self.render_job_info(value)
+
             else:
                 self.node('uws:' + self._to_camel_case(key), {}, value)
 
@@ -71,6 +75,14 @@ class UWSRenderer(XMLRenderer):
 
         self.end('uws:results')
 
+    def render_job_info(self, data):
+        self.start('uws:jobInfo')
+
+        for key, value in data.items():
+            self.node(self._to_camel_case(key), {}, None if value is None else str(value))
+
+        self.end('uws:jobInfo')
+
     def render_parameters(self, data, request, root=False):
         self.start('uws:parameters', self.root_attrs if root else {})
 
@@ -24,6 +24,7 @@ class JobRetrieveSerializer(serializers.ModelSerializer):
     owner_id = serializers.SerializerMethodField()
     destruction = serializers.DateTimeField(source='destruction_time')
     results = serializers.SerializerMethodField()
+    job_info = serializers.SerializerMethodField()
 
     creation_time = serializers.SerializerMethodField()
     start_time = serializers.SerializerMethodField()
@@ -43,7 +44,8 @@ class JobRetrieveSerializer(serializers.ModelSerializer):
             'execution_duration',
             'destruction',
             'results',
-            'parameters'
+            'parameters',
+            'job_info'
         )
 
     def get_owner_id(self, obj):
@@ -55,6 +57,10 @@ class JobRetrieveSerializer(serializers.ModelSerializer):
     def get_results(self, obj):
         return get_job_results(self.context['request'], obj)
 
+    def get_job_info(self, obj):
+        # jobs which report their progress while executing provide it as a dict
+        return getattr(obj, 'progress', None)
+
     def get_creation_time(self, obj):
         return obj.creation_time.strftime('%Y-%m-%dT%H:%M:%S.%fZ') if obj.creation_time else None
 
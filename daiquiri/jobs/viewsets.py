@@ -1,4 +1,4 @@
-from django.http import HttpResponse, FileResponse
+from django.http import HttpResponse
 
 from rest_framework import viewsets
 from rest_framework.response import Response
@@ -7,7 +7,7 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication, TokenAuthentication
 from rest_framework.decorators import action
 
-from daiquiri.core.responses import HttpResponseSeeOther
+from daiquiri.core.responses import HttpResponseSeeOther, CompressedFileResponse
 from daiquiri.core.utils import get_client_ip
 
 from .models import Job
@@ -87,7 +87,7 @@ class SyncJobViewSet(JobViewSet):
         except ValidationError as e:
             raise ValidationError(self.rewrite_exception(e))
 
-        return FileResponse(job.run_sync(), content_type=job.formats[job.response_format])
+        return CompressedFileResponse(request, job.run_sync(), content_type=job.formats[job.response_format])
 
 
 class AsyncJobViewSet(JobViewSet):
@@ -189,9 +189,9 @@ class AsyncJobViewSet(JobViewSet):
         job = self.get_object()
 
         if result == 'result':
-            return FileResponse(job.stream(job.response_format), content_type=job.formats[job.response_format])
+            return CompressedFileResponse(request, job.stream(job.response_format), content_type=job.formats[job.response_format])
         elif result in job.formats:
-            return FileResponse(job.stream(result), content_type=job.formats[result])
+            return CompressedFileResponse(request, job.stream(result), content_type=job.formats[result])
         else:
             raise ValidationError({
                 'result': 'Unsupported value.'
@@ -36,6 +36,7 @@ class ColumnAdmin(admin.ModelAdmin):
             'arraysize',
             'principal',
             'indexed',
+            'searchable',
             'std'
         )
 
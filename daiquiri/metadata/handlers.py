@@ -1,9 +1,9 @@
 from django.apps import apps
-from django.core.cache import cache
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
-from .models import Schema, Table, Column
+from .models import Schema, Table, Column, Function
+from .utils import update_metadata_version, invalidate_column_catalog
 
 
 @receiver(post_save, sender=Schema)
@@ -26,6 +26,10 @@ def table_updated_handler(sender, **kwargs):
         from daiquiri.oai.utils import update_records
         update_records('table', kwargs['instance'])
 
+    if apps.is_installed('daiquiri.query'):
+        from daiquiri.query.models import QueryJob
+        QueryJob.objects.invalidate_results(kwargs['instance'].schema.name, kwargs['instance'].name)
+
 
 @receiver(post_delete, sender=Table)
 def table_deleted_handler(sender, **kwargs):
@@ -33,7 +37,36 @@ def table_deleted_handler(sender, **kwargs):
         from daiquiri.oai.utils import delete_records
         delete_records('table', kwargs['instance'])
 
+    if apps.is_installed('daiquiri.query'):
+        from daiquiri.query.models import QueryJob
+        QueryJob.objects.invalidate_results(kwargs['instance'].schema.name, kwargs['instance'].name)
+
 
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
+def table_columns_changed_handler(sender, **kwargs):
+    table = kwargs['instance']
+    invalidate_column_catalog(table.schema.name, table.name)
+
+
+@receiver(post_save, sender=Column)
+@receiver(post_delete, sender=Column)
+def column_changed_handler(sender, **kwargs):
+    table = kwargs['instance'].table
+    invalidate_column_catalog(table.schema.name, table.name)
+
+
+@receiver(post_save, sender=Schema)
+@receiver(post_delete, sender=Schema)
+@receiver(post_save, sender=Table)
+@receiver(post_delete, sender=Table)
 @receiver(post_save, sender=Column)
-def column_updated_handler(sender, **kwargs):
-    cache.delete('processor')
+@receiver(post_delete, sender=Column)
+@receiver(post_save, sender=Function)
+@receiver(post_delete, sender=Function)
+@receiver(m2m_changed, sender=Schema.groups.through)
+@receiver(m2m_changed, sender=Table.groups.through)
+@receiver(m2m_changed, sender=Column.groups.through)
+@receiver(m2m_changed, sender=Function.groups.through)
+def metadata_changed_handler(sender, **kwargs):
+    update_metadata_version()
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from daiquiri.core.adapter import DatabaseAdapter
+from daiquiri.metadata.models import Column
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema', nargs='?', help='only create the indexes for this schema')
+        parser.add_argument('table', nargs='?', help='only create the indexes for this table')
+        parser.add_argument('--drop', action='store_true', help='drop the indexes of columns which are not searchable')
+
+    def handle(self, *args, **options):
+        adapter = DatabaseAdapter()
+
+        columns = Column.objects.select_related('table__schema')
+        if options['schema']:
+            columns = columns.filter(table__schema__name=options['schema'])
+        if options['table']:
+            columns = columns.filter(table__name=options['table'])
+
+        for column in columns:
+            schema_name, table_name = column.table.schema.name, column.table.name
+
+            if column.searchable:
+                self.stdout.write('Creating search index for %s.%s.%s' % (schema_name, table_name, column.name))
+                adapter.create_search_index(schema_name, table_name, column.name)
+
+                column.indexed = True
+                column.save()
+
+            elif options['drop']:
+                adapter.drop_search_index(schema_name, table_name, column.name)
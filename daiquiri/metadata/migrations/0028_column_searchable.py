@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_metadata', '0027_auto_20201202_1625'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='column',
+            name='searchable',
+            field=models.BooleanField(default=False, help_text='Designates whether the column is used for the search in the row browser.', verbose_name='Searchable'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_metadata', '0028_column_searchable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetadataVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(help_text='Changes whenever the metadata is changed.', max_length=32, verbose_name='Version')),
+            ],
+            options={
+                'verbose_name': 'Metadata version',
+                'verbose_name_plural': 'Metadata versions',
+            },
+        ),
+    ]
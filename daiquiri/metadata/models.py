@@ -284,6 +284,11 @@ class Column(models.Model):
         verbose_name=_('Indexed'),
         help_text=_('Designates whether the column is indexed.')
     )
+    searchable = models.BooleanField(
+        default=False,
+        verbose_name=_('Searchable'),
+        help_text=_('Designates whether the column is used for the search in the row browser.')
+    )
     std = models.BooleanField(
         default=False,
         verbose_name=_('Standard'),
@@ -375,3 +380,19 @@ class Function(models.Model):
 
     def __str__(self):
         return self.name
+
+
+class MetadataVersion(models.Model):
+
+    version = models.CharField(
+        max_length=32,
+        verbose_name=_('Version'),
+        help_text=_('Changes whenever the metadata is changed.')
+    )
+
+    class Meta:
+        verbose_name = _('Metadata version')
+        verbose_name_plural = _('Metadata versions')
+
+    def __str__(self):
+        return self.version
@@ -50,6 +50,7 @@ class ColumnSerializer(serializers.ModelSerializer):
                 'index_for',
                 'principal',
                 'indexed',
+                'searchable',
                 'std',
                 'table'
             )
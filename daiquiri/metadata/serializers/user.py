@@ -22,6 +22,7 @@ class ColumnSerializer(serializers.ModelSerializer):
             'arraysize',
             'principal',
             'indexed',
+            'searchable',
             'std'
         )
 
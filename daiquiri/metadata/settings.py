@@ -3,6 +3,12 @@ import daiquiri.core.env as env
 from daiquiri.core.constants import ACCESS_LEVEL_CHOICES
 
 METADATA_COLUMN_PERMISSIONS = False
+# the permissions are kept for the last METADATA_PERMISSION_SNAPSHOT_SIZE combinations of groups in every process
+METADATA_PERMISSION_SNAPSHOT_SIZE = 128
+METADATA_PERMISSION_SNAPSHOT_TIMEOUT = 60
+# the columns of the tables in the queries are cached, a change in the metadata store invalidates them, but
+# changes of the tables in the data database are not noticed, use ./manage.py invalidate_table_catalog after them
+METADATA_COLUMN_CATALOG_TIMEOUT = 3600
 METADATA_BASE_URL = None
 
 ARCHIVE_BASE_PATH = env.get_abspath('ARCHIVE_BASE_PATH')
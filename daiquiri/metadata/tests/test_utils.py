@@ -0,0 +1,155 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.conf import settings
+from django.test import TestCase, override_settings
+
+from daiquiri.query.process import check_permissions
+
+from ..models import Schema, Table, Column, Function
+from ..utils import (get_column_catalog, get_metadata_version, get_permission_snapshot, get_user_columns,
+                     permission_snapshots, update_metadata_version)
+
+
+class PermissionSnapshotTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+        'metadata.json'
+    )
+
+    users = ('admin', 'manager', 'user', 'test', 'anonymous')
+
+    def setUp(self):
+        permission_snapshots.clear()
+
+    def get_user(self, username):
+        return AnonymousUser() if username == 'anonymous' else User.objects.get(username=username)
+
+    def assert_snapshot(self):
+        # the snapshot gives the same answers as the queries for the single schemas, tables and columns
+        for username in self.users:
+            user = self.get_user(username)
+            snapshot = get_permission_snapshot(user)
+
+            for schema in Schema.objects.all():
+                self.assertEqual(schema.name in snapshot['schemas'],
+                                 Schema.objects.filter_by_access_level(user).filter(pk=schema.pk).exists())
+
+            for table in Table.objects.all():
+                key = (table.schema.name, table.name)
+                user_columns = get_user_columns(user, *key)
+
+                self.assertEqual(key[0] in snapshot['schemas'] and key in snapshot['tables'],
+                                 Schema.objects.filter_by_access_level(user).filter(pk=table.schema.pk).exists() and
+                                 Table.objects.filter_by_access_level(user).filter(pk=table.pk).exists())
+
+                # the columns are only collected for METADATA_COLUMN_PERMISSIONS
+                if not settings.METADATA_COLUMN_PERMISSIONS:
+                    self.assertEqual(snapshot['columns'], {})
+                elif key in snapshot['tables'] and key[0] in snapshot['schemas']:
+                    self.assertEqual(snapshot['columns'].get(key, set()),
+                                     set(column.name for column in user_columns))
+
+                # check_permissions uses the snapshot
+                self.assertEqual(check_permissions(user, [], [key], [], []) == [],
+                                 key[0] in snapshot['schemas'] and key in snapshot['tables'])
+
+                for column in Column.objects.filter(table=table):
+                    messages = check_permissions(user, [], [key], [key + (column.name, )], [])
+                    self.assertEqual(messages == [], column in user_columns)
+
+            for function in Function.objects.all():
+                self.assertEqual(function.name in snapshot['forbidden_functions'],
+                                 not Function.objects.filter_by_access_level(user).filter(pk=function.pk).exists())
+
+    def test_snapshot(self):
+        self.assert_snapshot()
+
+    @override_settings(METADATA_COLUMN_PERMISSIONS=True)
+    def test_snapshot_column_permissions(self):
+        self.assert_snapshot()
+
+    @override_settings(METADATA_PERMISSION_SNAPSHOT_SIZE=2)
+    def test_snapshot_size(self):
+        for username in self.users:
+            get_permission_snapshot(self.get_user(username))
+
+        self.assertLessEqual(len(permission_snapshots), 2)
+
+        # the last snapshot is reused
+        snapshot = get_permission_snapshot(self.get_user('anonymous'))
+        self.assertIs(get_permission_snapshot(AnonymousUser()), snapshot)
+
+        # a new version of the metadata replaces all snapshots
+        update_metadata_version()
+        self.assertIsNot(get_permission_snapshot(AnonymousUser()), snapshot)
+        self.assertEqual(len(permission_snapshots), 1)
+
+    def test_metadata_version(self):
+        version = get_metadata_version()
+
+        # the version is stored in the database, not in the (possibly process-local) cache
+        cache.clear()
+        self.assertEqual(get_metadata_version(), version)
+
+        update_metadata_version()
+        self.assertNotEqual(get_metadata_version(), version)
+
+
+class ColumnCatalogTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+        'metadata.json'
+    )
+
+    def setUp(self):
+        cache.clear()
+
+        self.table = Table.objects.first()
+        self.key = (self.table.schema.name, self.table.name)
+
+    def get_column_catalog(self, adapter, columns):
+        adapter.return_value.fetch_columns.return_value = columns
+        return get_column_catalog(*self.key)
+
+    @mock.patch('daiquiri.metadata.utils.DatabaseAdapter')
+    def test_get_column_catalog(self, adapter):
+        catalog = self.get_column_catalog(adapter, [{'name': 'b', 'order': 2}, {'name': 'a', 'order': 1}])
+
+        self.assertEqual([column['name'] for column in catalog['columns']], ['a', 'b'])
+        self.assertEqual(set(catalog['metadata']), set(Column.objects.filter(table=self.table).values_list('name', flat=True)))
+
+        # a change in the data database is not noticed, the catalog is cached
+        catalog = self.get_column_catalog(adapter, [{'name': 'c', 'order': 1}])
+        self.assertEqual([column['name'] for column in catalog['columns']], ['a', 'b'])
+        adapter.return_value.fetch_columns.assert_called_once_with(*self.key)
+
+    @mock.patch('daiquiri.metadata.utils.DatabaseAdapter')
+    def test_get_column_catalog_metadata_changed(self, adapter):
+        self.get_column_catalog(adapter, [{'name': 'a', 'order': 1}])
+
+        # a change in the metadata store invalidates the catalog
+        self.table.save()
+
+        catalog = self.get_column_catalog(adapter, [{'name': 'c', 'order': 1}])
+        self.assertEqual([column['name'] for column in catalog['columns']], ['c'])
+
+    @mock.patch('daiquiri.core.management.commands.invalidate_table_catalog.DatabaseAdapter', mock.Mock())
+    @mock.patch('daiquiri.metadata.utils.DatabaseAdapter')
+    def test_invalidate_table_catalog_command(self, adapter):
+        self.get_column_catalog(adapter, [{'name': 'a', 'order': 1}])
+
+        # the management command invalidates the catalog after a change in the data database
+        call_command('invalidate_table_catalog', *self.key, stdout=StringIO())
+
+        catalog = self.get_column_catalog(adapter, [{'name': 'c', 'order': 1}])
+        self.assertEqual([column['name'] for column in catalog['columns']], ['c'])
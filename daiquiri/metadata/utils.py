@@ -1,6 +1,19 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
 from django.conf import settings
+from django.core.cache import cache
+
+from daiquiri.core.adapter import DatabaseAdapter
+
+from .models import Schema, Table, Column, Function, MetadataVersion
 
-from .models import Schema, Table, Column
+# the permission snapshots of this process, by version and by the groups of the users, least recently used first
+permission_snapshots = OrderedDict()
+permission_snapshots_lock = threading.Lock()
 
 
 def get_user_columns(user, schema_name, table_name):
@@ -21,3 +34,100 @@ def get_user_columns(user, schema_name, table_name):
         return Column.objects.filter_by_access_level(user).filter(table=table)
     else:
         return Column.objects.filter(table=table)
+
+
+def get_metadata_version():
+    # the version is changed whenever the metadata is changed, it is stored in the database (and not in
+    # the cache, which can be local to the process), so that all processes see the change
+    return MetadataVersion.objects.get_or_create(pk=1, defaults={'version': uuid.uuid4().hex})[0].version
+
+
+def update_metadata_version():
+    MetadataVersion.objects.update_or_create(pk=1, defaults={'version': uuid.uuid4().hex})
+
+
+def get_permission_snapshot(user):
+    version = get_metadata_version()
+
+    # the access to the metadata only depends on the groups of the user
+    if not user or user.is_anonymous:
+        key = (version, None)
+    else:
+        key = (version, tuple(sorted(user.groups.values_list('id', flat=True))))
+
+    with permission_snapshots_lock:
+        snapshot = permission_snapshots.get(key)
+        if snapshot is not None and time.monotonic() - snapshot['time'] <= settings.METADATA_PERMISSION_SNAPSHOT_TIMEOUT:
+            permission_snapshots.move_to_end(key)
+            return snapshot
+
+    snapshot = build_permission_snapshot(user)
+
+    with permission_snapshots_lock:
+        # remove the snapshots of older versions and the least recently used ones
+        for snapshot_key in list(permission_snapshots):
+            if snapshot_key[0] != version:
+                permission_snapshots.pop(snapshot_key)
+
+        permission_snapshots[key] = snapshot
+        while len(permission_snapshots) > settings.METADATA_PERMISSION_SNAPSHOT_SIZE:
+            permission_snapshots.popitem(last=False)
+
+    return snapshot
+
+
+def build_permission_snapshot(user):
+    snapshot = {
+        'time': time.monotonic(),
+        'schemas': set(Schema.objects.filter_by_access_level(user).values_list('name', flat=True)),
+        'tables': set(Table.objects.filter_by_access_level(user).values_list('schema__name', 'name')),
+        'columns': defaultdict(set),
+        'forbidden_functions': set(Function.objects.values_list('name', flat=True))
+    }
+
+    # the columns are only needed for METADATA_COLUMN_PERMISSIONS, otherwise the tables are checked
+    if settings.METADATA_COLUMN_PERMISSIONS:
+        columns = Column.objects.filter_by_access_level(user)
+        for schema_name, table_name, column_name in columns.values_list('table__schema__name', 'table__name', 'name'):
+            snapshot['columns'][(schema_name, table_name)].add(column_name)
+
+    # only the functions which are in the metadata store, but not accessible, are forbidden
+    snapshot['forbidden_functions'] -= set(Function.objects.filter_by_access_level(user).values_list('name', flat=True))
+
+    return snapshot
+
+
+def get_column_catalog(schema_name, table_name):
+    # the columns of a table from the database and from the metadata store, cached until the metadata changes
+    cache_key = get_column_catalog_cache_key(schema_name, table_name)
+
+    catalog = cache.get(cache_key)
+    if catalog is None:
+        catalog = build_column_catalog(schema_name, table_name)
+        cache.set(cache_key, catalog, settings.METADATA_COLUMN_CATALOG_TIMEOUT)
+
+    return catalog
+
+
+def build_column_catalog(schema_name, table_name):
+    # name, datatype, arraysize and indexed of the columns as they are in the database
+    database_columns = DatabaseAdapter().fetch_columns(schema_name, table_name)
+
+    catalog = {
+        'columns': sorted(database_columns, key=lambda column: column.get('order') or 0),
+        'metadata': {}
+    }
+
+    columns = Column.objects.filter(table__schema__name=schema_name, table__name=table_name)
+    for column in columns.values('name', 'description', 'unit', 'ucd', 'utype', 'datatype', 'arraysize', 'principal', 'std'):
+        catalog['metadata'][column['name']] = dict(column, indexed=False)
+
+    return catalog
+
+
+def get_column_catalog_cache_key(schema_name, table_name):
+    return 'daiquiri.column_catalog.' + hashlib.sha256(('%s.%s' % (schema_name, table_name)).encode()).hexdigest()
+
+
+def invalidate_column_catalog(schema_name, table_name):
+    cache.delete(get_column_catalog_cache_key(schema_name, table_name))
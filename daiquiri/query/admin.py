@@ -13,7 +13,7 @@ class QueryJobAdmin(JobAdmin):
 
 class DownloadJobAdmin(JobAdmin):
     search_fields = JobAdmin.search_fields + ['schema_name', 'job__table_name', 'format_key']
-    list_display = JobAdmin.list_display + ['job', 'file_path']
+    list_display = JobAdmin.list_display + ['job', 'file_path', 'rows_written', 'bytes_written']
     actions = ['abort_job', 'archive_job']
 
 
@@ -1,20 +1,36 @@
 #from django.conf import settings
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 
-from .models import QueryJob, DownloadJob
+from .models import QueryJob, QueryJobTable, DownloadJob
 
 
 @receiver(pre_save, sender=QueryJob)
 def query_job_updated_handler(sender, **kwargs):
     instance = kwargs['instance']
 
+    # new jobs have no table which could be renamed
+    if instance._state.adding:
+        return
+
     try:
         QueryJob.objects.get(pk=instance.pk).rename_table(instance.table_name)
     except QueryJob.DoesNotExist:
         pass
 
 
+@receiver(post_save, sender=QueryJob)
+def query_job_created_handler(sender, **kwargs):
+    instance = kwargs['instance']
+
+    # the tables of a reusable result are stored, so that the result can be invalidated when they change
+    if kwargs['created'] and instance.result_fingerprint and instance.metadata:
+        QueryJobTable.objects.bulk_create([
+            QueryJobTable(job=instance, schema_name=schema_name, table_name=table_name)
+            for schema_name, table_name in instance.metadata.get('tables') or []
+        ])
+
+
 @receiver(post_delete, sender=QueryJob)
 def query_job_deleted_handler(sender, **kwargs):
     kwargs['instance'].drop_table()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from daiquiri.query.models import QueryJob
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('schema', help='the schema which was changed')
+        parser.add_argument('table', nargs='?', help='the table which was changed')
+
+    def handle(self, *args, **options):
+        count = QueryJob.objects.invalidate_results(options['schema'], options['table'])
+        self.stdout.write('Invalidated the results of %d query jobs.' % count)
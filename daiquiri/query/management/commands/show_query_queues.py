@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from daiquiri.query.scheduler import FairShareScheduler
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dispatch', action='store_true', help='Dispatch the queued jobs which can run now.')
+
+    def handle(self, *args, **options):
+        scheduler = FairShareScheduler()
+
+        if options['dispatch']:
+            for job in scheduler.dispatch():
+                self.stdout.write('dispatched job %s' % job.id)
+
+        stats = scheduler.get_stats()
+
+        for queue_key, queue_stats in stats['queues'].items():
+            self.stdout.write('queue %s: %d running, %d waiting, concurrency %s' % (
+                queue_key,
+                queue_stats['running'],
+                queue_stats['waiting'],
+                queue_stats['concurrency'] or 'unlimited'
+            ))
+
+        for username, owner_stats in stats['owners'].items():
+            self.stdout.write('user %s: %d running, %d waiting, longest wait %.0fs' % (
+                username or 'anonymous',
+                owner_stats['running'],
+                owner_stats['waiting'],
+                owner_stats['wait_time']
+            ))
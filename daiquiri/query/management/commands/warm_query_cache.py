@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rest_framework.exceptions import ValidationError
+
+from daiquiri.query.models import Example
+from daiquiri.query.process import compile_query, process_query_language
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('query_files', nargs='*', help='Files with additional queries, separated by empty lines.')
+        parser.add_argument('--query-language', default=None, help='The query language of the queries in the files.')
+
+    def handle(self, *args, **options):
+        if not settings.QUERY_COMPILE_CACHE_SHARED:
+            self.stderr.write('QUERY_COMPILE_CACHE_SHARED is not set, only the cache of this process is filled.')
+
+        queries = [(example.query_language, example.query_string) for example in Example.objects.all()]
+
+        for query_file in options['query_files']:
+            with open(query_file) as fp:
+                for query in fp.read().split('\n\n'):
+                    if query.strip():
+                        queries.append((options['query_language'], query))
+
+        for query_language, query in queries:
+            try:
+                compile_query(process_query_language(None, query_language), query)
+            except ValidationError as e:
+                self.stderr.write('Could not compile "%s" (%s)' % (query.strip(), e))
+            else:
+                self.stdout.write('Compiled "%s"' % query.strip())
@@ -1,4 +1,9 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
 
 from daiquiri.core.managers import AccessLevelManager
 from daiquiri.jobs.managers import JobManager
@@ -10,6 +15,140 @@ class QueryJobManager(JobManager):
         # get the size of all the tables of this user
         return self.filter_by_owner(user).exclude(phase=self.model.PHASE_ARCHIVED).aggregate(models.Sum('size'))['size__sum'] or 0
 
+    def create_batch(self, jobs, run=False):
+        # save a batch of processed jobs in one transaction, bulk_create can not be used,
+        # since the QueryJob model inherits from Job
+        from .scheduler import dispatch_query_jobs
+        from .tasks import run_query
+
+        for job in jobs:
+            if not getattr(job, 'is_clean', False):
+                raise Exception('job.process() was not called.')
+
+        with transaction.atomic():
+            for job in jobs:
+                job.save()
+
+            if run:
+                # the jobs are saved as PENDING first, then all of them are queued with one update
+                values = {'phase': self.model.PHASE_QUEUED}
+                if settings.ASYNC and not settings.QUERY_FAIR_SHARE:
+                    values['dispatch_time'] = now()
+
+                self.filter(pk__in=[job.pk for job in jobs]).update(**values)
+
+                for job in jobs:
+                    for field, value in values.items():
+                        setattr(job, field, value)
+
+        if run:
+            if not settings.ASYNC:
+                for job in jobs:
+                    run_query.apply((str(job.id), ), task_id=str(job.id), throw=True)
+
+            elif settings.QUERY_FAIR_SHARE:
+                dispatch_query_jobs()
+
+            else:
+                # publish all tasks using the same connection to the broker
+                with run_query.app.producer_or_acquire() as producer:
+                    for job in jobs:
+                        queue, priority = job.get_route()
+                        run_query.apply_async((str(job.id), ), task_id=str(job.id), queue=queue,
+                                              priority=priority, producer=producer)
+
+        return jobs
+
+    def get_cached_result(self, job):
+        # get the most recent completed job of the same owner with the same result
+        if settings.QUERY_RESULT_CACHE and job.result_fingerprint:
+            return self.filter_by_owner(job.owner).filter(
+                phase=self.model.PHASE_COMPLETED,
+                result_fingerprint=job.result_fingerprint,
+                end_time__gte=now() - timedelta(seconds=settings.QUERY_RESULT_CACHE_AGE)
+            ).exclude(pk=job.pk).order_by('-end_time').first()
+
+    def invalidate_results(self, schema_name, table_name=None):
+        # the results of queries on this schema or table can not be reused anymore, the tables
+        # of a query are stored in QueryJobTable, older results are not reused anyway
+        source_tables = {'source_tables__schema_name': schema_name}
+        if table_name is not None:
+            source_tables['source_tables__table_name'] = table_name
+
+        return self.exclude(result_fingerprint='').filter(
+            models.Q(end_time=None) | models.Q(end_time__gte=now() - timedelta(seconds=settings.QUERY_RESULT_CACHE_AGE)),
+            **source_tables
+        ).update(result_fingerprint='')
+
+
+class DownloadJobManager(JobManager):
+
+    def create_download(self, job, format_key, client_ip=None):
+        with transaction.atomic():
+            # lock the query job, so that concurrent requests for the same file create only one download job
+            type(job).objects.select_for_update().get(pk=job.pk)
+
+            download_job = self.filter(job=job, format_key=format_key).first()
+
+            if download_job is None:
+                download_job = self.model(
+                    job_type=job.JOB_TYPE_INTERFACE,
+                    client_ip=client_ip,
+                    job=job,
+                    format_key=format_key
+                )
+
+            elif download_job.phase in (download_job.PHASE_PENDING, ) + download_job.PHASE_ACTIVE:
+                # the file is already being created by another request
+                return download_job
+
+            elif download_job.is_cached:
+                # the file can be reused
+                return download_job
+
+            else:
+                # the file was lost, evicted, its creation failed or the query job was changed
+                fingerprint = download_job.get_fingerprint()
+
+                if download_job.phase != download_job.PHASE_ERROR or download_job.fingerprint != fingerprint:
+                    # the parts of a failed download are kept to resume the creation of the file
+                    download_job.delete_file()
+                    download_job.parts = None
+
+                download_job.phase = download_job.PHASE_PENDING
+                download_job.error_summary = None
+
+            download_job.fingerprint = download_job.get_fingerprint()
+            download_job.process()
+            download_job.save()
+
+        download_job.run()
+        return download_job
+
+    def evict(self, cache_size, keep=None):
+        # the size of the files is taken from bytes_written, so that the files are only
+        # touched when they are removed
+        download_jobs = self.filter(phase=self.model.PHASE_COMPLETED)
+
+        total_size = download_jobs.aggregate(models.Sum('bytes_written'))['bytes_written__sum'] or 0
+        if total_size <= cache_size:
+            return
+
+        # remove the files of completed downloads, least recently used first, until they fit into the cache size
+        download_jobs = download_jobs.exclude(pk=keep).select_related('owner', 'job') \
+                                     .order_by(Coalesce('access_time', 'end_time').asc())
+
+        for download_job in download_jobs.iterator():
+            if total_size <= cache_size:
+                break
+
+            download_job.delete_file()
+            download_job.parts = None
+            download_job.phase = download_job.PHASE_ARCHIVED
+            download_job.save(update_fields=['parts', 'phase'])
+
+            total_size -= download_job.bytes_written
+
 
 class ExampleManager(AccessLevelManager):
 
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_query', '0024_fix_jsonfield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadjob',
+            name='parts',
+            field=jsonfield.fields.JSONField(blank=True, help_text='Parts of the file, which are created in parallel.', null=True, verbose_name='Parts'),
+        ),
+        migrations.AddField(
+            model_name='downloadjob',
+            name='rows_written',
+            field=models.BigIntegerField(default=0, help_text='Number of rows written to the file so far.', verbose_name='Rows written'),
+        ),
+        migrations.AddField(
+            model_name='downloadjob',
+            name='bytes_written',
+            field=models.BigIntegerField(default=0, help_text='Number of bytes written to the file so far.', verbose_name='Bytes written'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_query', '0025_downloadjob_parts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='downloadjob',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', help_text='Fingerprint of the query job and the format, used as name for the file.', max_length=64, verbose_name='Fingerprint'),
+        ),
+        migrations.AddField(
+            model_name='downloadjob',
+            name='access_time',
+            field=models.DateTimeField(blank=True, help_text='Last time the file was downloaded.', null=True, verbose_name='Access time'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_query', '0026_downloadjob_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queryjob',
+            name='dispatch_time',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
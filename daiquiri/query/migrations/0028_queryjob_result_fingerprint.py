@@ -0,0 +1,18 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_query', '0027_queryjob_dispatch_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queryjob',
+            name='result_fingerprint',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+    ]
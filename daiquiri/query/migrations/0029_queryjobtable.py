@@ -0,0 +1,28 @@
+# Generated by Django 4.0.10 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daiquiri_query', '0028_queryjob_result_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryJobTable',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema_name', models.CharField(db_index=True, help_text='Schema of the table used by the query.', max_length=256, verbose_name='Schema name')),
+                ('table_name', models.CharField(db_index=True, help_text='Name of the table used by the query.', max_length=256, verbose_name='Table name')),
+                ('job', models.ForeignKey(help_text='QueryJob which uses this table.', on_delete=django.db.models.deletion.CASCADE, related_name='source_tables', to='daiquiri_query.queryjob', verbose_name='QueryJob')),
+            ],
+            options={
+                'verbose_name': 'QueryJobTable',
+                'verbose_name_plural': 'QueryJobTables',
+                'ordering': ('job', 'schema_name', 'table_name'),
+            },
+        ),
+    ]
@@ -1,5 +1,8 @@
+import hashlib
 import logging
 import os
+import shutil
+import uuid
 
 from collections import OrderedDict
 
@@ -7,7 +10,7 @@ from celery.app.control import Control
 
 from django.conf import settings
 from django.contrib.auth.models import Group
-from django.db import models
+from django.db import models, transaction
 from django.db.utils import OperationalError, ProgrammingError, InternalError, DataError
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
@@ -19,14 +22,14 @@ from jsonfield import JSONField
 
 from daiquiri.core.adapter import DatabaseAdapter, DownloadAdapter
 from daiquiri.core.constants import ACCESS_LEVEL_CHOICES
-from daiquiri.core.generators import generate_votable
+from daiquiri.core.generators import generate_votable, generate_votable_binary2, generate_compressed, generate_zip
 from daiquiri.jobs.models import Job
 from daiquiri.jobs.managers import JobManager
 from daiquiri.jobs.exceptions import JobError
 from daiquiri.files.utils import check_file
 from daiquiri.stats.models import Record
 
-from .managers import QueryJobManager, ExampleManager
+from .managers import QueryJobManager, DownloadJobManager, ExampleManager
 from .utils import (
     get_format_config,
     get_job_sources,
@@ -40,11 +43,13 @@ from .process import (
     process_query_language,
     process_queue,
     process_response_format,
-    translate_query,
-    process_query,
+    process_estimate,
+    process_result_fingerprint,
+    compile_query,
     process_display_columns,
     check_permissions,
 )
+from .scheduler import dispatch_query_jobs
 from .tasks import (
     run_query,
     run_ingest,
@@ -81,6 +86,10 @@ class QueryJob(Job):
 
     pid = models.IntegerField(null=True, blank=True)
 
+    dispatch_time = models.DateTimeField(null=True, blank=True)
+
+    result_fingerprint = models.CharField(max_length=64, blank=True, default='', db_index=True)
+
     class Meta:
         ordering = ('start_time', )
 
@@ -113,6 +122,10 @@ class QueryJob(Job):
     def quote(self):
         return None
 
+    @property
+    def progress(self):
+        return self.metadata.get('progress') if self.metadata else None
+
     @property
     def time_queue(self):
         if self.start_time and self.creation_time:
@@ -142,13 +155,14 @@ class QueryJob(Job):
     def column_names(self):
         return [column['name'] for column in self.metadata['columns']]
 
-    def process(self, upload=False):
+    def process(self, upload=False, check_limits=True):
         # log the query to the query log
         query_logger.info('"%s" %s %s', self.query, self.query_language, self.owner or 'anonymous')
 
-        # check quota and number of active jobs
-        check_quota(self)
-        check_number_of_active_jobs(self)
+        # check quota and number of active jobs, for a batch of jobs this is done only once
+        if check_limits:
+            check_quota(self)
+            check_number_of_active_jobs(self)
 
         # process schema_name, table_name and response format
         self.schema_name = process_schema_name(self.owner, self.schema_name)
@@ -172,13 +186,11 @@ class QueryJob(Job):
             # log the input query to the debug log
             logger.debug('query = "%s"', self.query)
 
-            # translate the query from adql
-            translated_query = translate_query(self.query_language, self.query)
+            # translate the query from adql and process it, or reuse the result for an identical query
+            processor = compile_query(self.query_language, self.query)
 
             # log the translated query to the debug log
-            logger.debug('translated_query = "%s"', translated_query)
-
-            processor = process_query(translated_query)
+            logger.debug('translated_query = "%s"', processor.translated_query)
 
             # log the processor output to the debug log
             logger.debug('native_query = "%s"', processor.query)
@@ -209,6 +221,20 @@ class QueryJob(Job):
             # get the native query from the processor (without trailing semicolon)
             self.native_query = processor.query.rstrip(';')
 
+            # estimate the number of rows and the cost of the query, this can reject the query,
+            # sync queries are not routed and are limited by QUERY_SYNC_TIMEOUT anyway
+            if self.job_type != self.JOB_TYPE_SYNC:
+                self.metadata['estimate'] = process_estimate(self.native_query)
+
+            # identify the result, so that the result of an identical query can be reused
+            self.result_fingerprint = process_result_fingerprint(
+                self.owner,
+                self.native_query,
+                self.max_records,
+                processor.tables,
+                processor.functions
+            )
+
             # set clean flag
             self.is_clean = True
 
@@ -226,15 +252,36 @@ class QueryJob(Job):
                 logger.info('job %s submitted (sync)' % self.id)
                 run_query.apply((job_id, ), task_id=job_id, throw=True)
 
+            elif settings.QUERY_FAIR_SHARE:
+                # the job is released to the workers by the scheduler, when it is its turn
+                logger.info('job %s submitted (async, fair share)' % self.id)
+                dispatch_query_jobs()
+
             else:
-                logger.info('job %s submitted (async, queue=query, priority=%s)' % (self.id, self.priority))
-                run_query.apply_async((job_id, ), task_id=job_id, queue='query', priority=self.priority)
+                self.dispatch_time = now()
+                self.save(update_fields=['dispatch_time'])
+
+                queue, priority = self.get_route()
+                logger.info('job %s submitted (async, queue=%s, priority=%s)' % (self.id, queue, priority))
+                run_query.apply_async((job_id, ), task_id=job_id, queue=queue, priority=priority)
 
         else:
             raise ValidationError({
                 'phase': ['Job is not PENDING.']
             })
 
+    def get_route(self):
+        # the celery queue and priority are taken from the first entry in QUERY_ESTIMATE_ROUTES
+        # where the estimate of the job does not exceed any of the given values
+        estimate = self.metadata.get('estimate') if self.metadata else None
+
+        if estimate:
+            for route in settings.QUERY_ESTIMATE_ROUTES:
+                if all(estimate.get(key) is not None and estimate[key] <= route[key] for key in ['rows', 'cost'] if key in route):
+                    return route.get('queue', 'query'), route.get('priority', self.priority)
+
+        return 'query', self.priority
+
     def run_sync(self):
         adapter = DatabaseAdapter()
 
@@ -264,15 +311,24 @@ class QueryJob(Job):
         try:
             download_adapter = DownloadAdapter()
 
-            yield from generate_votable(adapter.fetchall(self.actual_query), get_job_columns(self),
-                                        table=download_adapter.get_table_name(self.schema_name, self.table_name),
-                                        infos=download_adapter.get_infos('OK', self.query, self.query_language, job_sources),
-                                        links=download_adapter.get_links(job_sources))
+            if self.response_format == 'votable-binary2':
+                generator = generate_votable_binary2
+            else:
+                generator = generate_votable
+
+            yield from generator(adapter.fetchall(self.actual_query), get_job_columns(self),
+                                 table=download_adapter.get_table_name(self.schema_name, self.table_name),
+                                 infos=download_adapter.get_infos('OK', self.query, self.query_language, job_sources),
+                                 links=download_adapter.get_links(job_sources))
             self.drop_uploads()
 
         except (OperationalError, ProgrammingError, InternalError, DataError) as e:
             raise StopIteration()
 
+        finally:
+            # the connection is reused, so the timeout of the sync query needs to be reset
+            adapter.reset_session()
+
     def ingest(self, file_path):
         if self.phase == self.PHASE_PENDING:
             self.phase = self.PHASE_QUEUED
@@ -304,6 +360,9 @@ class QueryJob(Job):
             if current_phase == self.PHASE_EXECUTING:
                 self.abort_query()
 
+            # a revoked task does not release the next queued jobs, so this is done here
+            dispatch_query_jobs()
+
     def archive(self):
         self.abort()
         self.drop_table()
@@ -346,15 +405,31 @@ class QueryJob(Job):
     def abort_query(self):
         task_args = (self.pid, )
 
+        # for asyncronous jobs, the QueryMonitor in the run_query task cancels the query as well,
+        # as soon as it notices that the phase has changed
         if not settings.ASYNC:
             abort_query.apply(task_args, throw=True)
         else:
             abort_query.apply_async(task_args)
 
-    def stream(self, format_key):
+    def update_progress(self, progress):
+        # lock the row, since the job can be aborted by a different process at the same time
+        with transaction.atomic():
+            query_job = QueryJob.objects.select_for_update().get(pk=self.pk)
+
+            if query_job.phase == self.PHASE_EXECUTING:
+                query_job.metadata = dict(query_job.metadata or {}, progress=progress)
+                query_job.save(update_fields=['metadata'])
+
+        return query_job
+
+    def stream(self, format_key, part=None, download_adapter=None):
         if self.phase == self.PHASE_COMPLETED:
-            return DownloadAdapter().generate(
-                format_key,
+            # compressed formats use the generator of the uncompressed format
+            format_config = get_format_config(format_key) or {}
+
+            generator = (download_adapter or DownloadAdapter()).generate(
+                format_config.get('format', format_key),
                 self.metadata.get('columns', []),
                 sources=self.metadata.get('sources', []),
                 schema_name=self.schema_name,
@@ -362,14 +437,20 @@ class QueryJob(Job):
                 nrows=self.nrows,
                 query_status=self.result_status,
                 query=self.query,
-                query_language=self.query_language
+                query_language=self.query_language,
+                part=part
             )
+
+            if format_config.get('compression'):
+                return generate_compressed(generator, format_config['compression'])
+            else:
+                return generator
         else:
             raise ValidationError({
                 'phase': ['Job is not COMPLETED.']
             })
 
-    def rows(self, column_names, ordering, page, page_size, search, filters):
+    def rows(self, column_names, ordering, page, page_size, search, filters, cursor=None):
         if self.phase == self.PHASE_COMPLETED:
             # check if the columns are actually in the jobs table
             errors = {}
@@ -386,19 +467,19 @@ class QueryJob(Job):
 
             try:
                 # query the database for the total number of rows
-                count = adapter.count_rows(self.schema_name, self.table_name, column_names, search, filters)
+                count, estimated = adapter.fetch_count(self.schema_name, self.table_name, column_names, search, filters, nrows=self.nrows)
 
                 # query the paginated rowset
-                rows = adapter.fetch_rows(self.schema_name, self.table_name, column_names, ordering, page, page_size, search, filters)
+                rows, cursors = adapter.fetch_page(self.schema_name, self.table_name, column_names, ordering, page, page_size, search, filters, cursor=cursor)
 
                 # flatten the list if only one column is retrieved
                 if len(column_names) == 1:
-                    return count, [element for row in rows for element in row]
+                    return count, estimated, [element for row in rows for element in row], cursors
                 else:
-                    return count, rows
+                    return count, estimated, rows, cursors
 
             except ProgrammingError:
-                return 0, []
+                return 0, False, [], None
 
         else:
             raise ValidationError({
@@ -412,9 +493,37 @@ class QueryJob(Job):
             return []
 
 
+class QueryJobTable(models.Model):
+
+    job = models.ForeignKey(
+        QueryJob, related_name='source_tables', on_delete=models.CASCADE,
+        verbose_name=_('QueryJob'),
+        help_text=_('QueryJob which uses this table.')
+    )
+    schema_name = models.CharField(
+        max_length=256, db_index=True,
+        verbose_name=_('Schema name'),
+        help_text=_('Schema of the table used by the query.')
+    )
+    table_name = models.CharField(
+        max_length=256, db_index=True,
+        verbose_name=_('Table name'),
+        help_text=_('Name of the table used by the query.')
+    )
+
+    class Meta:
+        ordering = ('job', 'schema_name', 'table_name')
+
+        verbose_name = _('QueryJobTable')
+        verbose_name_plural = _('QueryJobTables')
+
+    def __str__(self):
+        return '%s.%s' % (self.schema_name, self.table_name)
+
+
 class DownloadJob(Job):
 
-    objects = JobManager()
+    objects = DownloadJobManager()
 
     job = models.ForeignKey(
         QueryJob, related_name='downloads', on_delete=models.CASCADE,
@@ -426,6 +535,31 @@ class DownloadJob(Job):
         verbose_name=_('Format key'),
         help_text=_('Format key for this download.')
     )
+    parts = JSONField(
+        null=True, blank=True,
+        verbose_name=_('Parts'),
+        help_text=_('Parts of the file, which are created in parallel.')
+    )
+    rows_written = models.BigIntegerField(
+        default=0,
+        verbose_name=_('Rows written'),
+        help_text=_('Number of rows written to the file so far.')
+    )
+    bytes_written = models.BigIntegerField(
+        default=0,
+        verbose_name=_('Bytes written'),
+        help_text=_('Number of bytes written to the file so far.')
+    )
+    fingerprint = models.CharField(
+        max_length=64, blank=True, default='',
+        verbose_name=_('Fingerprint'),
+        help_text=_('Fingerprint of the query job and the format, used as name for the file.')
+    )
+    access_time = models.DateTimeField(
+        blank=True, null=True,
+        verbose_name=_('Access time'),
+        help_text=_('Last time the file was downloaded.')
+    )
 
     class Meta:
         ordering = ('start_time', )
@@ -443,11 +577,40 @@ class DownloadJob(Job):
         format_config = get_format_config(self.format_key)
 
         if format_config:
+            # files of older download jobs are still named after the table
             directory_name = os.path.join(settings.QUERY_DOWNLOAD_DIR, username)
-            return os.path.join(directory_name, '%s.%s' % (self.job.table_name, format_config['extension']))
+            return os.path.join(directory_name, '%s.%s' % (self.fingerprint or self.job.table_name, format_config['extension']))
         else:
             return None
 
+    @property
+    def file_name(self):
+        format_config = get_format_config(self.format_key)
+
+        if format_config:
+            return '%s.%s' % (self.job.table_name, format_config['extension'])
+        else:
+            return None
+
+    @property
+    def is_cached(self):
+        # the file can be reused if it exists and the query job was not changed since its creation
+        return self.phase == self.PHASE_COMPLETED and \
+            self.fingerprint == self.get_fingerprint() and \
+            os.path.isfile(self.file_path)
+
+    def get_fingerprint(self):
+        return hashlib.sha256(('%s:%s:%s:%s' % (
+            self.job.id,
+            self.format_key,
+            self.job.size,
+            self.job.nrows
+        )).encode()).hexdigest()[:32]
+
+    def touch(self):
+        self.access_time = now()
+        DownloadJob.objects.filter(pk=self.pk).update(access_time=self.access_time)
+
     def process(self):
         if self.job.phase == self.PHASE_COMPLETED:
             self.owner = self.job.owner
@@ -482,11 +645,43 @@ class DownloadJob(Job):
             })
 
     def delete_file(self):
-        try:
-            if self.file_path is not None:
-                os.remove(self.file_path)
-        except OSError:
-            pass
+        if self.file_path is not None:
+            for file_path in [self.file_path] + [self.get_part_path(index) for index in range(len(self.parts or []))]:
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+    def get_part_path(self, index):
+        return '%s.part%d' % (self.file_path, index)
+
+    def update_part(self, index, **values):
+        # lock the row, since the parts are updated concurrently by different workers
+        with transaction.atomic():
+            download_job = DownloadJob.objects.select_for_update().get(pk=self.pk)
+            download_job.parts[index].update(values)
+            download_job.rows_written = sum([part.get('rows', 0) for part in download_job.parts])
+            download_job.bytes_written = sum([part.get('bytes', 0) for part in download_job.parts])
+            download_job.save(update_fields=['parts', 'rows_written', 'bytes_written'])
+
+        return download_job
+
+    def concatenate_parts(self):
+        if len(self.parts) == 1:
+            os.replace(self.get_part_path(0), self.file_path)
+        else:
+            # write into a temporary file first, so that the file appears only when it is complete
+            tmp_path = '%s.%s.tmp' % (self.file_path, uuid.uuid4().hex)
+
+            with open(tmp_path, 'wb') as f:
+                for index in range(len(self.parts)):
+                    with open(self.get_part_path(index), 'rb') as part_file:
+                        shutil.copyfileobj(part_file, f, 1024 * 1024)
+
+            os.replace(tmp_path, self.file_path)
+
+            for index in range(len(self.parts)):
+                os.remove(self.get_part_path(index))
 
 
 class QueryArchiveJob(Job):
@@ -592,6 +787,9 @@ class QueryArchiveJob(Job):
         except OSError:
             pass
 
+    def stream(self):
+        return generate_zip(settings.FILES_BASE_PATH, self.files)
+
 
 class Example(models.Model):
 
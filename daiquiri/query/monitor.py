@@ -0,0 +1,52 @@
+import logging
+import threading
+
+from django.db import connections
+from django.utils.timezone import now
+
+from daiquiri.core.adapter import DatabaseAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class QueryMonitor(threading.Thread):
+
+    def __init__(self, job, interval):
+        super().__init__(name='query-monitor-%s' % job.id, daemon=True)
+
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.aborted = False
+
+    def run(self):
+        # the thread uses its own connections, while the query is executed by the task
+        adapter = DatabaseAdapter()
+
+        try:
+            while not self.aborted and not self.stopped.wait(self.interval):
+                try:
+                    progress = adapter.fetch_progress(self.job.pid)
+                    progress['elapsed_time'] = (now() - self.job.start_time).total_seconds()
+
+                    # if the database does not report the rows (see fetch_progress), report the estimate instead
+                    estimate = (self.job.metadata or {}).get('estimate')
+                    if 'rows' not in progress and estimate and estimate.get('rows') is not None:
+                        progress['estimated_rows'] = estimate['rows']
+
+                    job = self.job.update_progress(progress)
+
+                    # cancel the query right away if the job was aborted (or archived)
+                    if job.phase != job.PHASE_EXECUTING:
+                        logger.info('job %s aborted, cancel query %s' % (job.id, job.pid))
+                        self.aborted = True
+                        adapter.abort_query(self.job.pid)
+
+                except Exception as e:
+                    logger.error('job %s could not be monitored (%s)' % (self.job.id, e))
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
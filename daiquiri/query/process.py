@@ -1,9 +1,13 @@
+import hashlib
 import json
-from collections import OrderedDict
+import re
+import threading
+from collections import OrderedDict, namedtuple
 
 from daiquiri.core.adapter import DatabaseAdapter
 from daiquiri.core.utils import filter_by_access_level
-from daiquiri.metadata.models import Column, Function, Schema, Table
+from daiquiri.metadata.models import Table
+from daiquiri.metadata.utils import get_metadata_version, get_permission_snapshot
 from django.conf import settings
 from django.core.cache import cache
 from django.utils.translation import gettext as _
@@ -11,8 +15,21 @@ from queryparser.adql import ADQLQueryTranslator
 from queryparser.exceptions import QueryError, QuerySyntaxError
 from rest_framework.exceptions import ValidationError
 
-from .utils import (get_default_table_name, get_indexed_objects,
-                    get_max_active_jobs, get_quota, get_user_schema_name)
+from .utils import (get_column_names, get_default_table_name,
+                    get_indexed_objects, get_max_active_jobs, get_quota,
+                    get_user_schema_name)
+
+# the result of translate_query and process_query, which is kept in the compiled query cache
+CompiledQuery = namedtuple('CompiledQuery', [
+    'translated_query', 'query', 'keywords', 'tables', 'columns', 'functions', 'display_columns'
+])
+
+# the compiled queries of this process, least recently used first
+compiled_queries = OrderedDict()
+compiled_queries_lock = threading.Lock()
+
+# the translator and processor objects of the current thread, they are reused for every query
+parsers = threading.local()
 
 
 def check_quota(job):
@@ -25,12 +42,13 @@ def check_quota(job):
         })
 
 
-def check_number_of_active_jobs(job):
+def check_number_of_active_jobs(job, count=1):
     # get the model from the instance to prevent circular inclusion
     QueryJob = type(job)
 
+    # count is the number of jobs which are about to be submitted
     max_active_jobs = get_max_active_jobs(job.owner)
-    if max_active_jobs and max_active_jobs <= QueryJob.objects.get_active(job.owner).count():
+    if max_active_jobs and max_active_jobs < QueryJob.objects.get_active(job.owner).count() + count:
         raise ValidationError({
             'query': [_('Too many active jobs. Please abort some of your active jobs or wait until they are completed.')]
         })
@@ -103,16 +121,70 @@ def process_queue(user, queue):
         return queues[0]['key']
 
 
+def process_estimate(query):
+    # the estimate is only needed for the limits and the routes
+    if not (settings.QUERY_ESTIMATE_LIMITS or settings.QUERY_ESTIMATE_ROUTES):
+        return None
+
+    # estimate the query using the query planner of the database, this might not be possible,
+    # e.g. if the query uses uploaded tables
+    estimate = DatabaseAdapter().fetch_estimate(query)
+
+    if estimate:
+        for key, limit in settings.QUERY_ESTIMATE_LIMITS.items():
+            if estimate.get(key) is not None and estimate[key] > limit:
+                raise ValidationError({
+                    'query': [_('The query is estimated to be too expensive (%(key)s: %(value)g, limit: %(limit)g). '
+                                'Please restrict the query, e.g. using a WHERE clause or a smaller region.') % {
+                        'key': key,
+                        'value': estimate[key],
+                        'limit': limit
+                    }]
+                })
+
+    return estimate
+
+
+def process_result_fingerprint(user, query, max_records, tables, functions):
+    # the fingerprint identifies the result of a query, it is empty if the result can not be reused
+    if not settings.QUERY_RESULT_CACHE:
+        return ''
+
+    # queries with functions like random() or now() give a different result every time
+    excluded_functions = [function_name.lower() for function_name in settings.QUERY_RESULT_CACHE_EXCLUDED_FUNCTIONS]
+    if any(function_name.lower() in excluded_functions for function_name in functions):
+        return ''
+
+    versions = []
+    for schema_name, table_name in sorted(tables):
+        # the tables in the user schema and the uploaded tables can change at any time
+        if schema_name in [get_user_schema_name(user), settings.TAP_UPLOAD]:
+            return ''
+
+        # the version of the table is taken from the metadata store
+        table = Table.objects.filter(schema__name=schema_name, name=table_name)
+        version = table.values_list('updated', 'nrows', 'size').first()
+        versions.append('%s.%s:%s' % (schema_name, table_name, version))
+
+    return hashlib.sha256(('%s:%s:%s' % (
+        query,
+        max_records,
+        ','.join(versions)
+    )).encode()).hexdigest()
+
+
 def process_response_format(response_format):
     if response_format:
-        response_format = response_format.lower()
+        response_format = response_format.lower().replace(' ', '')
 
-        if response_format in [item['key'] for item in settings.QUERY_DOWNLOAD_FORMATS]:
-            return response_format
-        else:
-            raise ValidationError({
-                'response_format': [_('This response format is not supported.')]
-            })
+        for item in settings.QUERY_DOWNLOAD_FORMATS:
+            # the format can be given by its key or by one of its aliases, e.g. a mime type
+            if response_format == item['key'] or response_format in item.get('aliases', []):
+                return item['key']
+
+        raise ValidationError({
+            'response_format': [_('This response format is not supported.')]
+        })
     else:
         # return the default response_format
         return settings.QUERY_DEFAULT_DOWNLOAD_FORMAT
@@ -125,7 +197,7 @@ def translate_query(query_language, query):
     # translate adql string
     if query_language == 'adql-2.0':
         try:
-            translator = cache.get_or_set('translator', ADQLQueryTranslator(), 3600)
+            translator = get_translator()
             translator.set_query(query)
 
             if adapter.database_config['ENGINE'] == 'django.db.backends.mysql':
@@ -169,13 +241,13 @@ def process_query(query):
             from queryparser.postgresql import PostgreSQLQueryProcessor
 
             if settings.QUERY_PROCESSOR_CACHE:
-                processor = cache.get_or_set('processor', PostgreSQLQueryProcessor(), 3600)
+                processor = get_processor(PostgreSQLQueryProcessor)
             else:
                 processor = PostgreSQLQueryProcessor()
 
             # first run to replace with get_indexed_objects
             processor.set_query(query)
-            processor.process_query(indexed_objects=get_indexed_objects(), replace_schema_name={
+            processor.process_query(indexed_objects=get_cached_indexed_objects(), replace_schema_name={
                 'TAP_SCHEMA': settings.TAP_SCHEMA,
                 'tap_schema': settings.TAP_SCHEMA,
                 'TAP_UPLOAD': settings.TAP_UPLOAD,
@@ -207,13 +279,102 @@ def process_query(query):
     return processor
 
 
+def compile_query(query_language, query):
+    # translate and process the query, or get the result from a previous identical query
+    key = get_compiled_query_key(query_language, query)
+
+    with compiled_queries_lock:
+        compiled_query = compiled_queries.get(key)
+        if compiled_query is not None:
+            compiled_queries.move_to_end(key)
+            return compiled_query
+
+    if settings.QUERY_COMPILE_CACHE_SHARED:
+        compiled_query = cache.get(key)
+
+    if compiled_query is None:
+        translated_query = translate_query(query_language, query)
+        processor = process_query(translated_query)
+
+        compiled_query = CompiledQuery(
+            translated_query,
+            processor.query,
+            processor.keywords,
+            processor.tables,
+            processor.columns,
+            processor.functions,
+            processor.display_columns
+        )
+
+        if settings.QUERY_COMPILE_CACHE_SHARED:
+            cache.set(key, compiled_query, settings.QUERY_COMPILE_CACHE_TIMEOUT)
+
+    with compiled_queries_lock:
+        compiled_queries[key] = compiled_query
+        while len(compiled_queries) > settings.QUERY_COMPILE_CACHE_SIZE:
+            compiled_queries.popitem(last=False)
+
+    return compiled_query
+
+
+def get_compiled_query_key(query_language, query):
+    # the processed query depends on the metadata, e.g. the indexed columns
+    key = json.dumps([
+        DatabaseAdapter().database_config['ENGINE'],
+        query_language,
+        normalize_query(query),
+        get_metadata_version()
+    ])
+    return 'daiquiri.compiled_query.' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def normalize_query(query):
+    query = query.strip().rstrip(';').strip()
+
+    # a line break ends a comment, so queries with comments are used as they are
+    if '--' in query:
+        return query
+
+    # collapse the whitespace outside of the quoted strings and identifiers
+    parts = re.split(r'(\'(?:[^\']|\'\')*\'|"(?:[^"]|"")*")', query)
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+
+
+def get_translator():
+    if getattr(parsers, 'translator', None) is None:
+        parsers.translator = ADQLQueryTranslator()
+
+    return parsers.translator
+
+
+def get_processor(processor_class):
+    # the processor is created again when the metadata was changed
+    version = get_metadata_version()
+
+    if getattr(parsers, 'processor_version', None) != version:
+        parsers.processor = processor_class()
+        parsers.processor_version = version
+
+    return parsers.processor
+
+
+def get_cached_indexed_objects():
+    version = get_metadata_version()
+
+    if getattr(parsers, 'indexed_objects_version', None) != version:
+        parsers.indexed_objects = get_indexed_objects()
+        parsers.indexed_objects_version = version
+
+    return parsers.indexed_objects
+
+
 def process_display_columns(processor_display_columns):
     # process display_columns to expand *
     display_columns = []
     for processor_display_column, original_column in processor_display_columns:
         if processor_display_column == '*':
             schema_name, table_name, tmp = original_column
-            for column_name in DatabaseAdapter().fetch_column_names(schema_name, table_name):
+            for column_name in get_column_names(schema_name, table_name):
                 display_columns.append((column_name, (schema_name, table_name, column_name)))
 
         else:
@@ -241,6 +402,9 @@ def process_display_columns(processor_display_columns):
 def check_permissions(user, keywords, tables, columns, functions):
     messages = []
 
+    # get the names of the schemas, tables, columns and functions the user has access to
+    snapshot = get_permission_snapshot(user)
+
     # check keywords against whitelist
     for keywords in keywords:
         pass
@@ -259,27 +423,20 @@ def check_permissions(user, keywords, tables, columns, functions):
         elif schema_name == settings.TAP_UPLOAD:
             # all tables are allowed move to next table
             continue
-        else:
-            # check permissions on the schema
-            try:
-                schema = Schema.objects.filter_by_access_level(user).get(name=schema_name)
-            except Schema.DoesNotExist:
-                # schema not found or not allowed, move to next table
-                messages.append(_('Schema %s not found.') % schema_name)
-                continue
+        elif schema_name not in snapshot['schemas']:
+            # schema not found or not allowed, move to next table
+            messages.append(_('Schema %s not found.') % schema_name)
+            continue
 
         # check permission on table
         if table_name is None:
             # table_name must not be null, move to next table
             messages.append(_('No table given for schema %s.') % schema_name)
             continue
-        else:
-            try:
-                Table.objects.filter_by_access_level(user).filter(schema=schema).get(name=table_name)
-            except Table.DoesNotExist:
-                # table not found or not allowed, move to next table
-                messages.append(_('Table %s not found.') % table_name)
-                continue
+        elif (schema_name, table_name) not in snapshot['tables']:
+            # table not found or not allowed, move to next table
+            messages.append(_('Table %s not found.') % table_name)
+            continue
 
     # loop over columns to check permissions or just to see if they are there,
     # but only if no error messages where appended so far
@@ -292,61 +449,41 @@ def check_permissions(user, keywords, tables, columns, functions):
                     or column_name is None:
                 # doesn't need to be checked, move to next column
                 continue
-            else:
-                if not settings.METADATA_COLUMN_PERMISSIONS:
-                    # just check if the column exist
-                    if column_name == '*':
-                        # doesn't need to be checked, move to next table
-                        continue
 
-                    else:
-                        try:
-                            Column.objects.filter(table__schema__name=schema_name).filter(table__name=table_name).get(name=column_name)
-                        except Column.DoesNotExist:
-                            messages.append(_('Column %s not found.') % column_name)
-                            continue
-                else:
-                    try:
-                        schema = Schema.objects.filter_by_access_level(user).get(name=schema_name)
-                    except Schema.DoesNotExist:
-                        messages.append(_('Schema %s not found.') % schema_name)
-                        continue
+            if not settings.METADATA_COLUMN_PERMISSIONS:
+                # all columns of an accessible table are allowed, missing columns are reported by the database
+                if (schema_name, table_name) not in snapshot['tables']:
+                    messages.append(_('Table %s not found.') % table_name)
+                    continue
+            else:
+                # the accessible column names of the table
+                column_names = snapshot['columns'].get((schema_name, table_name), set())
 
-                    try:
-                        table = Table.objects.filter_by_access_level(user).filter(schema=schema).get(name=table_name)
-                    except Table.DoesNotExist:
-                        messages.append(_('Table %s not found.') % table_name)
-                        continue
+                if schema_name not in snapshot['schemas']:
+                    messages.append(_('Schema %s not found.') % schema_name)
+                    continue
 
-                    if column_name == '*':
-                        columns = Column.objects.filter_by_access_level(user).filter(table=table)
-                        actual_columns = DatabaseAdapter().fetch_columns(schema_name, table_name)
+                if (schema_name, table_name) not in snapshot['tables']:
+                    messages.append(_('Table %s not found.') % table_name)
+                    continue
 
-                        column_names_set = set([column.name for column in columns])
-                        actual_column_names_set = set([column['name'] for column in actual_columns])
+                if column_name == '*':
+                    actual_column_names = get_column_names(schema_name, table_name)
 
-                        if column_names_set != actual_column_names_set:
-                            messages.append(_('The asterisk (*) is not allowed for this table.'))
-                            continue
+                    if column_names != set(actual_column_names):
+                        messages.append(_('The asterisk (*) is not allowed for this table.'))
+                        continue
 
-                    else:
-                        try:
-                            column = Column.objects.filter_by_access_level(user).filter(table=table).get(name=column_name)
-                        except Column.DoesNotExist:
-                            messages.append(_('Column %s not found.') % column_name)
-                            continue
+                elif column_name not in column_names:
+                    messages.append(_('Column %s not found.') % column_name)
+                    continue
 
     # check permissions on functions
     for function_name in functions:
 
-        # check permission on function
-        queryset = Function.objects.filter(name=function_name)
-
         # forbit the function if it is in metadata.functions, and the user doesn't have access.
-        if queryset and not queryset.filter_by_access_level(user):
+        if function_name in snapshot['forbidden_functions']:
             messages.append(_('Function %s is not allowed.') % function_name)
-        else:
-            continue
 
     # return the error stack
     return list(set(messages))
@@ -0,0 +1,162 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .utils import get_fair_share_weight
+
+logger = logging.getLogger(__name__)
+
+
+class FairShareScheduler(object):
+    '''
+    Releases QUEUED query jobs to the celery workers. Every owner has a virtual time, which is
+    the query time used in the last QUERY_FAIR_SHARE_WINDOW seconds divided by the weight of the
+    owner. The job of the owner with the lowest virtual time is dispatched next, as long as the
+    concurrency of its queue (from QUERY_QUEUES) is not exhausted.
+    '''
+
+    def __init__(self, send=None):
+        # send is called for every dispatched job, it can be replaced, e.g. in tests
+        self.send = send or self.send_job
+
+    def dispatch(self):
+        from .models import QueryJob
+
+        dispatched_jobs = []
+
+        # lock the queued jobs, so that only one process dispatches them at a time
+        with transaction.atomic():
+            queued_jobs = list(QueryJob.objects.select_for_update().filter(
+                phase=QueryJob.PHASE_QUEUED,
+                dispatch_time=None
+            ).order_by('creation_time'))
+
+            if not queued_jobs:
+                return []
+
+            running_jobs = self.get_running_jobs()
+            counts = self.get_queue_counts(running_jobs)
+            virtual_times = self.get_virtual_times(running_jobs, queued_jobs)
+
+            while queued_jobs:
+                # the jobs which can be dispatched, because their queue is not full
+                jobs = [job for job in queued_jobs if not self.is_full(job.queue, counts)]
+                if not jobs:
+                    break
+
+                # the job of the owner with the lowest virtual time, the oldest job first
+                job = min(jobs, key=lambda job: (virtual_times[job.owner_id], job.creation_time))
+
+                job.dispatch_time = now()
+                job.save(update_fields=['dispatch_time'])
+
+                queued_jobs.remove(job)
+                dispatched_jobs.append(job)
+
+                # account the maximal time of the job to its owner and to its queue
+                counts[job.queue] += 1
+                virtual_times[job.owner_id] += job.timeout / get_fair_share_weight(job.owner)
+
+        # send the jobs after the transaction, so that the workers see the dispatch_time
+        for job in dispatched_jobs:
+            self.send(job)
+
+        return dispatched_jobs
+
+    def get_running_jobs(self):
+        from .models import QueryJob
+
+        # jobs which were dispatched, but are not yet finished
+        return list(QueryJob.objects.filter(phase__in=QueryJob.PHASE_ACTIVE).exclude(dispatch_time=None))
+
+    def get_queue_counts(self, running_jobs):
+        counts = defaultdict(int)
+        for job in running_jobs:
+            counts[job.queue] += 1
+
+        return counts
+
+    def get_virtual_times(self, running_jobs, queued_jobs):
+        from .models import QueryJob
+
+        current_time = now()
+        usage = defaultdict(float)
+
+        # the query time of the recent jobs of the owners with queued jobs
+        owner_ids = set([job.owner_id for job in queued_jobs])
+        recent_filter = Q(owner_id__in=[owner_id for owner_id in owner_ids if owner_id is not None])
+        if None in owner_ids:
+            # anonymous jobs share one owner
+            recent_filter |= Q(owner=None)
+
+        recent_jobs = QueryJob.objects.filter(
+            recent_filter,
+            start_time__gte=current_time - timedelta(seconds=settings.QUERY_FAIR_SHARE_WINDOW)
+        ).values_list('owner_id', 'start_time', 'end_time')
+
+        for owner_id, start_time, end_time in recent_jobs:
+            usage[owner_id] += ((end_time or current_time) - start_time).total_seconds()
+
+        # dispatched jobs which have not started yet count with their maximal time
+        for job in running_jobs:
+            if job.start_time is None and job.owner_id in owner_ids:
+                usage[job.owner_id] += job.timeout
+
+        weights = {job.owner_id: get_fair_share_weight(job.owner) for job in queued_jobs}
+        return defaultdict(float, {owner_id: usage[owner_id] / weights[owner_id] for owner_id in owner_ids})
+
+    def is_full(self, queue_key, counts):
+        concurrency = next((queue.get('concurrency') for queue in settings.QUERY_QUEUES if queue['key'] == queue_key), None)
+        return concurrency is not None and counts[queue_key] >= concurrency
+
+    def send_job(self, job):
+        from .tasks import run_query
+
+        queue, priority = job.get_route()
+        logger.info('job %s dispatched (async, queue=%s, priority=%s)' % (job.id, queue, priority))
+        run_query.apply_async((str(job.id), ), task_id=str(job.id), queue=queue, priority=priority)
+
+    def get_stats(self):
+        from .models import QueryJob
+
+        current_time = now()
+        stats = {
+            'queues': {},
+            'owners': {}
+        }
+
+        for queue in settings.QUERY_QUEUES:
+            stats['queues'][queue['key']] = {
+                'concurrency': queue.get('concurrency'),
+                'running': 0,
+                'waiting': 0
+            }
+
+        jobs = QueryJob.objects.filter(phase__in=QueryJob.PHASE_ACTIVE).select_related('owner')
+        for job in jobs:
+            queue_stats = stats['queues'].setdefault(job.queue, {'concurrency': None, 'running': 0, 'waiting': 0})
+            owner_stats = stats['owners'].setdefault(job.owner.username if job.owner else None, {
+                'running': 0,
+                'waiting': 0,
+                'wait_time': 0
+            })
+
+            if job.dispatch_time is None:
+                queue_stats['waiting'] += 1
+                owner_stats['waiting'] += 1
+                owner_stats['wait_time'] = max(owner_stats['wait_time'], (current_time - job.creation_time).total_seconds())
+            else:
+                queue_stats['running'] += 1
+                owner_stats['running'] += 1
+
+        return stats
+
+
+def dispatch_query_jobs():
+    if settings.ASYNC and settings.QUERY_FAIR_SHARE:
+        return FairShareScheduler().dispatch()
@@ -1,3 +1,6 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework import serializers
 
 from daiquiri.jobs.serializers import SyncJobSerializer, AsyncJobSerializer
@@ -79,6 +82,7 @@ class QueryJobRetrieveSerializer(serializers.ModelSerializer):
             'queue',
             'nrows',
             'size',
+            'progress',
             'sources',
             'columns'
         )
@@ -117,6 +121,38 @@ class QueryJobCreateSerializer(serializers.ModelSerializer):
         )
 
 
+class QueryJobBatchSerializer(serializers.Serializer):
+
+    queries = QueryJobCreateSerializer(many=True)
+
+    def validate_queries(self, queries):
+        if not queries:
+            raise serializers.ValidationError(_('At least one query is required.'))
+
+        if len(queries) > settings.QUERY_BATCH_SIZE:
+            raise serializers.ValidationError(_('A batch can contain at most %d queries.') % settings.QUERY_BATCH_SIZE)
+
+        return queries
+
+
+class QueryJobBatchStatusSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = QueryJob
+        fields = (
+            'id',
+            'run_id',
+            'phase',
+            'creation_time',
+            'start_time',
+            'end_time',
+            'error_summary',
+            'table_name',
+            'nrows',
+            'size'
+        )
+
+
 class QueryJobUpdateSerializer(serializers.ModelSerializer):
 
     table_name = serializers.CharField(required=True, validators=[TableNameValidator()])
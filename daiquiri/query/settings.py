@@ -12,6 +12,8 @@ QUERY_QUOTA = {
     'groups': {}
 }
 QUERY_SYNC_TIMEOUT = 5
+QUERY_BATCH_SIZE = 1000
+QUERY_PROGRESS_INTERVAL = 1
 QUERY_MAX_ACTIVE_JOBS = {
     'anonymous': '1'
 }
@@ -25,6 +27,27 @@ QUERY_QUEUES = [
         'groups': []
     }
 ]
+# release the queued jobs by the fair share of their owners, the concurrency of a queue
+# can be limited with an additional 'concurrency' key in QUERY_QUEUES
+QUERY_FAIR_SHARE = False
+QUERY_FAIR_SHARE_WINDOW = 86400
+QUERY_FAIR_SHARE_WEIGHTS = {
+    'anonymous': 1,
+    'user': 1,
+    'users': {},
+    'groups': {}
+}
+# limits for the rows and cost estimated by the database, e.g. {'rows': 1e9, 'cost': 1e10}
+QUERY_ESTIMATE_LIMITS = {}
+# routes to celery queues by the estimate, e.g. {'cost': 1e6, 'queue': 'query', 'priority': 5}
+QUERY_ESTIMATE_ROUTES = []
+# reuse the results of identical queries, which completed in the last QUERY_RESULT_CACHE_AGE seconds
+QUERY_RESULT_CACHE = False
+QUERY_RESULT_CACHE_AGE = 3600
+QUERY_RESULT_CACHE_EXCLUDED_FUNCTIONS = [
+    'rand', 'random', 'uuid', 'gen_random_uuid', 'now', 'clock_timestamp', 'statement_timestamp',
+    'current_date', 'current_time', 'current_timestamp', 'curdate', 'curtime', 'sysdate'
+]
 QUERY_LANGUAGES = [
     {
         'key': 'adql',
@@ -60,7 +83,16 @@ QUERY_DOWNLOAD_FORMATS = [
         'extension': 'xml',
         'content_type': 'application/xml',
         'label': 'IVOA VOTable XML file - TABLEDATA serialization',
-        'help': 'A XML file using the IVOA VOTable format. Use this option if you intend to use VO compatible software to further process the data.'
+        'help': 'A XML file using the IVOA VOTable format. Use this option if you intend to use VO compatible software to further process the data.',
+        'aliases': ['votable/td', 'application/x-votable+xml']
+    },
+    {
+        'key': 'votable-binary2',
+        'extension': 'binary2.xml',
+        'content_type': 'application/x-votable+xml;serialization=BINARY2',
+        'label': 'IVOA VOTable XML file - BINARY2 serialization',
+        'help': 'A XML file using the IVOA VOTable format with the data stored as base64 encoded binary stream. The file is more compact and faster to read for VO compatible software, but not human readable.',
+        'aliases': ['votable/b2', 'application/x-votable+xml;serialization=binary2']
     },
     {
         'key': 'csv',
@@ -75,8 +107,45 @@ QUERY_DOWNLOAD_FORMATS = [
         'content_type': 'application/fits',
         'label': 'FITS',
         'help': 'Flexible Image Transport System (FITS) file format.'
+    },
+    {
+        'key': 'parquet',
+        'extension': 'parquet',
+        'content_type': 'application/vnd.apache.parquet',
+        'label': 'Apache Parquet',
+        'help': 'A binary columnar file format. Use this option if you intend to process the data with pandas, Spark or other big data tools. The unit, UCD and description of the columns are stored as field metadata.'
+    },
+    {
+        'key': 'votable-gz',
+        'extension': 'xml.gz',
+        'content_type': 'application/gzip',
+        'label': 'IVOA VOTable XML file - TABLEDATA serialization (gzip compressed)',
+        'help': 'A gzip compressed XML file using the IVOA VOTable format. Use this option for large tables if you intend to use VO compatible software.',
+        'format': 'votable',
+        'compression': 'gzip'
+    },
+    {
+        'key': 'csv-gz',
+        'extension': 'csv.gz',
+        'content_type': 'application/gzip',
+        'label': 'Comma separated Values (gzip compressed)',
+        'help': 'A gzip compressed text file with a line for each row of the table. Use this option for large tables.',
+        'format': 'csv',
+        'compression': 'gzip'
+    },
+    {
+        'key': 'fits-gz',
+        'extension': 'fits.gz',
+        'content_type': 'application/gzip',
+        'label': 'FITS (gzip compressed)',
+        'help': 'A gzip compressed Flexible Image Transport System (FITS) file, which can be read directly by most FITS software.',
+        'format': 'fits',
+        'compression': 'gzip'
     }
 ]
+QUERY_DOWNLOAD_PART_ROWS = 1000000
+QUERY_DOWNLOAD_PROGRESS_BYTES = 16777216
+QUERY_DOWNLOAD_CACHE_SIZE = None
 QUERY_UPLOAD = True
 QUERY_UPLOAD_LIMIT = {
     'anonymous': '10Mb',
@@ -84,4 +153,10 @@ QUERY_UPLOAD_LIMIT = {
     'users': {},
     'groups': {}
 }
+# connect and read timeout in seconds for uploads which are downloaded from a url
+QUERY_UPLOAD_TIMEOUT = (10, 60)
 QUERY_PROCESSOR_CACHE = True
+# cache the translated and processed queries in every process, and optionally in the shared cache
+QUERY_COMPILE_CACHE_SIZE = 1024
+QUERY_COMPILE_CACHE_SHARED = False
+QUERY_COMPILE_CACHE_TIMEOUT = 3600
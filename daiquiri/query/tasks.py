@@ -1,6 +1,6 @@
 import logging
 import os
-import zipfile
+import uuid
 
 from celery import shared_task
 
@@ -35,12 +35,20 @@ class RunQueryTask(Task):
         job.error_summary = str(_('There has been an server error with your job.'))
         job.save()
 
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        # always import daiquiri packages inside the task
+        from daiquiri.query.scheduler import dispatch_query_jobs
+
+        # release the next queued jobs, since this job has finished
+        dispatch_query_jobs()
+
 
 @shared_task(base=RunQueryTask)
 def run_query(job_id):
     # always import daiquiri packages inside the task
     from daiquiri.core.adapter import DatabaseAdapter
     from daiquiri.query.models import QueryJob
+    from daiquiri.query.monitor import QueryMonitor
     from daiquiri.query.utils import get_quota, get_job_sources, get_job_columns, ingest_uploads
     from daiquiri.stats.models import Record
 
@@ -74,19 +82,40 @@ def run_query(job_id):
 
         # set database and start time
         job.pid = adapter.fetch_pid()
-        job.actual_query = adapter.build_query(job.schema_name, job.table_name, job.native_query, job.timeout, job.max_records)
+
+        # copy the table of a recent identical query instead of running the query again
+        cached_job = QueryJob.objects.get_cached_result(job)
+        if cached_job:
+            logger.info('job %s reuses the result of job %s' % (job.id, cached_job.id))
+            job.actual_query = adapter.build_copy_query(job.schema_name, job.table_name, cached_job.schema_name, cached_job.table_name, job.timeout)
+        else:
+            job.actual_query = adapter.build_query(job.schema_name, job.table_name, job.native_query, job.timeout, job.max_records)
         job.phase = job.PHASE_EXECUTING
         job.start_time = now()
         job.save()
 
         logger.info('job %s started' % job.id)
 
+        # report the progress and cancel the query when the job is aborted, from a separate thread
+        monitor = QueryMonitor(job, settings.QUERY_PROGRESS_INTERVAL) if settings.ASYNC else None
+        if monitor:
+            monitor.start()
+
         # get the actual query and submit the job to the database
         try:
             ingest_uploads(job.uploads, job.owner)
 
             # this is where the work ist done (and the time is spend)
-            adapter.submit_query(job.actual_query)
+            try:
+                adapter.submit_query(job.actual_query)
+            except ProgrammingError as e:
+                if not cached_job:
+                    raise
+
+                # the table of the cached job was dropped in the meantime, run the query instead
+                logger.info('job %s could not copy the result of job %s (%s)' % (job.id, cached_job.id, e))
+                job.actual_query = adapter.build_query(job.schema_name, job.table_name, job.native_query, job.timeout, job.max_records)
+                adapter.submit_query(job.actual_query)
 
         except (ProgrammingError, InternalError, ValueError) as e:
             job.phase = job.PHASE_ERROR
@@ -97,7 +126,7 @@ def run_query(job_id):
             # load the job again and check if the job was killed
             job = QueryJob.objects.get(pk=job_id)
 
-            if job.phase != job.PHASE_ABORTED:
+            if job.phase not in [job.PHASE_ABORTED, job.PHASE_ARCHIVED]:
                 job.phase = job.PHASE_ERROR
                 job.error_summary = str(e)
                 logger.info('job %s failed (%s)' % (job.id, job.error_summary))
@@ -108,6 +137,18 @@ def run_query(job_id):
             logger.info('job %s completed' % job.id)
 
         finally:
+            if monitor:
+                monitor.stop()
+
+            # the job might have been aborted or archived while the query was running,
+            # archive() might then have dropped the table before the query created it
+            current_phase = QueryJob.objects.values_list('phase', flat=True).get(pk=job_id)
+            if current_phase in [job.PHASE_ABORTED, job.PHASE_ARCHIVED]:
+                job.phase = current_phase
+
+                if current_phase == job.PHASE_ARCHIVED:
+                    drop_table(job.schema_name, job.table_name)
+
             # get timing and save the job object
             job.end_time = now()
 
@@ -122,7 +163,7 @@ def run_query(job_id):
                 # fetch the metadata for the columns and fetch additional metadata from the metadata store
                 job.metadata['columns'] = get_job_columns(job)
 
-            # remove unneeded metadata
+            # remove unneeded metadata, the tables of a reusable result are kept in job.source_tables
             job.metadata.pop('display_columns', None)
             job.metadata.pop('tables', None)
 
@@ -143,6 +184,9 @@ def run_query(job_id):
 
             job.save()
 
+            # log the statistics for the persistent connections of this worker
+            logger.debug('connections = %s', adapter.fetch_connection_stats())
+
     return job.phase
 
 
@@ -202,7 +246,7 @@ def run_ingest(job_id, file_path):
             # load the job again and check if the job was killed
             job = QueryJob.objects.get(pk=job_id)
 
-            if job.phase != job.PHASE_ABORTED:
+            if job.phase not in [job.PHASE_ABORTED, job.PHASE_ARCHIVED]:
                 job.phase = job.PHASE_ERROR
                 job.error_summary = str(e)
                 logger.info('job %s failed (%s)' % (job.id, job.error_summary))
@@ -213,6 +257,15 @@ def run_ingest(job_id, file_path):
             logger.info('job %s completed' % job.id)
 
         finally:
+            # the job might have been aborted or archived while the query was running,
+            # archive() might then have dropped the table before the query created it
+            current_phase = QueryJob.objects.values_list('phase', flat=True).get(pk=job_id)
+            if current_phase in [job.PHASE_ABORTED, job.PHASE_ARCHIVED]:
+                job.phase = current_phase
+
+                if current_phase == job.PHASE_ARCHIVED:
+                    drop_table(job.schema_name, job.table_name)
+
             # get timing and save the job object
             job.end_time = now()
 
@@ -246,7 +299,9 @@ def run_ingest(job_id, file_path):
 @shared_task(base=Task)
 def create_download_file(download_id):
     # always import daiquiri packages inside the task
+    from daiquiri.core.adapter import DownloadAdapter
     from daiquiri.query.models import DownloadJob
+    from daiquiri.query.utils import get_format_config
 
     # get logger
     logger = logging.getLogger(__name__)
@@ -264,34 +319,113 @@ def create_download_file(download_id):
         except OSError:
             pass
 
+        # split the table into parts, unless the parts of a previous run can be resumed
+        if not download_job.parts:
+            format_config = get_format_config(download_job.format_key)
+            download_job.parts = DownloadAdapter().get_parts(
+                format_config.get('format', download_job.format_key),
+                download_job.job.schema_name,
+                download_job.job.table_name,
+                download_job.job.nrows,
+                settings.QUERY_DOWNLOAD_PART_ROWS
+            )
+
+        # parts which were not finished or which files were lost are created again
+        for index, part in enumerate(download_job.parts):
+            if not (part.get('done') and os.path.isfile(download_job.get_part_path(index))):
+                part.update({'done': False, 'rows': 0, 'bytes': 0})
+
+        download_job.rows_written = sum([part['rows'] for part in download_job.parts])
+        download_job.bytes_written = sum([part['bytes'] for part in download_job.parts])
         download_job.phase = download_job.PHASE_EXECUTING
         download_job.start_time = now()
         download_job.save()
 
-        # write file using the generator in the adapter
-        if download_job.format_key == 'fits':
-            write_label = 'wb'
-        else:
-            write_label = 'w'
-        try:
+        # create the parts in parallel, the last finished part concatenates the file
+        indexes = [index for index, part in enumerate(download_job.parts) if not part['done']]
 
-            with open(download_job.file_path, write_label) as f:
-                for line in download_job.job.stream(download_job.format_key):
-                    f.write(line)
+        for index in indexes:
+            if not settings.ASYNC:
+                create_download_part.apply((download_id, index), throw=True)
+            else:
+                create_download_part.apply_async((download_id, index), queue='download')
 
-        except Exception as e:
-            download_job.phase = download_job.PHASE_ERROR
-            download_job.error_summary = str(e)
-            download_job.save()
-            logger.info('download_job %s failed (%s)' % (download_job.id, download_job.error_summary))
+        if not indexes:
+            create_download_part.apply((download_id, None), throw=True)
+
+
+@shared_task(track_started=True, base=Task)
+def create_download_part(download_id, index):
+    # always import daiquiri packages inside the task
+    from daiquiri.core.adapter import DownloadAdapter
+    from daiquiri.core.utils import human2bytes
+    from daiquiri.query.models import DownloadJob
+
+    # get logger
+    logger = logging.getLogger(__name__)
+
+    # get the job object from the database
+    download_job = DownloadJob.objects.get(pk=download_id)
+
+    if download_job.phase != download_job.PHASE_EXECUTING:
+        return
+
+    try:
+        if index is not None and not download_job.parts[index]['done']:
+            logger.info('download_job %s part %d started' % (download_job.id, index))
+
+            # write the part into a temporary file using the generator in the adapter,
+            # which yields str or bytes chunks, and report the progress from time to time
+            download_adapter = DownloadAdapter()
+            part_path = download_job.get_part_path(index)
+            tmp_path = '%s.%s.tmp' % (part_path, uuid.uuid4().hex)
+
+            bytes_written = 0
+            bytes_reported = 0
+            try:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in download_job.job.stream(download_job.format_key, part=download_job.parts[index],
+                                                         download_adapter=download_adapter):
+                        data = chunk.encode() if isinstance(chunk, str) else chunk
+                        f.write(data)
+                        bytes_written += len(data)
+
+                        if bytes_written - bytes_reported >= settings.QUERY_DOWNLOAD_PROGRESS_BYTES:
+                            download_job.update_part(index, rows=download_adapter.rows_written, bytes=bytes_written)
+                            bytes_reported = bytes_written
+
+                os.replace(tmp_path, part_path)
+
+            finally:
+                if os.path.isfile(tmp_path):
+                    os.remove(tmp_path)
+
+            download_job = download_job.update_part(index, rows=download_adapter.rows_written, bytes=bytes_written, done=True)
+            logger.info('download_job %s part %d completed' % (download_job.id, index))
+
+        # concatenate the parts when all of them are done, this happens only in the task
+        # which finishes the last part, since update_part locks the row
+        if all([part['done'] for part in download_job.parts]):
+            download_job.concatenate_parts()
 
-            raise e
-        else:
             download_job.phase = download_job.PHASE_COMPLETED
-            logger.info('download_job %s completed' % download_job.file_path)
-        finally:
             download_job.end_time = now()
-            download_job.save()
+            download_job.save(update_fields=['phase', 'end_time'])
+            logger.info('download_job %s completed' % download_job.file_path)
+
+            # remove least recently used files if the download directory exceeds its size
+            if settings.QUERY_DOWNLOAD_CACHE_SIZE:
+                DownloadJob.objects.evict(human2bytes(settings.QUERY_DOWNLOAD_CACHE_SIZE), keep=download_job.pk)
+
+    except Exception as e:
+        DownloadJob.objects.filter(pk=download_id).update(
+            phase=DownloadJob.PHASE_ERROR,
+            error_summary=str(e),
+            end_time=now()
+        )
+        logger.info('download_job %s failed (%s)' % (download_id, e))
+
+        raise e
 
 
 @shared_task(track_started=True, base=Task)
@@ -319,11 +453,28 @@ def create_archive_file(archive_id):
         archive_job.start_time = now()
         archive_job.save()
 
-        # create a zipfile with all files
-        with zipfile.ZipFile(archive_job.file_path, 'w') as z:
-            os.chdir(settings.FILES_BASE_PATH)
-            for file_path in archive_job.files:
-                z.write(file_path)
+        # write the zip file into a temporary file first, so that the file appears only when it is complete
+        tmp_path = '%s.%s.tmp' % (archive_job.file_path, uuid.uuid4().hex)
+
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in archive_job.stream():
+                    f.write(chunk)
+
+            os.replace(tmp_path, archive_job.file_path)
+
+        except Exception as e:
+            archive_job.phase = archive_job.PHASE_ERROR
+            archive_job.error_summary = str(e)
+            archive_job.end_time = now()
+            archive_job.save()
+            logger.info('create_archive_zip_file %s failed (%s)' % (archive_job.id, archive_job.error_summary))
+
+            raise e
+
+        finally:
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
 
         archive_job.end_time = now()
         archive_job.phase = archive_job.PHASE_COMPLETED
@@ -0,0 +1,98 @@
+import os
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from daiquiri.core.generators import generate_votable
+
+from ..models import DownloadJob, QueryJob
+
+FIELDS = [
+    {'name': 'id', 'datatype': 'long'},
+    {'name': 'name', 'datatype': 'char'}
+]
+
+ROWS = [[i, 'star %d' % i] for i in range(10)]
+
+
+class DownloadJobTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+    )
+
+    def create_download_job(self, format_key, bytes_written, age):
+        job = QueryJob.objects.create(
+            job_type=QueryJob.JOB_TYPE_ASYNC,
+            owner=User.objects.get(username='user'),
+            schema_name='daiquiri_user_user',
+            table_name='test',
+            query_language='adql-2.0',
+            query='SELECT 1'
+        )
+        download_job = DownloadJob.objects.create(
+            job_type=DownloadJob.JOB_TYPE_INTERFACE,
+            owner=job.owner,
+            job=job,
+            format_key=format_key,
+            fingerprint=format_key,
+            bytes_written=bytes_written
+        )
+        DownloadJob.objects.filter(pk=download_job.pk).update(
+            phase=DownloadJob.PHASE_COMPLETED,
+            end_time=now() - timedelta(hours=age)
+        )
+        return download_job
+
+    def test_evict(self):
+        # the csv file is the least recently used one, but it is kept
+        csv_job = self.create_download_job('csv', 400, 3)
+        votable_job = self.create_download_job('votable', 400, 2)
+        fits_job = self.create_download_job('fits', 400, 1)
+        DownloadJob.objects.filter(pk=fits_job.pk).update(access_time=now() - timedelta(hours=4))
+
+        DownloadJob.objects.evict(800, keep=csv_job.pk)
+
+        phases = dict(DownloadJob.objects.values_list('format_key', 'phase'))
+        self.assertEqual(phases, {
+            'csv': DownloadJob.PHASE_COMPLETED,
+            'votable': DownloadJob.PHASE_COMPLETED,
+            'fits': DownloadJob.PHASE_ARCHIVED
+        })
+
+        # nothing is removed, if the files fit into the cache
+        DownloadJob.objects.evict(800)
+        self.assertEqual(DownloadJob.objects.filter(phase=DownloadJob.PHASE_COMPLETED).count(), 2)
+
+        DownloadJob.objects.evict(500)
+        self.assertEqual(DownloadJob.objects.get(pk=votable_job.pk).phase, DownloadJob.PHASE_COMPLETED)
+        self.assertEqual(DownloadJob.objects.get(pk=csv_job.pk).phase, DownloadJob.PHASE_ARCHIVED)
+
+    def test_concatenate_parts(self):
+        with tempfile.TemporaryDirectory() as download_dir, override_settings(QUERY_DOWNLOAD_DIR=download_dir):
+            download_job = DownloadJob(format_key='votable', fingerprint='test', parts=[
+                {'range': [0, 4], 'first': True, 'last': False},
+                {'range': [4, 8], 'first': False, 'last': False},
+                {'range': [8, None], 'first': False, 'last': True}
+            ])
+            os.mkdir(os.path.dirname(download_job.file_path))
+
+            # create the parts like create_download_part, without the header and footer in between
+            for index, part in enumerate(download_job.parts):
+                start, end = part['range']
+                with open(download_job.get_part_path(index), 'w') as f:
+                    f.write(''.join(generate_votable(iter(ROWS[start:end]), FIELDS,
+                                                     header=part['first'], footer=part['last'])))
+
+            download_job.concatenate_parts()
+
+            with open(download_job.file_path) as f:
+                self.assertEqual(f.read(), ''.join(generate_votable(iter(ROWS), FIELDS)))
+
+            # the parts are removed
+            self.assertEqual(os.listdir(os.path.dirname(download_job.file_path)), ['test.xml'])
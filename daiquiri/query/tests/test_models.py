@@ -0,0 +1,230 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db.utils import ProgrammingError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+
+from ..models import QueryJob
+from ..monitor import QueryMonitor
+from ..process import CompiledQuery
+from ..tasks import run_query
+
+QUERY_ESTIMATE_ROUTES = [
+    {'rows': 1e3, 'cost': 1e4, 'queue': 'query_small', 'priority': 9},
+    {'cost': 1e8, 'queue': 'query', 'priority': 5}
+]
+
+
+class QueryJobTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+    )
+
+    def create_job(self, phase):
+        job = QueryJob.objects.create(
+            job_type=QueryJob.JOB_TYPE_ASYNC,
+            owner=User.objects.get(username='user'),
+            schema_name='daiquiri_user_user',
+            table_name='test',
+            queue='default',
+            query_language='adql-2.0',
+            query='SELECT 1',
+            native_query='SELECT 1',
+            metadata={},
+            pid=42
+        )
+        QueryJob.objects.filter(pk=job.pk).update(phase=phase)
+        return QueryJob.objects.get(pk=job.pk)
+
+    @override_settings(QUERY_ESTIMATE_ROUTES=QUERY_ESTIMATE_ROUTES)
+    def test_get_route(self):
+        job = self.create_job(QueryJob.PHASE_PENDING)
+        priority = job.priority
+
+        for estimate, route in [
+            ({'rows': 1e3, 'cost': 1e4}, ('query_small', 9)),  # the thresholds are inclusive
+            ({'rows': 1e3 + 1, 'cost': 1e4}, ('query', 5)),     # every value needs to fit
+            ({'rows': 1e9, 'cost': 1e8}, ('query', 5)),         # keys missing in the route are ignored
+            ({'rows': 1e3, 'cost': None}, ('query', priority)),        # missing estimates never fit
+            ({'rows': 1e9, 'cost': 1e9}, ('query', priority)),         # no route fits, the default is used
+            (None, ('query', priority))                                # no estimate at all
+        ]:
+            job.metadata = {'estimate': estimate}
+            self.assertEqual(job.get_route(), route, estimate)
+
+    @mock.patch('daiquiri.query.models.process_estimate')
+    @mock.patch('daiquiri.query.models.check_permissions', mock.Mock(return_value=[]))
+    @mock.patch('daiquiri.query.models.compile_query', mock.Mock(return_value=CompiledQuery(
+        'SELECT 1', 'SELECT 1;', [], [], [], [], []
+    )))
+    def test_process_sync(self, process_estimate):
+        job = QueryJob(
+            job_type=QueryJob.JOB_TYPE_SYNC,
+            owner=User.objects.get(username='user'),
+            query_language='adql-2.0',
+            query='SELECT 1'
+        )
+        job.process(check_limits=False)
+
+        # sync queries are not estimated
+        self.assertNotIn('estimate', job.metadata)
+        process_estimate.assert_not_called()
+
+    @override_settings(ASYNC=True)
+    @mock.patch('daiquiri.query.models.Control')
+    @mock.patch('daiquiri.query.models.abort_query')
+    def test_abort_executing(self, abort_query, control):
+        job = self.create_job(QueryJob.PHASE_EXECUTING)
+        job.abort()
+
+        # the query is cancelled by a task, even if the monitor of the job would notice it as well
+        control.return_value.revoke.assert_called_once_with(str(job.id))
+        abort_query.apply_async.assert_called_once_with((42, ))
+        self.assertEqual(QueryJob.objects.get(pk=job.pk).phase, QueryJob.PHASE_ABORTED)
+
+    @override_settings(ASYNC=True)
+    @mock.patch('daiquiri.query.models.Control')
+    @mock.patch('daiquiri.query.models.abort_query')
+    @mock.patch('daiquiri.query.models.drop_table')
+    def test_archive_executing(self, drop_table, abort_query, control):
+        job = self.create_job(QueryJob.PHASE_EXECUTING)
+        job.archive()
+
+        abort_query.apply_async.assert_called_once_with((42, ))
+        drop_table.apply_async.assert_called_once_with(('daiquiri_user_user', 'test'))
+        self.assertEqual(QueryJob.objects.get(pk=job.pk).phase, QueryJob.PHASE_ARCHIVED)
+
+    @override_settings(ASYNC=False)
+    @mock.patch('daiquiri.core.adapter.DatabaseAdapter')
+    def test_run_query_archived(self, adapter):
+        job = self.create_job(QueryJob.PHASE_QUEUED)
+
+        # the job is archived while the query is running, and the query finishes anyway
+        def submit_query(actual_query):
+            QueryJob.objects.filter(pk=job.pk).update(phase=QueryJob.PHASE_ARCHIVED)
+
+        adapter.return_value.fetch_pid.return_value = 42
+        adapter.return_value.build_query.return_value = 'CREATE TABLE ...'
+        adapter.return_value.submit_query.side_effect = submit_query
+
+        self.assertEqual(run_query(str(job.id)), QueryJob.PHASE_ARCHIVED)
+
+        # the table, which was created after archive() dropped it, is dropped again
+        adapter.return_value.drop_table.assert_called_once_with('daiquiri_user_user', 'test')
+        adapter.return_value.count_rows.assert_not_called()
+        self.assertEqual(QueryJob.objects.get(pk=job.pk).phase, QueryJob.PHASE_ARCHIVED)
+
+
+class QueryMonitorTestCase(SimpleTestCase):
+
+    @mock.patch('daiquiri.query.monitor.connections', mock.Mock())
+    @mock.patch('daiquiri.query.monitor.DatabaseAdapter')
+    def test_run(self, adapter):
+        adapter.return_value.fetch_progress.return_value = {'state': 'active'}
+
+        job = mock.Mock(pid=42, start_time=now(), metadata={'estimate': {'rows': 1000, 'cost': 1e4}})
+        job.update_progress.return_value = mock.Mock(phase=QueryJob.PHASE_ABORTED, PHASE_EXECUTING=QueryJob.PHASE_EXECUTING)
+
+        QueryMonitor(job, 0).run()
+
+        # the rows of CREATE TABLE AS are not reported by the database, the estimate is used instead
+        progress = job.update_progress.call_args.args[0]
+        self.assertEqual(progress['state'], 'active')
+        self.assertEqual(progress['estimated_rows'], 1000)
+        adapter.return_value.abort_query.assert_called_once_with(42)
+
+
+@override_settings(QUERY_RESULT_CACHE=True)
+class QueryResultCacheTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+    )
+
+    def create_job(self, username, phase, tables, fingerprint='fingerprint'):
+        job = QueryJob.objects.create(
+            job_type=QueryJob.JOB_TYPE_ASYNC,
+            owner=User.objects.get(username=username),
+            schema_name='daiquiri_user_' + username,
+            table_name='test',
+            queue='default',
+            query_language='adql-2.0',
+            query='SELECT 1',
+            native_query='SELECT 1',
+            metadata={'tables': tables},
+            result_fingerprint=fingerprint
+        )
+        QueryJob.objects.filter(pk=job.pk).update(phase=phase, end_time=now())
+        return QueryJob.objects.get(pk=job.pk)
+
+    def test_get_cached_result(self):
+        cached_job = self.create_job('user', QueryJob.PHASE_COMPLETED, [])
+        QueryJob.objects.filter(pk=cached_job.pk).update(end_time=now() - timedelta(minutes=1))
+
+        # the result is reused only for the same owner
+        self.assertEqual(QueryJob.objects.get_cached_result(self.create_job('user', QueryJob.PHASE_QUEUED, [])), cached_job)
+        self.assertIsNone(QueryJob.objects.get_cached_result(self.create_job('admin', QueryJob.PHASE_QUEUED, [])))
+        self.assertIsNone(QueryJob.objects.get_cached_result(self.create_job('user', QueryJob.PHASE_QUEUED, [], 'other')))
+
+    def test_invalidate_results(self):
+        stars_job = self.create_job('user', QueryJob.PHASE_COMPLETED, [['daiquiri_data_obs', 'stars']])
+        stars2_job = self.create_job('user', QueryJob.PHASE_COMPLETED, [['daiquiri_data_obs', 'stars2']])
+        sim_job = self.create_job('user', QueryJob.PHASE_COMPLETED, [['daiquiri_data_sim', 'stars']])
+
+        # only the job using the table is invalidated, not the ones with a similar name
+        self.assertEqual(QueryJob.objects.invalidate_results('daiquiri_data_obs', 'stars'), 1)
+        self.assertEqual(QueryJob.objects.get(pk=stars_job.pk).result_fingerprint, '')
+        self.assertEqual(QueryJob.objects.get(pk=stars2_job.pk).result_fingerprint, 'fingerprint')
+
+        # all the jobs using the schema are invalidated
+        self.assertEqual(QueryJob.objects.invalidate_results('daiquiri_data_obs'), 1)
+        self.assertEqual(QueryJob.objects.get(pk=stars2_job.pk).result_fingerprint, '')
+        self.assertEqual(QueryJob.objects.get(pk=sim_job.pk).result_fingerprint, 'fingerprint')
+
+        # a job which uses several tables of the schema is counted once
+        join_job = self.create_job('user', QueryJob.PHASE_COMPLETED, [['daiquiri_data_sim', 'stars'], ['daiquiri_data_sim', 'particles']])
+        self.assertEqual(QueryJob.objects.invalidate_results('daiquiri_data_sim'), 2)
+        self.assertEqual(QueryJob.objects.get(pk=join_job.pk).result_fingerprint, '')
+
+    @override_settings(ASYNC=False)
+    @mock.patch('daiquiri.query.utils.get_job_sources', mock.Mock(return_value=[]))
+    @mock.patch('daiquiri.query.utils.get_job_columns', mock.Mock(return_value=[]))
+    @mock.patch('daiquiri.core.adapter.DatabaseAdapter')
+    def test_run_query_cached(self, adapter):
+        cached_job = self.create_job('user', QueryJob.PHASE_COMPLETED, [['daiquiri_data_obs', 'stars']])
+        job = self.create_job('user', QueryJob.PHASE_QUEUED, [['daiquiri_data_obs', 'stars']])
+
+        adapter.return_value.fetch_pid.return_value = 42
+        adapter.return_value.count_rows.return_value = 10
+        adapter.return_value.fetch_size.return_value = 100
+        adapter.return_value.build_copy_query.return_value = 'COPY'
+        adapter.return_value.build_query.return_value = 'QUERY'
+
+        # the cached job is archived after it was picked, the copy fails and the query is run instead
+        def submit_query(actual_query):
+            if actual_query == 'COPY':
+                raise ProgrammingError('relation does not exist')
+
+        adapter.return_value.submit_query.side_effect = submit_query
+
+        self.assertEqual(run_query(str(job.id)), QueryJob.PHASE_COMPLETED)
+
+        adapter.return_value.build_copy_query.assert_called_once_with(
+            'daiquiri_user_user', 'test', cached_job.schema_name, cached_job.table_name, job.timeout
+        )
+        self.assertEqual([call.args[0] for call in adapter.return_value.submit_query.call_args_list], ['COPY', 'QUERY'])
+
+        job = QueryJob.objects.get(pk=job.pk)
+        self.assertEqual(job.actual_query, 'QUERY')
+        self.assertEqual(job.nrows, 10)
+
+        # the tables are stored, so that the result can be invalidated later
+        self.assertNotIn('tables', job.metadata)
+        self.assertEqual(list(job.source_tables.values_list('schema_name', 'table_name')), [('daiquiri_data_obs', 'stars')])
@@ -1,5 +1,5 @@
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from daiquiri.query.process import check_permissions
 
@@ -33,6 +33,7 @@ class QueryPermissionsTestCase(TestCase):
 
         self.assertEqual(result, [])
 
+    @override_settings(METADATA_COLUMN_PERMISSIONS=True)
     def test_columns_not_found(self):
         user = User.objects.get(username='admin')
         keywords = []
@@ -47,6 +48,21 @@ class QueryPermissionsTestCase(TestCase):
 
         self.assertEqual(result, ['Column not_found not found.'])
 
+    def test_columns_without_column_permissions(self):
+        user = User.objects.get(username='admin')
+        keywords = []
+        tables = [('daiquiri_data_obs', 'stars')]
+        columns = [
+            ('daiquiri_data_obs', 'stars', 'ra'),
+            ('daiquiri_data_obs', 'stars', 'not_found')
+        ]
+        functions = []
+
+        # only the table is checked, a missing column is reported by the database
+        result = check_permissions(user, keywords, tables, columns, functions)
+
+        self.assertEqual(result, [])
+
     def test_alias(self):
         user = User.objects.get(username='admin')
         keywords = []
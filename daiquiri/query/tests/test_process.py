@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rest_framework.exceptions import ValidationError
+
+from daiquiri.core.constants import ACCESS_LEVEL_PRIVATE, ACCESS_LEVEL_PUBLIC
+from daiquiri.metadata.models import Schema, Table
+from daiquiri.metadata.utils import permission_snapshots
+
+from ..process import (check_permissions, compile_query, compiled_queries,
+                       get_compiled_query_key, process_estimate)
+
+
+class ProcessEstimateTestCase(SimpleTestCase):
+
+    @mock.patch('daiquiri.query.process.DatabaseAdapter')
+    def test_process_estimate_disabled(self, adapter):
+        self.assertIsNone(process_estimate('SELECT 1'))
+        adapter.return_value.fetch_estimate.assert_not_called()
+
+    @override_settings(QUERY_ESTIMATE_LIMITS={'rows': 1e6, 'cost': 1e8})
+    @mock.patch('daiquiri.query.process.DatabaseAdapter')
+    def test_process_estimate(self, adapter):
+        adapter.return_value.fetch_estimate.return_value = {'rows': 1e6, 'cost': 1e7}
+        self.assertEqual(process_estimate('SELECT 1'), {'rows': 1e6, 'cost': 1e7})
+
+        # the limit itself is still allowed, a missing value is not checked
+        adapter.return_value.fetch_estimate.return_value = {'rows': None, 'cost': 1e8}
+        self.assertEqual(process_estimate('SELECT 1'), {'rows': None, 'cost': 1e8})
+
+        # no estimate, e.g. for uploaded tables
+        adapter.return_value.fetch_estimate.return_value = None
+        self.assertIsNone(process_estimate('SELECT 1'))
+
+    @override_settings(QUERY_ESTIMATE_LIMITS={'rows': 1e6, 'cost': 1e8})
+    @mock.patch('daiquiri.query.process.DatabaseAdapter')
+    def test_process_estimate_rejected(self, adapter):
+        adapter.return_value.fetch_estimate.return_value = {'rows': 1e6 + 1, 'cost': 1e7}
+
+        with self.assertRaises(ValidationError) as cm:
+            process_estimate('SELECT 1')
+
+        self.assertIn('rows', str(cm.exception.detail['query'][0]))
+
+
+class CompileQueryTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+        'metadata.json'
+    )
+
+    def setUp(self):
+        compiled_queries.clear()
+        permission_snapshots.clear()
+
+        self.table = Table.objects.first()
+        Schema.objects.filter(pk=self.table.schema.pk).update(access_level=ACCESS_LEVEL_PUBLIC)
+        Table.objects.filter(pk=self.table.pk).update(access_level=ACCESS_LEVEL_PUBLIC)
+        self.tables = [[self.table.schema.name, self.table.name]]
+
+    @mock.patch('daiquiri.query.process.translate_query', mock.Mock(return_value='SELECT 1'))
+    @mock.patch('daiquiri.query.process.process_query')
+    def test_compile_query(self, process_query):
+        process_query.return_value = mock.Mock(query='SELECT 1', keywords=[], tables=self.tables,
+                                               columns=[], functions=[], display_columns=[])
+
+        # identical queries are only compiled once, regardless of whitespace
+        key = get_compiled_query_key('adql-2.0', 'SELECT 1')
+        compiled_query = compile_query('adql-2.0', 'SELECT 1')
+        self.assertIs(compile_query('adql-2.0', '  SELECT   1;'), compiled_query)
+        self.assertEqual(process_query.call_count, 1)
+
+        self.assertEqual(check_permissions(AnonymousUser(), [], compiled_query.tables, [], []), [])
+
+        # the table is made private, this changes the metadata version and the key
+        self.table.access_level = ACCESS_LEVEL_PRIVATE
+        self.table.save()
+        self.assertNotEqual(get_compiled_query_key('adql-2.0', 'SELECT 1'), key)
+
+        # the query is compiled again, and the permissions are checked with the new metadata
+        compiled_query = compile_query('adql-2.0', 'SELECT 1')
+        self.assertEqual(process_query.call_count, 2)
+        self.assertEqual(check_permissions(AnonymousUser(), [], compiled_query.tables, [], []),
+                         ['Table %s not found.' % self.table.name])
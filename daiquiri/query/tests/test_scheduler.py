@@ -0,0 +1,92 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from ..models import QueryJob
+from ..scheduler import FairShareScheduler
+
+QUERY_QUEUES = [
+    {
+        'key': 'default',
+        'label': 'Default',
+        'timeout': 10,
+        'priority': 1,
+        'access_level': 'PUBLIC',
+        'groups': [],
+        'concurrency': 2
+    }
+]
+
+
+@override_settings(ASYNC=True, QUERY_FAIR_SHARE=True, QUERY_QUEUES=QUERY_QUEUES)
+class FairShareSchedulerTestCase(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+    )
+
+    def create_job(self, username):
+        job = QueryJob.objects.create(
+            job_type=QueryJob.JOB_TYPE_ASYNC,
+            owner=User.objects.get(username=username),
+            schema_name='daiquiri_user_' + username,
+            table_name='test',
+            queue='default',
+            query_language='adql-2.0',
+            query='SELECT 1'
+        )
+        QueryJob.objects.filter(pk=job.pk).update(phase=QueryJob.PHASE_QUEUED)
+        return job
+
+    def test_dispatch(self):
+        # the user submits three jobs before the admin submits one
+        user_jobs = [self.create_job('user') for i in range(3)]
+        admin_job = self.create_job('admin')
+
+        sent = []
+        FairShareScheduler(send=sent.append).dispatch()
+
+        # the admin job overtakes the later user jobs, the concurrency limits the rest
+        self.assertEqual([job.id for job in sent], [user_jobs[0].id, admin_job.id])
+
+        # the queue is full, nothing is dispatched
+        self.assertEqual(FairShareScheduler(send=sent.append).dispatch(), [])
+
+        # a job finishes, the next user job is dispatched
+        QueryJob.objects.filter(pk=admin_job.pk).update(phase=QueryJob.PHASE_COMPLETED)
+        FairShareScheduler(send=sent.append).dispatch()
+        self.assertEqual(sent[-1].id, user_jobs[1].id)
+
+    def test_get_stats(self):
+        self.create_job('user')
+
+        stats = FairShareScheduler().get_stats()
+
+        self.assertEqual(stats['queues']['default']['waiting'], 1)
+        self.assertEqual(stats['owners']['user']['waiting'], 1)
+
+    @mock.patch('daiquiri.query.models.Control', mock.Mock())
+    @mock.patch('daiquiri.query.scheduler.FairShareScheduler.send_job')
+    def test_dispatch_abort(self, send_job):
+        # the user jobs fill the queue, the admin job waits
+        user_jobs = [self.create_job('user') for i in range(2)]
+        FairShareScheduler(send=lambda job: None).dispatch()
+        admin_job = self.create_job('admin')
+
+        # the dispatched user job is revoked before it started, the admin job is released
+        QueryJob.objects.get(pk=user_jobs[0].pk).abort()
+        self.assertEqual([call.args[0].id for call in send_job.call_args_list], [admin_job.id])
+
+    @mock.patch('daiquiri.query.models.Control', mock.Mock())
+    @mock.patch('daiquiri.query.models.drop_table', mock.Mock())
+    @mock.patch('daiquiri.query.scheduler.FairShareScheduler.send_job')
+    def test_dispatch_archive(self, send_job):
+        user_jobs = [self.create_job('user') for i in range(2)]
+        FairShareScheduler(send=lambda job: None).dispatch()
+        admin_job = self.create_job('admin')
+
+        QueryJob.objects.get(pk=user_jobs[1].pk).archive()
+        self.assertEqual([call.args[0].id for call in send_job.call_args_list], [admin_job.id])
@@ -0,0 +1,33 @@
+from unittest import mock
+
+import requests
+
+from django.test import SimpleTestCase, override_settings
+
+from ..utils import ingest_url
+
+
+@override_settings(QUERY_UPLOAD_TIMEOUT=(1, 2))
+class IngestUrlTestCase(SimpleTestCase):
+
+    @mock.patch('daiquiri.query.utils.ingest_stream')
+    @mock.patch('daiquiri.query.utils.requests.get')
+    def test_ingest_url(self, get, ingest_stream):
+        ingest_url('daiquiri_user_user', 'upload', 'https://example.com/table.xml')
+
+        get.assert_called_once_with('https://example.com/table.xml', allow_redirects=True, stream=True, timeout=(1, 2))
+        ingest_stream.assert_called_once()
+
+    @mock.patch('daiquiri.query.utils.ingest_stream')
+    @mock.patch('daiquiri.query.utils.requests.get')
+    def test_ingest_url_error(self, get, ingest_stream):
+        # a failed download is a ValueError, so that run_query marks the job as failed
+        get.return_value.__enter__.return_value.raise_for_status.side_effect = requests.HTTPError('404 Client Error')
+        with self.assertRaisesRegex(ValueError, 'could not be downloaded'):
+            ingest_url('daiquiri_user_user', 'upload', 'https://example.com/table.xml')
+
+        get.side_effect = requests.ConnectTimeout('timed out')
+        with self.assertRaisesRegex(ValueError, 'could not be downloaded'):
+            ingest_url('daiquiri_user_user', 'upload', 'https://example.com/table.xml')
+
+        ingest_stream.assert_not_called()
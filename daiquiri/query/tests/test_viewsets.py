@@ -1,9 +1,10 @@
-import os
+import uuid
 from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import User, AnonymousUser
 from django.test import TestCase
+from django.urls import reverse
 
 from test_generator.viewsets import (
     TestModelViewsetMixin,
@@ -162,13 +163,9 @@ class JobTests(TestViewsetMixin, QueryViewsetTestCase):
 
     def assert_create_download_viewset(self, key, instance, username):
 
-        for format_key in ('csv', 'votable'):
-            file_name = self.get_download_file_name(instance, format_key)
-
-            try:
-                os.remove(os.path.join(settings.QUERY_DOWNLOAD_DIR, file_name))
-            except OSError:
-                pass
+        for format_key in ('csv', 'votable', 'votable-binary2', 'csv-gz'):
+            for download_job in instance.downloads.filter(format_key=format_key):
+                download_job.delete_file()
 
             # file is not existing yet
             self.assert_viewset(key, 'post', 'create-download', username, data={
@@ -196,13 +193,9 @@ class JobTests(TestViewsetMixin, QueryViewsetTestCase):
 
     def assert_stream_viewset(self, key, instance, username):
 
-        for format_key in ('csv', 'votable'):
-            file_name = self.get_download_file_name(instance, format_key)
-
-            try:
-                os.remove(os.path.join(settings.QUERY_DOWNLOAD_DIR, file_name))
-            except OSError:
-                pass
+        for format_key in ('csv', 'votable', 'votable-binary2', 'csv-gz'):
+            for download_job in instance.downloads.filter(format_key=format_key):
+                download_job.delete_file()
 
             # file is not existing yet
             self.assert_viewset(key, 'get', 'stream', username, kwargs={
@@ -216,17 +209,6 @@ class JobTests(TestViewsetMixin, QueryViewsetTestCase):
                 'format_key': format_key
             })
 
-    def get_download_file_name(self, instance, format_key):
-        file_name = '%(username)s/%(table_name)s' % {
-            'username': instance.owner.username,
-            'table_name': instance.table_name
-        }
-
-        if format_key == 'csv':
-            return file_name + '.csv'
-        elif format_key == 'votable':
-            return file_name + '.xml'
-
 # class UserRowTests(TestViewsetMixin, ServeTestCase):
 
 #     url_names = {
@@ -315,3 +297,117 @@ class ExampleTests(TestModelViewsetMixin, ExampleViewsetTestCase):
 
     def _test_user_viewset(self, username):
         self.assert_viewset('user_viewset', 'get', 'user', username)
+
+
+@mock.patch(settings.ADAPTER_DATABASE + '.submit_query', mock.Mock())
+@mock.patch(settings.ADAPTER_DATABASE + '.fetch_nrows', mock.Mock(return_value=100))
+@mock.patch(settings.ADAPTER_DATABASE + '.fetch_size', mock.Mock(return_value=100))
+@mock.patch(settings.ADAPTER_DATABASE + '.count_rows', mock.Mock(return_value=100))
+@mock.patch(settings.ADAPTER_DATABASE + '.rename_table', mock.Mock())
+@mock.patch(settings.ADAPTER_DATABASE + '.drop_table', mock.Mock())
+@mock.patch(settings.ADAPTER_DATABASE + '.create_user_schema_if_not_exists', mock.Mock())
+class BatchTests(TestCase):
+
+    databases = ('default', 'data', 'tap', 'oai')
+
+    fixtures = (
+        'auth.json',
+        'metadata.json',
+        'jobs.json',
+        'queryjobs.json',
+        'examples.json'
+    )
+
+    def setUp(self):
+        self.user = User.objects.get(username='user')
+        self.client.login(username='user', password='user')
+
+        example = Example.objects.filter_by_access_level(self.user).first()
+        self.query = {
+            'query_language': example.query_language,
+            'query': example.query_string
+        }
+
+    def post_batch(self, queries):
+        return self.client.post(reverse('query:job-batch'), {'queries': queries}, content_type='application/json')
+
+    def post_batch_status(self, ids):
+        return self.client.post(reverse('query:job-batch-status'), {'ids': ids}, content_type='application/json')
+
+    def test_batch(self):
+        response = self.post_batch([
+            self.query,
+            dict(self.query, query='SELECT FROM WHERE'),
+            self.query
+        ])
+        self.assertEqual(response.status_code, 200)
+
+        # the invalid query is reported, the valid ones are run with different table names
+        results = response.json()
+        self.assertEqual(len(results), 3)
+        self.assertIn('errors', results[1])
+
+        jobs = QueryJob.objects.filter(id__in=[results[0]['id'], results[2]['id']])
+        self.assertEqual(jobs.count(), 2)
+        self.assertEqual(len(set(job.table_name for job in jobs)), 2)
+        self.assertTrue(all(job.owner == self.user for job in jobs))
+
+    def test_batch_table_name(self):
+        response = self.post_batch([
+            dict(self.query, table_name='batch'),
+            dict(self.query, table_name='batch')
+        ])
+        self.assertEqual(response.status_code, 200)
+
+        results = response.json()
+        self.assertIn('id', results[0])
+        self.assertIn('table_name', results[1]['errors'])
+
+    def test_batch_invalid(self):
+        self.assertEqual(self.post_batch([]).status_code, 400)
+        self.assertEqual(self.post_batch([{'query_language': 'adql-2.0'}]).status_code, 400)
+
+        with self.settings(QUERY_BATCH_SIZE=2):
+            self.assertEqual(self.post_batch([self.query] * 3).status_code, 400)
+
+    def test_batch_active_jobs(self):
+        active = QueryJob.objects.get_active(self.user).count()
+        count = QueryJob.objects.count()
+
+        # the whole batch is rejected if it exceeds the number of active jobs
+        with self.settings(QUERY_MAX_ACTIVE_JOBS={'user': active + 2}):
+            self.assertEqual(self.post_batch([self.query] * 3).status_code, 400)
+            self.assertEqual(QueryJob.objects.count(), count)
+
+            # invalid queries do not count as active jobs
+            response = self.post_batch([self.query, dict(self.query, query='SELECT FROM WHERE'), self.query])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(QueryJob.objects.count(), count + 2)
+
+    def test_batch_quota(self):
+        QueryJob.objects.filter(owner=self.user).exclude(phase=QueryJob.PHASE_ARCHIVED).update(size=2000)
+
+        with self.settings(QUERY_QUOTA={'user': '1kB'}):
+            self.assertEqual(self.post_batch([self.query]).status_code, 400)
+
+    def test_batch_status(self):
+        user_job, admin_job = [QueryJob.objects.create(
+            job_type=QueryJob.JOB_TYPE_INTERFACE,
+            owner=User.objects.get(username=username),
+            schema_name='daiquiri_user_' + username,
+            table_name='batch',
+            query_language='adql-2.0',
+            query='SELECT 1'
+        ) for username in ['user', 'admin']]
+
+        # the jobs of other owners are not returned
+        response = self.post_batch_status([str(user_job.id), str(admin_job.id)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([job['id'] for job in response.json()], [str(user_job.id)])
+
+    def test_batch_status_invalid(self):
+        self.assertEqual(self.post_batch_status(['not-a-uuid']).status_code, 400)
+        self.assertEqual(self.post_batch_status('not-a-list').status_code, 400)
+
+        with self.settings(QUERY_BATCH_SIZE=1):
+            self.assertEqual(self.post_batch_status([str(uuid.uuid4())] * 2).status_code, 400)
@@ -1,17 +1,19 @@
+import io
 import os
 import sys
 
 import requests
-
-from astropy.io.votable import parse_single_table
+from urllib3.exceptions import HTTPError
 
 from django.conf import settings
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
 from daiquiri.core.adapter import DatabaseAdapter
+from daiquiri.core.parsers import get_parser
 from daiquiri.core.utils import human2bytes, handle_file_upload
 from daiquiri.metadata.models import Table, Column
+from daiquiri.metadata.utils import get_column_catalog
 
 
 def get_format_config(format_key):
@@ -94,6 +96,30 @@ def get_max_active_jobs(user):
     return count
 
 
+def get_fair_share_weight(user):
+    weights = settings.QUERY_FAIR_SHARE_WEIGHTS
+
+    if not user or user.is_anonymous:
+        weight = float(weights.get('anonymous') or 1)
+
+    else:
+        weight = float(weights.get('user') or 1)
+
+        # apply weight for user
+        users = weights.get('users')
+        if users and users.get(user.username):
+            weight = max(weight, float(users.get(user.username)))
+
+        # apply weight for group
+        groups = weights.get('groups')
+        if groups:
+            for group in user.groups.all():
+                if groups.get(group.name):
+                    weight = max(weight, float(groups.get(group.name)))
+
+    return weight
+
+
 def fetch_user_schema_metadata(user, jobs):
 
     schema_name = get_user_schema_name(user)
@@ -181,7 +207,15 @@ def get_job_sources(job):
     return sources
 
 
-def get_job_column(job, display_column_name):
+def get_column_names(schema_name, table_name):
+    if schema_name.startswith(settings.QUERY_USER_SCHEMA_PREFIX) or schema_name == settings.TAP_UPLOAD:
+        # the tables of the users change all the time, so they are not in the column catalog
+        return DatabaseAdapter().fetch_column_names(schema_name, table_name)
+    else:
+        return [column['name'] for column in get_column_catalog(schema_name, table_name)['columns']]
+
+
+def get_job_column(job, display_column_name, catalogs=None):
     try:
         schema_name, table_name, column_name = \
             job.metadata['display_columns'][display_column_name]
@@ -193,45 +227,32 @@ def get_job_column(job, display_column_name):
         return DatabaseAdapter().fetch_column(schema_name, table_name, column_name)
 
     else:
-        # for regular schemas consult the metadata store
-        try:
-            column = Column.objects.get(
-                name=column_name,
-                table__name=table_name,
-                table__schema__name=schema_name
-            )
-
-            return {
-                'name': column.name,
-                'description': column.description,
-                'unit': column.unit,
-                'ucd': column.ucd,
-                'utype': column.utype,
-                'datatype': column.datatype,
-                'arraysize': column.arraysize,
-                'principal': column.principal,
-                'indexed': False,
-                'std': column.std
-            }
+        # for regular schemas consult the column catalog, which is filled from the metadata store,
+        # the catalogs can be shared between the calls for the columns of one job
+        if catalogs is None:
+            catalogs = {}
+
+        if (schema_name, table_name) not in catalogs:
+            catalogs[(schema_name, table_name)] = get_column_catalog(schema_name, table_name)
 
-        except Column.DoesNotExist:
-            return {}
+        return dict(catalogs[(schema_name, table_name)]['metadata'].get(column_name, {}))
 
 
 def get_job_columns(job):
     columns = []
+    catalogs = {}
 
     if job.phase == job.PHASE_COMPLETED:
         database_columns = DatabaseAdapter().fetch_columns(job.schema_name, job.table_name)
 
         for database_column in database_columns:
-            column = get_job_column(job, database_column['name'])
+            column = get_job_column(job, database_column['name'], catalogs)
             column.update(database_column)
             columns.append(column)
 
     else:
         for display_column in job.metadata['display_columns']:
-            columns.append(get_job_column(job, display_column))
+            columns.append(get_job_column(job, display_column, catalogs))
 
     return columns
 
@@ -259,43 +280,51 @@ def ingest_uploads(uploads, user):
     if uploads:
         for table_name, location in uploads.items():
             if location.startswith('http:') or location.startswith('https:'):
-                file_path = fetch_file(user, location)
+                ingest_url(settings.TAP_UPLOAD, table_name, location, drop_table=True)
             else:
-                file_path = location
-
-            ingest_table(settings.TAP_UPLOAD, table_name, file_path, drop_table=True)
+                ingest_table(settings.TAP_UPLOAD, table_name, location, drop_table=True)
 
 
-def fetch_file(user, url):
-    response = requests.get(url, allow_redirects=True)
+def ingest_url(schema_name, table_name, url, drop_table=False):
+    # the table is parsed and ingested while it is still downloaded, errors while reading
+    # the stream come from urllib3, the job fails with a ValueError in both cases
+    try:
+        with requests.get(url, allow_redirects=True, stream=True, timeout=settings.QUERY_UPLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
 
-    file_path = os.path.join(get_user_upload_directory(user), url.split('/')[-1])
-    with open(file_path, 'wb') as f:
-        f.write(response.content)
+            return ingest_stream(schema_name, table_name, io.BufferedReader(response.raw), drop_table=drop_table)
 
-    return file_path
+    except (requests.RequestException, HTTPError) as e:
+        raise ValueError('Upload %s could not be downloaded (%s).' % (url, e))
 
 
 def ingest_table(schema_name, table_name, file_path, drop_table=False):
+    try:
+        with open(file_path, 'rb') as stream:
+            return ingest_stream(schema_name, table_name, stream, drop_table=drop_table)
+    finally:
+        os.remove(file_path)
+
+
+def ingest_stream(schema_name, table_name, stream, drop_table=False):
     adapter = DatabaseAdapter()
 
-    table = parse_single_table(file_path, pedantic=False)
+    parser = get_parser(stream, batch_size=adapter.copy_chunk_size)
 
     columns = []
-    for field in table.fields:
+    for field in parser.fields:
         columns.append({
-            'name': field.name,
-            'datatype': field.datatype,
-            'ucd': field.ucd,
-            'unit': str(field.unit),
+            'name': field['name'],
+            'datatype': field['datatype'],
+            'ucd': field['ucd'],
+            'unit': field['unit'],
         })
 
     if drop_table:
         adapter.drop_table(schema_name, table_name)
 
     adapter.create_table(schema_name, table_name, columns)
-    adapter.insert_rows(schema_name, table_name, columns, table.array, table.array.mask)
-
-    os.remove(file_path)
+    adapter.copy_batches(schema_name, table_name, columns, parser)
 
     return columns
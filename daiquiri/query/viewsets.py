@@ -5,7 +5,9 @@ from collections import OrderedDict
 from sendfile import sendfile
 
 from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.http import Http404, FileResponse
+from django.utils.translation import gettext_lazy as _
 
 from rest_framework import viewsets, mixins, filters
 from rest_framework.response import Response
@@ -20,6 +22,7 @@ from rest_framework.authentication import (
 from daiquiri.core.viewsets import ChoicesViewSet, RowViewSetMixin
 from daiquiri.core.permissions import HasModelPermission
 from daiquiri.core.paginations import ListPagination
+from daiquiri.core.responses import CompressedFileResponse, send_file
 from daiquiri.core.utils import (
     get_client_ip,
     fix_for_json,
@@ -37,6 +40,8 @@ from .serializers import (
     QueryJobRetrieveSerializer,
     QueryJobCreateSerializer,
     QueryJobUpdateSerializer,
+    QueryJobBatchSerializer,
+    QueryJobBatchStatusSerializer,
     QueryJobUploadSerializer,
     QueryLanguageSerializer,
     ExampleSerializer,
@@ -45,7 +50,9 @@ from .serializers import (
     AsyncQueryJobSerializer
 )
 from .permissions import HasPermission
+from .process import check_quota, check_number_of_active_jobs
 from .utils import (
+    get_default_table_name,
     get_format_config,
     get_quota,
     get_user_upload_directory,
@@ -64,7 +71,7 @@ class StatusViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
     def list(self, request):
         return Response([{
             'guest': not request.user.is_authenticated,
-            'queued_jobs': None,
+            'queued_jobs': QueryJob.objects.filter_by_owner(request.user).filter(phase=QueryJob.PHASE_QUEUED).count(),
             'size': QueryJob.objects.get_size(request.user),
             'quota': get_quota(request.user)
         }])
@@ -123,7 +130,7 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
             return QueryJobSerializer
 
     def get_throttles(self):
-        if self.action == 'create':
+        if self.action in ['create', 'batch']:
             self.throttle_scope = 'query.create'
 
         return super(QueryJobViewSet, self).get_throttles()
@@ -185,6 +192,80 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
         serializer = QueryJobRetrieveSerializer(instance=job)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        serializer = QueryJobBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        owner = None if self.request.user.is_anonymous else self.request.user
+        client_ip = get_client_ip(self.request)
+        queries = serializer.validated_data['queries']
+
+        jobs = []
+        results = []
+        table_names = set()
+        for data in queries:
+            job = QueryJob(
+                job_type=QueryJob.JOB_TYPE_INTERFACE,
+                owner=owner,
+                run_id=data.get('run_id'),
+                table_name=data.get('table_name'),
+                query_language=data.get('query_language'),
+                query=data.get('query'),
+                queue=data.get('queue'),
+                client_ip=client_ip
+            )
+
+            # the queries of the batch are processed independently, errors are reported for each query
+            try:
+                job.process(check_limits=False)
+
+                # the default table names are created from the current time and can collide in a batch
+                while not data.get('table_name') and job.table_name in table_names:
+                    job.table_name = get_default_table_name()
+
+                if job.table_name in table_names:
+                    raise ValidationError({
+                        'table_name': [_('The table name is used more than once in this batch.')]
+                    })
+
+            except ValidationError as e:
+                results.append({'errors': e.detail})
+
+            else:
+                table_names.add(job.table_name)
+                jobs.append(job)
+                results.append(job)
+
+        # check quota and number of active jobs once for the valid jobs of the batch
+        if jobs:
+            check_quota(QueryJob(owner=owner))
+            check_number_of_active_jobs(QueryJob(owner=owner), len(jobs))
+
+        QueryJob.objects.create_batch(jobs, run=True)
+
+        return Response([
+            {'id': result.id, 'phase': result.phase} if isinstance(result, QueryJob) else result
+            for result in results
+        ])
+
+    @action(detail=False, methods=['post'], url_path='batch/status', url_name='batch-status')
+    def batch_status(self, request):
+        job_ids = request.data.get('ids')
+        if not isinstance(job_ids, list) or len(job_ids) > settings.QUERY_BATCH_SIZE:
+            raise ValidationError({
+                'ids': [_('A list of at most %d job ids is required.') % settings.QUERY_BATCH_SIZE]
+            })
+
+        try:
+            queryset = self.get_queryset().filter(id__in=job_ids)
+            serializer = QueryJobBatchStatusSerializer(queryset, many=True)
+            return Response(serializer.data)
+        except DjangoValidationError:
+            raise ValidationError({
+                'ids': [_('The job ids need to be UUIDs.')]
+            })
+
     @action(detail=True, methods=['put'])
     def abort(self, request, pk=None):
         try:
@@ -204,20 +285,21 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
             raise NotFound
 
         # get the row query params from the request
-        ordering, page, page_size, search, filters = self._get_query_params(job.columns())
+        ordering, page, page_size, search, filters, cursor = self._get_query_params(job.columns())
 
         # get column names from the request
         column_names = self.request.GET.getlist('column')
 
         # get the count and the rows from the job
-        count, results = job.rows(column_names, ordering, page, page_size, search, filters)
+        count, estimated, results, cursors = job.rows(column_names, ordering, page, page_size, search, filters, cursor)
 
         # return ordered dict to be send as json
         return Response(OrderedDict((
             ('count', count),
+            ('estimated', estimated),
             ('results', fix_for_json(results)),
-            ('next', self._get_next_url(page, page_size, count)),
-            ('previous', self._get_previous_url(page))
+            ('next', self._get_next_url(page, page_size, count, cursors)),
+            ('previous', self._get_previous_url(page, cursors))
         )))
 
     @action(detail=True, methods=['get'])
@@ -242,7 +324,8 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
             raise NotFound
 
         if download_job.phase == download_job.PHASE_COMPLETED and request.GET.get('download', True):
-            return sendfile(request, download_job.file_path, attachment=True)
+            download_job.touch()
+            return send_file(request, download_job.file_path, attachment=True, attachment_filename=download_job.file_name)
         else:
             return Response(download_job.phase)
 
@@ -255,29 +338,8 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
 
         format_key = request.data.get('format_key')
 
-        try:
-            download_job = DownloadJob.objects.get(job=job, format_key=format_key)
-
-            # check if the file was lost
-            if download_job.phase == download_job.PHASE_COMPLETED and \
-                    not os.path.isfile(download_job.file_path):
-
-                # set the phase back to pending so that the file is recreated
-                download_job.phase = download_job.PHASE_PENDING
-                download_job.process()
-                download_job.save()
-                download_job.run()
-
-        except DownloadJob.DoesNotExist:
-            download_job = DownloadJob(
-                job_type=QueryJob.JOB_TYPE_INTERFACE,
-                client_ip=get_client_ip(self.request),
-                job=job,
-                format_key=format_key
-            )
-            download_job.process()
-            download_job.save()
-            download_job.run()
+        # the download job is reused if the file exists or is currently created
+        download_job = DownloadJob.objects.create_download(job, format_key, client_ip=get_client_ip(self.request))
 
         return Response({
             'id': download_job.id
@@ -337,6 +399,33 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
             'id': archive_job.id
         })
 
+    @action(detail=True, methods=['post'], url_path='stream-archive', url_name='stream-archive')
+    def stream_archive(self, request, pk=None):
+        try:
+            job = self.get_queryset().get(pk=pk)
+        except QueryJob.DoesNotExist:
+            raise NotFound
+
+        column_name = request.data.get('column_name')
+
+        try:
+            archive_job = QueryArchiveJob.objects.get(job=job, column_name=column_name)
+
+            # check if the file was lost
+            if archive_job.phase == archive_job.PHASE_COMPLETED and os.path.isfile(archive_job.file_path):
+                # send the previously created file
+                return send_file(request, archive_job.file_path, attachment=True)
+        except QueryArchiveJob.DoesNotExist:
+            pass
+
+        # stream the zip file while it is created, without storing the archive job
+        archive_job = QueryArchiveJob(job=job, column_name=column_name)
+        archive_job.process()
+
+        response = FileResponse(archive_job.stream(), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="%s"' % os.path.basename(archive_job.file_path)
+        return response
+
     @action(detail=True, methods=['get'], url_path='stream/(?P<format_key>[A-Za-z0-9\-]+)', url_name='stream')
     def stream(self, request, pk=None, format_key=None):
         try:
@@ -352,16 +441,17 @@ class QueryJobViewSet(RowViewSetMixin, viewsets.ModelViewSet):
         try:
             download_job = DownloadJob.objects.get(job=job, format_key=format_key)
 
-            # check if the file was lost
-            if download_job.phase == download_job.PHASE_COMPLETED and os.path.isfile(download_job.file_path):
+            # check if the file was lost or is outdated
+            if download_job.is_cached:
                 # stream the previously created file
-                return sendfile(request, download_job.file_path)
+                download_job.touch()
+                return send_file(request, download_job.file_path, attachment_filename=download_job.file_name)
         except DownloadJob.DoesNotExist:
             pass
 
         # stream the table directly from the database
         file_name = '%s.%s' % (job.table_name, format_config['extension'])
-        response = FileResponse(job.stream(format_key), content_type=format_config['content_type'])
+        response = CompressedFileResponse(request, job.stream(format_key), content_type=format_config['content_type'])
         return response
 
 
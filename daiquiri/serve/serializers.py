@@ -18,5 +18,6 @@ class ColumnSerializer(serializers.ModelSerializer):
             'arraysize',
             'principal',
             'indexed',
+            'searchable',
             'std'
         )
@@ -26,7 +26,7 @@ class RowViewSet(RowViewSetMixin, viewsets.GenericViewSet):
 
         if user_columns:
             # get the row query params from the request
-            ordering, page, page_size, search, filters = self._get_query_params(user_columns)
+            ordering, page, page_size, search, filters, cursor = self._get_query_params(user_columns)
 
             # filter by input column names by the the allowed columns
             if column_names:
@@ -34,21 +34,25 @@ class RowViewSet(RowViewSetMixin, viewsets.GenericViewSet):
             else:
                 column_names = [column.name for column in user_columns]
 
+            # get the columns which are marked as searchable in the metadata, or search all columns
+            search_column_names = [column.name for column in user_columns if column.searchable and column.name in column_names] or None
+
             # get database adapter
             adapter = DatabaseAdapter()
 
             # query the database for the total number of rows
-            count = adapter.count_rows(schema_name, table_name, column_names, search, filters)
+            count, estimated = adapter.fetch_count(schema_name, table_name, column_names, search, filters, search_column_names)
 
             # query the paginated rowset
-            results = adapter.fetch_rows(schema_name, table_name, column_names, ordering, page, page_size, search, filters)
+            results, cursors = adapter.fetch_page(schema_name, table_name, column_names, ordering, page, page_size, search, filters, search_column_names, cursor)
 
             # return ordered dict to be send as json
             return Response(OrderedDict((
                 ('count', count),
+                ('estimated', estimated),
                 ('results', fix_for_json(results)),
-                ('next', self._get_next_url(page, page_size, count)),
-                ('previous', self._get_previous_url(page))
+                ('next', self._get_next_url(page, page_size, count, cursors)),
+                ('previous', self._get_previous_url(page, cursors))
             )))
 
         # if nothing worked, return 404